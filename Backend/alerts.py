@@ -0,0 +1,171 @@
+"""Stateful alert table for the master.
+
+An alert is a record keyed by (mac, type, site) that is opened when its
+condition starts, updated while it holds, optionally acknowledged by an
+admin and resolved when the condition clears; the record keeps the time of
+each. The server re-evaluates an agent's conditions when one of its
+reports is applied and inactivity on a timer, and passes the result to
+`Table.update()`, so nothing is recomputed when alerts are read.
+
+Every change stamps the record with the next number of a change sequence
+and moves it to the end of an ordered index, so the records changed after
+a cursor are a walk back from the end: a client that polls with the cursor
+of its last answer gets only what changed since, including resolutions.
+Resolved records are kept for `keep` seconds; a cursor older than what has
+been dropped since (or from before a restart) gets a full reset instead.
+`on_change`, if set, is called with every record as it changes, for
+pushing transitions to clients that do not poll.
+"""
+import collections
+import itertools
+import time
+
+KEEP = 3600     # seconds a resolved alert stays visible to `changes`
+
+
+class Table:
+    """Open and recently resolved alerts, indexed by key, id and change."""
+
+    def __init__(self, keep=KEEP, on_change=None):
+        self.keep      = keep
+        self.on_change = on_change
+        self.epoch     = format(int(time.time() * 1000), "x")   # tells cursors of another run apart
+        self._seq      = 0
+        self._ids      = itertools.count(1)
+        self._open     = {}                          # (mac, type, site) -> open record
+        self._by_mac   = {}                          # mac -> keys of its open alerts
+        self._changes  = collections.OrderedDict()   # id -> record, oldest change first
+        self._floor    = 0                           # newest seq of a record dropped from _changes
+
+    # ─── Writing ──────────────────────────────────────────────────────────────
+
+    def update(self, mac, kind, current, now=None, detail=None):
+        """Make `mac`'s open alerts of type `kind` match `current`.
+
+        `current` maps site (None for alert types without one) to the
+        record's fields (severity, message, details). Missing alerts are
+        opened, alerts whose fields changed are updated and open alerts not
+        in `current` are resolved. Returns the records that changed.
+
+        `detail` maps site to figures that move with every report (bytes so
+        far): they are stored on the record but not compared, so on their
+        own they do not count as a change.
+        """
+        now     = time.time() if now is None else now
+        changed = []
+        keys    = self._by_mac.get(mac, ())
+        for key in [k for k in keys if k[1] == kind and k[2] not in current]:
+            changed.append(self._resolve(key, now))
+        for site, fields in current.items():
+            rec   = self._open.get((mac, kind, site))
+            extra = detail.get(site, {}) if detail else {}
+            if rec is None:
+                rec = self._opened(mac, kind, site, {**fields, **extra}, now)
+            elif any(rec.get(k) != v for k, v in fields.items()):
+                rec.update(fields)
+                rec.update(extra)
+            else:
+                rec.update(extra)
+                continue
+            self._touch(rec, now)
+            changed.append(rec)
+        return changed
+
+    def acknowledge(self, alert_id, now=None):
+        """Mark an alert acknowledged; returns it, or None if unknown."""
+        rec = self._changes.get(alert_id)
+        if rec is not None and rec["acknowledged_at"] is None:
+            rec["acknowledged_at"] = time.time() if now is None else now
+            self._touch(rec, rec["acknowledged_at"])
+        return rec
+
+    def clear(self, now=None):
+        """Resolve every open alert."""
+        now = time.time() if now is None else now
+        return [self._resolve(key, now) for key in list(self._open)]
+
+    def prune(self, now=None):
+        """Forget resolved alerts older than `keep` seconds."""
+        now = time.time() if now is None else now
+        for rec in [r for r in self._changes.values()
+                    if r["resolved_at"] is not None and now - r["resolved_at"] > self.keep]:
+            del self._changes[rec["id"]]
+            self._floor = max(self._floor, rec["seq"])
+
+    # ─── Reading ──────────────────────────────────────────────────────────────
+
+    def cursor(self):
+        return f"{self.epoch}.{self._seq}"
+
+    def open(self, mac=None):
+        """Open alerts, oldest first (of one agent with `mac`)."""
+        if mac is not None:
+            return sorted((self._open[k] for k in self._by_mac.get(mac, ())),
+                          key=lambda r: r["id"])
+        return sorted(self._open.values(), key=lambda r: r["id"])
+
+    def changes(self, since):
+        """(reset, records) for a client whose last cursor was `since`.
+
+        Normally reset is False and records are those changed after the
+        cursor, oldest change first, resolved ones included. If the cursor
+        is unknown or older than a dropped record, reset is True and the
+        records are all open alerts, to replace whatever the client holds.
+        """
+        epoch, _, seq = (since or "").partition(".")
+        try:
+            seq = int(seq)
+        except ValueError:
+            seq = -1
+        if epoch != self.epoch or not self._floor <= seq <= self._seq:
+            return True, self.open()
+        out = []
+        for rec in reversed(self._changes.values()):
+            if rec["seq"] <= seq:
+                break
+            out.append(rec)
+        out.reverse()
+        return False, out
+
+    def macs(self):
+        """MACs with open alerts."""
+        return set(self._by_mac)
+
+    def __len__(self):
+        return len(self._open)
+
+    # ─── Internals ────────────────────────────────────────────────────────────
+
+    def _opened(self, mac, kind, site, fields, now):
+        rec = {
+            "id":              next(self._ids),
+            "mac":             mac,
+            "type":            kind,
+            "site":            site,
+            **fields,
+            "opened_at":       now,
+            "acknowledged_at": None,
+            "resolved_at":     None,
+        }
+        self._open[(mac, kind, site)] = rec
+        self._by_mac.setdefault(mac, set()).add((mac, kind, site))
+        return rec
+
+    def _resolve(self, key, now):
+        rec  = self._open.pop(key)
+        keys = self._by_mac[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self._by_mac[key[0]]
+        rec["resolved_at"] = now
+        self._touch(rec, now)
+        return rec
+
+    def _touch(self, rec, now):
+        self._seq         = self._seq + 1
+        rec["seq"]        = self._seq
+        rec["updated_at"] = now
+        self._changes[rec["id"]] = rec
+        self._changes.move_to_end(rec["id"])
+        if self.on_change is not None:
+            self.on_change(rec)
@@ -0,0 +1,137 @@
+"""Blacklist matching before and after the precomputed index (blacklist.py).
+
+Builds a blacklist of `--entries` domains and `--agents` agents that have
+each looked up `--names` DNS names (a few of them blacklisted), then times
+
+  scan        the old per-request check: every name of every agent against
+              every entry with a subdomain string test, as /alerts and
+              /check_blacklist ran it on each call (timed on `--sample`
+              agents and scaled to the fleet; the full run takes hours)
+  build       blacklist.Matcher over all entries (each save_blacklist)
+  recheck     every agent's names against the index (each save_blacklist)
+  ingest      one report's newly seen names against the index (each _ingest)
+  read        collecting the precomputed hits of every agent (each /alerts)
+
+    cd Backend && python3 benchmarks/blacklist_match.py
+    python3 benchmarks/blacklist_match.py --entries 100000 --agents 1000 --json out.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import string
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+import blacklist  # noqa: E402
+
+ENTRIES   = 100_000
+AGENTS    = 1000
+NAMES     = 150         # DNS names per agent (2-label, as the master keeps them)
+HIT_RATE  = 0.02        # share of an agent's names that are blacklisted
+NEW_NAMES = 5           # names per report not seen before
+SAMPLE    = 3           # agents the old scan is timed on
+TLDS      = ("com", "net", "org", "io", "info", "xyz", "co.uk", "ru", "de", "tv")
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _label(rng):
+    return "".join(rng.choices(string.ascii_lowercase + string.digits, k=rng.randint(5, 12)))
+
+def _is_subdomain(domain, parent):
+    # As in server.py
+    if not domain or not parent:
+        return False
+    return domain == parent or domain.endswith("." + parent)
+
+def old_check(dns_list, bl_domains):
+    # The check /alerts and /check_blacklist ran before the index
+    blocked = set()
+    for domain in dns_list:
+        if any(_is_subdomain(domain, bl) for bl in bl_domains):
+            blocked.add(domain)
+    return blocked
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--entries", type=int, default=ENTRIES)
+    ap.add_argument("--agents",  type=int, default=AGENTS)
+    ap.add_argument("--names",   type=int, default=NAMES)
+    ap.add_argument("--sample",  type=int, default=SAMPLE, help="agents the old scan is timed on")
+    ap.add_argument("--seed",    type=int, default=1)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    rng     = random.Random(args.seed)
+    entries = [f"{_label(rng)}.{rng.choice(TLDS)}" for _ in range(args.entries)]
+    # Some entries name a subdomain, which only matches names below it
+    entries += [f"{_label(rng)}.{e}" for e in rng.sample(entries, args.entries // 10)]
+    agents  = []
+    for _ in range(args.agents):
+        names = {f"{_label(rng)}.{rng.choice(TLDS)}" for _ in range(args.names)}
+        names.update(rng.sample(entries[:args.entries], max(1, int(args.names * HIT_RATE))))
+        agents.append(sorted(names))
+
+    matcher = blacklist.Matcher(entries)
+    sample  = agents[:args.sample]
+    assert all(old_check(a, entries) == matcher.blocked(a) for a in sample)
+
+    scan    = timed(lambda: [old_check(a, entries) for a in sample], repeat=1) * args.agents / len(sample)
+    build   = timed(lambda: blacklist.Matcher(entries))
+    recheck = timed(lambda: [matcher.blocked(a) for a in agents])
+    fresh   = [[f"{_label(rng)}.{rng.choice(TLDS)}" for _ in range(NEW_NAMES)] for _ in range(1000)]
+    ingest  = timed(lambda: [matcher.blocked(n) for n in fresh]) / len(fresh)
+    hits    = [{site: 0 for site in matcher.blocked(a)} for a in agents]
+    read    = timed(lambda: [list(h.items()) for h in hits])
+
+    results = {
+        "entries":         len(entries),
+        "agents":          args.agents,
+        "names_per_agent": args.names,
+        "scan_s":          round(scan, 2),
+        "build_ms":        round(build * 1e3, 1),
+        "recheck_ms":      round(recheck * 1e3, 1),
+        "ingest_us":       round(ingest * 1e6, 2),
+        "read_us":         round(read * 1e6, 1),
+        "speedup":         round(scan / read),
+    }
+    print(f"{len(entries)} blacklist entries, {args.agents} agents x {args.names} names")
+    print(f"  old scan per /alerts call   {results['scan_s']:>10} s   (from {len(sample)} agents)")
+    print(f"  build index                 {results['build_ms']:>10} ms  per blacklist save")
+    print(f"  recheck all agents          {results['recheck_ms']:>10} ms  per blacklist save")
+    print(f"  check {NEW_NAMES} new names           {results['ingest_us']:>10} us  per report")
+    print(f"  read precomputed hits       {results['read_us']:>10} us  per /alerts call")
+
+    if args.json:
+        out = {
+            "commit":    _commit(),
+            "python":    platform.python_version(),
+            "machine":   platform.machine(),
+            "timestamp": round(time.time()),
+            "seed":      args.seed,
+            "results":   results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=2)
+        print(f"\nwrote {args.json}")
+
+if __name__ == "__main__":
+    main()
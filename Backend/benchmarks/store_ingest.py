@@ -0,0 +1,166 @@
+"""Ingest throughput of the persistent usage store (store.py) at fleet scale.
+
+Simulates `--agents` agents each reporting every `--interval` seconds with
+`--procs` processes, and pushes `--minutes` of their reports through
+Store.add() as fast as it accepts them (into an unbounded queue, so the
+writer runs flat out), twice: into an empty database and into one already
+holding `--prefill` reports. For each run it prints
+
+  add p50/p99 µs   time the request thread spends in Store.add()
+  reports/s        reports the writer thread commits per second
+  rows/s           the same in rows (one per report plus one per process)
+  headroom         reports/s over what the fleet sends (agents / interval)
+  q 1h / q 24h µs  agent_totals() for one agent over the last hour / day
+
+The two runs should show the same add latency and writer rate: inserts
+only touch the current day's partition, and the prefilled reports share
+that day (the worst case).
+
+    cd Backend && python3 benchmarks/store_ingest.py
+    python3 benchmarks/store_ingest.py --agents 1000 --prefill 500000 --json out.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+import store      # noqa: E402
+
+AGENTS   = 1000
+INTERVAL = 5        # seconds between an agent's reports
+PROCS    = 10       # processes per report
+MINUTES  = 10       # simulated minutes pushed per run
+PREFILL  = 300_000  # reports already in the database for the second run
+NAMES    = [f"proc{i}" for i in range(200)]
+
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _macs(n):
+    return [":".join(f"{b:02x}" for b in (0x02, 0, (i >> 16) & 255, (i >> 8) & 255, i & 255, 1))
+            for i in range(n)]
+
+def reports(rng, macs, start, minutes, interval, procs):
+    """Reports of every agent, in time order, starting at `start`."""
+    ident = {"hostname": "bench", "username": "bench", "ip": "10.0.0.1", "os": "Linux"}
+    steps = int(minutes * 60 / interval)
+    for k in range(steps):
+        t = start + k * interval
+        for i, mac in enumerate(macs):
+            up, down = rng.random() * 1e6, rng.random() * 4e6
+            yield (mac, t + i * interval / len(macs), ident, up, down, interval,
+                   [(rng.choice(NAMES), up / procs, down / procs) for _ in range(procs)])
+
+def prefill(path, macs, n, interval, procs, now):
+    """Write `n` reports ending at `now` straight through the writer path."""
+    s    = store.Store(path)
+    db   = s.open_writer()
+    rng  = random.Random(2)
+    rows = reports(rng, macs, now - n / len(macs) * interval, n / len(macs) * interval / 60,
+                   interval, procs)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= 5000:
+            s.write(db, batch)
+            batch = []
+    if batch:
+        s.write(db, batch)
+    db.close()
+
+def run(path, macs, args, now):
+    s = store.Store(path, queue_max=0)     # unbounded: the whole run is queued up front
+    s.start()
+    rng   = random.Random(1)
+    lat   = []
+    t0    = time.perf_counter()
+    count = 0
+    for row in reports(rng, macs, now, args.minutes, args.interval, args.procs):
+        a = time.perf_counter_ns()
+        s.add(*row)
+        lat.append(time.perf_counter_ns() - a)
+        count += 1
+    pushed = time.perf_counter() - t0
+    s.flush(timeout=600)
+    elapsed = time.perf_counter() - t0
+
+    lat.sort()
+    rate = s.written / elapsed
+    q1h, q24h = [], []
+    end = now + args.minutes * 60
+    for mac in rng.sample(macs, min(20, len(macs))):
+        a = time.perf_counter(); s.agent_totals(end - 3600,  end, mac); q1h.append(time.perf_counter() - a)
+        a = time.perf_counter(); s.agent_totals(end - 86400, end, mac); q24h.append(time.perf_counter() - a)
+    return {
+        "reports":       count,
+        "add_p50_us":    round(lat[len(lat) // 2] / 1000, 2),
+        "add_p99_us":    round(lat[int(len(lat) * 0.99)] / 1000, 2),
+        "push_s":        round(pushed, 2),
+        "reports_per_s": round(rate),
+        "rows_per_s":    round(rate * (1 + args.procs)),
+        "headroom":      round(rate / (len(macs) / args.interval), 1),
+        "query_1h_us":   round(sorted(q1h)[len(q1h) // 2] * 1e6),
+        "query_24h_us":  round(sorted(q24h)[len(q24h) // 2] * 1e6),
+        "db_mib":        round(s.size() / 2**20, 1),
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--agents",   type=int,   default=AGENTS)
+    ap.add_argument("--interval", type=float, default=INTERVAL)
+    ap.add_argument("--procs",    type=int,   default=PROCS)
+    ap.add_argument("--minutes",  type=float, default=MINUTES, help="simulated minutes per run")
+    ap.add_argument("--prefill",  type=int,   default=PREFILL, help="reports stored before run 2")
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    macs    = _macs(args.agents)
+    now     = time.time() - args.minutes * 60
+    results = []
+    print(f"{args.agents} agents every {args.interval:g} s with {args.procs} processes "
+          f"= {args.agents / args.interval:.0f} reports/s")
+    print(f"{'database':<16} {'reports':>8} {'add p50 µs':>10} {'add p99 µs':>10} "
+          f"{'reports/s':>10} {'rows/s':>9} {'headroom':>8} "
+          f"{'q 1h µs':>8} {'q 24h µs':>8} {'MiB':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, n in (("empty", 0), (f"{args.prefill} stored", args.prefill)):
+            path = os.path.join(tmp, f"{n}.db")
+            if n:
+                prefill(path, macs, n, args.interval, args.procs, now)
+            r = {"database": label, "prefill": n, **run(path, macs, args, now)}
+            results.append(r)
+            print(f"{label:<16} {r['reports']:>8} {r['add_p50_us']:>10} {r['add_p99_us']:>10} "
+                  f"{r['reports_per_s']:>10} {r['rows_per_s']:>9} {r['headroom']:>7}x "
+                  f"{r['query_1h_us']:>8} {r['query_24h_us']:>8} "
+                  f"{r['db_mib']:>6}")
+
+    if args.json:
+        out = {
+            "commit":    _commit(),
+            "python":    platform.python_version(),
+            "sqlite":    store.sqlite3.sqlite_version,
+            "machine":   platform.machine(),
+            "timestamp": round(time.time()),
+            "agents":    args.agents,
+            "interval":  args.interval,
+            "procs":     args.procs,
+            "results":   results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=2)
+        print(f"\nwrote {args.json}")
+
+if __name__ == "__main__":
+    main()
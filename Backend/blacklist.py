@@ -0,0 +1,34 @@
+"""Blacklist matching for the master.
+
+A DNS name is blacklisted when it or one of its parent domains is on the
+list: an entry "example.com" covers "example.com" and "video.example.com",
+but not "badexample.com". The entries sit in a hash set and a name is
+looked up once per label suffix, so a check costs a few set lookups
+however long the blacklist is; it is rebuilt only when the blacklist is
+saved.
+"""
+
+
+class Matcher:
+    """Blacklisted domains (lower case, no trailing dot), indexed for lookup."""
+
+    def __init__(self, domains):
+        self._entries = frozenset(d for d in domains if d)
+
+    def match(self, domain):
+        """The entry covering `domain` (the most specific one), or None."""
+        while domain:
+            if domain in self._entries:
+                return domain
+            dot = domain.find(".")
+            if dot < 0:
+                return None
+            domain = domain[dot + 1:]
+        return None
+
+    def blocked(self, domains):
+        """The subset of `domains` that the blacklist covers."""
+        return {d for d in domains if self.match(d) is not None}
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,163 @@
+"""Per-agent rate history for the master, in fixed-size ring buffers.
+
+Every series (an agent's interface rates, or one of its processes) is kept
+at several resolutions at once. Each resolution is a ring of `size`
+buckets of `step` seconds, stored in flat arrays; a bucket holds the
+time-weighted sum of upload and download rates and the seconds it covers,
+so its average is exact however many samples fell into it. A sample is
+added to the current bucket of every ring when it arrives, which is the
+whole rollup: nothing is recomputed later. Memory per series is fixed at
+16 bytes per bucket.
+
+Queries read the finest ring that still covers the requested start and
+can thin the result to a point budget with LTTB (largest triangle three
+buckets).
+"""
+from array import array
+
+RESOLUTIONS = ((5, 720), (60, 1440), (900, 672))    # (seconds per bucket, buckets): 1 h, 1 day, 1 week
+
+
+class Ring:
+    """`size` buckets of `step` seconds, indexed by bucket number mod `size`."""
+
+    __slots__ = ("step", "size", "bucket", "seconds", "up", "down", "last")
+
+    def __init__(self, step, size):
+        self.step    = step
+        self.size    = size
+        self.bucket  = array("i", [-1]) * size      # bucket number held by each slot
+        self.seconds = array("f", bytes(4 * size))  # seconds of samples in the bucket
+        self.up      = array("f", bytes(4 * size))  # Σ rate × seconds
+        self.down    = array("f", bytes(4 * size))
+        self.last    = -1                           # newest bucket number written
+
+    def add(self, t, up, down, seconds):
+        b = int(t // self.step)
+        if b <= self.last - self.size:
+            return                                  # older than anything the ring keeps
+        i = b % self.size
+        if self.bucket[i] != b:
+            self.bucket[i]  = b
+            self.seconds[i] = 0.0
+            self.up[i]      = 0.0
+            self.down[i]    = 0.0
+        self.seconds[i] += seconds
+        self.up[i]      += up   * seconds
+        self.down[i]    += down * seconds
+        if b > self.last:
+            self.last = b
+
+    def oldest(self):
+        """Start time of the oldest bucket the ring can still hold."""
+        return (self.last - self.size + 1) * self.step
+
+    def points(self, start, end):
+        """[(bucket start, avg upload, avg download)] for buckets in [start, end]."""
+        first = max(int(start // self.step), self.last - self.size + 1)
+        last  = min(int(end // self.step), self.last)
+        out = []
+        for b in range(first, last + 1):
+            i = b % self.size
+            if self.bucket[i] == b and self.seconds[i]:
+                s = self.seconds[i]
+                out.append((b * self.step, self.up[i] / s, self.down[i] / s))
+        return out
+
+
+class Series:
+    """One rate series at every resolution in `RESOLUTIONS`."""
+
+    __slots__ = ("rings", "updated")
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self.rings   = [Ring(step, size) for step, size in resolutions]
+        self.updated = 0.0
+
+    def add(self, t, up, down, seconds):
+        for ring in self.rings:
+            ring.add(t, up, down, seconds)
+        self.updated = max(self.updated, t)
+
+    def query(self, start, end):
+        """(step, points) from the finest ring that reaches back to `start`
+        (give or take the bucket `start` falls in)."""
+        for ring in self.rings:
+            if ring.last >= 0 and ring.oldest() <= start + ring.step:
+                break
+        return ring.step, ring.points(start, end)
+
+
+class AgentHistory:
+    """Interface rates of one agent plus up to `max_procs` of its processes.
+
+    When a new process would exceed `max_procs`, the one updated longest
+    ago is dropped.
+    """
+
+    def __init__(self, max_procs=8):
+        self.max_procs = max_procs
+        self.total     = Series()
+        self.procs     = {}                 # name -> Series
+
+    def add_report(self, t, usage, series, processes, covered):
+        """Record one report ending at `t` that covers `covered` seconds.
+
+        `series` holds per-step rates ({"step", "upload", "download"}) and
+        is used for the interface history when present; otherwise the
+        report's average `usage` is.
+        """
+        step = (series or {}).get("step") or 0
+        ups  = (series or {}).get("upload")   or []
+        if step and ups:
+            downs = series.get("download") or [0] * len(ups)
+            n     = len(ups)
+            for k, (up, down) in enumerate(zip(ups, downs)):
+                self.total.add(t - (n - k - 0.5) * step, up, down, step)
+        else:
+            self.total.add(t - covered / 2, usage.get("upload", 0), usage.get("download", 0),
+                           covered)
+
+        mid = t - covered / 2
+        for proc in processes:
+            name = proc.get("name")
+            if not name:
+                continue
+            s = self.procs.get(name)
+            if s is None:
+                if len(self.procs) >= self.max_procs:
+                    del self.procs[min(self.procs, key=lambda k: self.procs[k].updated)]
+                s = self.procs[name] = Series()
+            speed = proc.get("speed", {})
+            s.add(mid, speed.get("upload", 0), speed.get("download", 0), covered)
+
+
+def lttb(points, n):
+    """Thin `points` [(t, up, down)] to `n` with largest-triangle-three-buckets.
+
+    Points are chosen on upload + download, so both directions keep the
+    same timestamps; the first and last points are always kept.
+    """
+    if n >= len(points):
+        return list(points)
+    if n < 3:
+        return [points[0], points[-1]][:max(n, 1)]
+    y     = [p[1] + p[2] for p in points]
+    every = (len(points) - 2) / (n - 2)
+    out   = [points[0]]
+    a     = 0
+    for i in range(n - 2):
+        lo, hi   = int(i * every) + 1, int((i + 1) * every) + 1
+        nlo, nhi = hi, min(int((i + 2) * every) + 1, len(points))
+        avg_t = sum(p[0] for p in points[nlo:nhi]) / (nhi - nlo)
+        avg_y = sum(y[nlo:nhi]) / (nhi - nlo)
+        at, ay = points[a][0], y[a]
+        best, best_area = lo, -1.0
+        for j in range(lo, hi):
+            area = abs((at - avg_t) * (y[j] - ay) - (at - points[j][0]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(points[best])
+        a = best
+    out.append(points[-1])
+    return out
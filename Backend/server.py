@@ -1,12 +1,26 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+import collections
+import ipaddress
 import json
+import logging
+import logging.handlers
+import os
+import queue
 import re
+import sys
 import time
 import threading
 import functools
 import requests
 
+import alerts
+import blacklist
+import history
+import store
+import stream
+import wire
+
 app = Flask(__name__)
 CORS(app)
 
@@ -18,12 +32,120 @@ CONFIG_FILE    = "config.json"
 MAC_FILE = 'mac_addresses.json'
 collecting = True
 
+# Agent health thresholds (see /health)
+HEALTH_CPU_MAX          = 80.0      # % of one core
+HEALTH_UNATTRIBUTED_MAX = 0.2       # share of packets without a process
+HEALTH_CALLBACK_P99_US  = 1000.0    # per-packet handling time
+
+# Report directives sent back to agents (see _directives)
+REPORT_INTERVAL   = 5       # seconds between reports, normal load
+REPORT_LIVE       = 2       # agent open in the dashboard
+REPORT_BURST      = 2       # usage well above the agent's own average
+REPORT_IDLE       = 30      # usage below IDLE_BPS
+REPORT_MAX        = 60      # cap when stretching for fleet load
+TOP_N_DEFAULT     = 10
+TOP_N_LIVE        = 25
+TOP_N_IDLE        = 5
+IDLE_BPS          = 2048    # up + down B/s under which an agent is idle
+BURST_FACTOR      = 4       # usage this many times the average is a burst
+LOAD_EWMA         = 0.2     # weight of the newest report in an agent's average
+LIVE_VIEW_TTL     = 10      # seconds a /data/<mac> poll keeps an agent live
+FLEET_REPORTS_MAX = 100     # reports/s the whole fleet is allowed to send
+FLEET_WINDOW      = 10      # seconds between fleet load recalculations
+INACTIVE_AFTER    = 10      # seconds without a report (at least 2 intervals)
+
+# Fleet-wide top destinations (see /destinations)
+TOP_DESTINATIONS  = 20
+
+# Rate history (see history.py and /history/<mac>)
+HISTORY_PROCS     = 8       # processes with their own history, per agent
+HISTORY_POINTS    = 300     # default point budget of a /history response
+HISTORY_WINDOW    = 3600    # default span of a /history response, seconds
+
+# Persistent usage store (see store.py and /report)
+STORE_FILE        = "usage.db"
+STORE_RAW_DAYS    = 7       # days kept per report before rolling up to hours
+STORE_HOURLY_DAYS = 400     # days of hourly totals kept
+REPORT_TOP_N      = 10      # default agents/processes in a /report response
+
+# Ingest pipeline (see _ingest_worker)
+INGEST_QUEUE_MAX  = 5000    # reports (or whole batches) waiting; /usage answers 503 beyond
+INGEST_BATCH      = 50      # reports applied per lock acquisition, at most (~7 ms held)
+INGEST_RETRY      = 2       # Retry-After of a 503, seconds
+LOG_QUEUE_MAX     = 10000   # log lines waiting for the console; more are dropped
+USAGE_BATCH_MAX   = 500     # reports in one /usage/batch request
+USAGE_BATCH_WAIT  = 3       # seconds /usage/batch waits for its reports; under the agents' 5 s timeout
+DEDUP_WINDOW      = 64      # recent report timestamps kept per agent to spot duplicates
+
+# Alert table (see alerts.py and /alerts)
+ALERT_TICK        = 2       # seconds between inactivity checks
+ALERT_KEEP        = 3600    # seconds a resolved alert is still returned to ?since= polls
+
+# Dashboard push stream (see stream.py and /stream)
+STREAM_MAX        = 20      # /stream clients at once
+STREAM_INTERVAL   = 1       # seconds between two events to one client; changes in between merge
+STREAM_KEEPALIVE  = 5       # seconds without changes before a keepalive (< LIVE_VIEW_TTL)
+STREAM_RETRY      = 3       # seconds a browser waits before reconnecting
+
 # -----------------------------------------------------------------------
 # State
 # -----------------------------------------------------------------------
 lock             = threading.Lock()
+policy_lock      = threading.Lock()   # report_policy and _fleet, so /usage never waits on an ingest batch
+wire_lock        = threading.Lock()   # wire_sessions
 agent_data       = {}   # mac -> latest payload
+wire_sessions    = {}   # mac -> binary report decoder state (under wire_lock)
+recent_reports   = {}   # mac -> deque of the last DEDUP_WINDOW report timestamps
 _blacklist_cache = None
+report_policy    = {}   # mac -> {"avg", "base", "interval", "seen"} for directives
+live_views       = {}   # mac -> time the dashboard last polled /data/<mac>
+agent_history    = {}   # mac -> history.AgentHistory
+blacklist_hits   = {}   # mac -> {blacklisted DNS name it looked up: bytes to it}
+alert_table      = alerts.Table(ALERT_KEEP)   # open and recently resolved alerts
+stream_hub       = stream.Hub()
+stream_watch     = {}   # /stream subscriber id -> mac open in its dashboard
+_fleet           = {"at": 0.0, "stretch": 1.0}
+ingest_queue     = queue.Queue(INGEST_QUEUE_MAX)   # (reports, statuses, done) for _ingest_worker
+ingest_stats     = {"accepted": 0, "rejected": 0,                 # under policy_lock
+                    "applied": 0, "batches": 0, "batch_max": 0,  # under lock
+                    "log_dropped": 0}                            # under policy_lock
+
+# -----------------------------------------------------------------------
+# Logging
+# -----------------------------------------------------------------------
+
+class _FieldFormatter(logging.Formatter):
+    """`HH:MM:SS event key=value ...` from the record's `fields`."""
+
+    def format(self, record):
+        fields = getattr(record, "fields", {})
+        return " ".join([self.formatTime(record, "%H:%M:%S"), record.getMessage(),
+                         *(f"{k}={v}" for k, v in fields.items())])
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the console thread; never block the caller."""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with policy_lock:
+                ingest_stats["log_dropped"] += 1
+
+log_queue = queue.Queue(LOG_QUEUE_MAX)
+log       = logging.getLogger("master")
+log.setLevel(logging.INFO)
+log.propagate = False
+log.addHandler(_DroppingQueueHandler(log_queue))
+_console = logging.StreamHandler(sys.stdout)
+_console.setFormatter(_FieldFormatter())
+_log_listener = logging.handlers.QueueListener(log_queue, _console)
+
+def _log(event, **fields):
+    log.info(event, extra={"fields": fields})
+
+# Created here rather than with the other state: it logs through _log.
+usage_store = store.Store(STORE_FILE, STORE_RAW_DAYS, STORE_HOURLY_DAYS, log=_log)
 
 
 # -----------------------------------------------------------------------
@@ -48,9 +170,20 @@ def load_blacklist():
     return _blacklist_cache
 
 def save_blacklist(bl):
-    global _blacklist_cache
+    global _blacklist_cache, blacklist_matcher
     _blacklist_cache = bl
     save_json(BLACKLIST_FILE, bl)
+    # Only here does the index change; re-check every agent's names once.
+    matcher = blacklist.Matcher(bl["domains"])
+    with lock:
+        blacklist_matcher = matcher
+        for mac, d in agent_data.items():
+            hits = blacklist_hits.get(mac, {})
+            blacklist_hits[mac] = {
+                site: hits[site] if site in hits else _domain_bytes(d["domains"], site)
+                for site in matcher.blocked(d["dns"])
+            }
+            _evaluate_alerts(mac, time.time())
 
 def load_config():
     return load_json(CONFIG_FILE, {"total_usage_limit": 100 * 1024 * 1024})
@@ -60,6 +193,7 @@ def save_config(cfg):
 
 config = load_config()
 mac_addresses = load_json(MAC_FILE, [])
+blacklist_matcher = blacklist.Matcher(load_blacklist()["domains"])
 
 # -----------------------------------------------------------------------
 # Helpers
@@ -84,13 +218,22 @@ def _is_subdomain(domain, parent):
         return False
     return domain == parent or domain.endswith("." + parent)
 
-def _check_blacklist_dns(dns_list, bl_domains):
-    """Return set of blacklisted domains found in agent dns list."""
-    blocked = set()
-    for domain in dns_list:
-        if any(_is_subdomain(domain, bl) for bl in bl_domains):
-            blocked.add(domain)
-    return blocked
+def _domain_bytes(domains, site):
+    """Total bytes the agent attributed to `site` and its subdomains."""
+    return sum(
+        d["total"]["upload"] + d["total"]["download"]
+        for d in domains
+        if _is_subdomain(_normalize_domain(d.get("name")), site)
+    )
+
+def _peak(raw):
+    """Highest per-step rate in the report's series, else its average rate."""
+    usage  = raw.get("usage", {})
+    series = raw.get("series") or {}
+    return {
+        "upload":   max(series.get("upload")   or [usage.get("upload",   0)]),
+        "download": max(series.get("download") or [usage.get("download", 0)]),
+    }
 
 @functools.lru_cache(maxsize=512)
 def _get_mac_vendor(mac):
@@ -109,7 +252,9 @@ def _get_mac_vendor(mac):
 # Agent ingestion
 # -----------------------------------------------------------------------
 
-def _ingest(raw):
+def _prepare(raw):
+    """(mac, 2-label DNS names, timestamp) of a report, or None if the MAC
+    is invalid. Needs no lock."""
     mac = _normalize_mac(raw.get("mac", ""))
     if not re.match(r"^([0-9a-f]{2}:){5}[0-9a-f]{2}$", mac):
         return None
@@ -123,31 +268,231 @@ def _ingest(raw):
         if d2 and not any(d2.endswith(s) for s in IGNORE_SUFFIXES):
             incoming_dns.add(d2)
 
-    with lock:
-        # Accumulate dns across intervals
-        existing_dns = set(agent_data[mac]["dns"]) if mac in agent_data else set()
-        merged_dns   = existing_dns | incoming_dns
-
-        agent_data[mac] = {
-            "hostname":  raw.get("name",     "Unknown"),
-            "username":  raw.get("username", "Unknown"),
-            "ip":        raw.get("ip",       "Unknown"),
-            "mac":       mac,
-            "os":        raw.get("os",       "Unknown"),
-            "timestamp": raw.get("timestamp", time.time()),
-            "state":     raw.get("state",    "sending"),
-            "usage": {
-                "upload":   raw.get("usage",       {}).get("upload",   0),
-                "download": raw.get("usage",       {}).get("download", 0),
-            },
-            "total_usage": {
-                "upload":   raw.get("total_usage", {}).get("upload",   0),
-                "download": raw.get("total_usage", {}).get("download", 0),
-            },
-            "process": raw.get("process", []),
-            "dns":     list(merged_dns),
-        }
-    return mac
+    return mac, incoming_dns, raw.get("timestamp", time.time())
+
+def _ingest(mac, raw, incoming_dns, timestamp):
+    """Apply one prepared report; the caller holds `lock`.
+
+    Returns "ok", "stale" for a report older than the agent's current state
+    (recorded in history and the store, but only its domains reach
+    agent_data) or "duplicate" for a timestamp already applied, which is
+    dropped so a replay is never counted twice. Timestamps compare in whole
+    seconds, as binary reports carry them.
+    """
+    recent = recent_reports.get(mac)
+    if recent is None:
+        recent = recent_reports[mac] = collections.deque(maxlen=DEDUP_WINDOW)
+    if int(timestamp) in recent:
+        return "duplicate"
+    recent.append(int(timestamp))
+
+    covered = _covered(mac, raw)
+    _record_history(mac, raw, timestamp, covered)
+    _store_report(mac, raw, timestamp, covered)
+
+    # Accumulate dns across intervals
+    existing_dns = set(agent_data[mac]["dns"]) if mac in agent_data else set()
+    merged_dns   = existing_dns | incoming_dns
+
+    # Only names not seen before need checking against the blacklist
+    hits = blacklist_hits.setdefault(mac, {})
+    for site in blacklist_matcher.blocked(incoming_dns - existing_dns):
+        hits.setdefault(site, None)
+
+    # Late report (e.g. replayed from an agent's spool) — keep the newer
+    # state and only pick up the domains it saw
+    if mac in agent_data and timestamp < agent_data[mac]["timestamp"]:
+        agent_data[mac]["dns"] = list(merged_dns)
+        for site in [s for s, b in hits.items() if b is None]:
+            hits[site] = _domain_bytes(agent_data[mac]["domains"], site)
+        _evaluate_alerts(mac, time.time())
+        _push_agent(mac)
+        return "stale"
+
+    # Bytes to each hit follow the newest report's domain totals
+    for site in hits:
+        hits[site] = _domain_bytes(raw.get("domains", []), site)
+
+    agent_data[mac] = {
+        "hostname":  raw.get("name",     "Unknown"),
+        "username":  raw.get("username", "Unknown"),
+        "ip":        raw.get("ip",       "Unknown"),
+        "mac":       mac,
+        "os":        raw.get("os",       "Unknown"),
+        "timestamp": timestamp,
+        "state":     raw.get("state",    "sending"),
+        "usage": {
+            "upload":   raw.get("usage",       {}).get("upload",   0),
+            "download": raw.get("usage",       {}).get("download", 0),
+        },
+        "total_usage": {
+            "upload":   raw.get("total_usage", {}).get("upload",   0),
+            "download": raw.get("total_usage", {}).get("download", 0),
+        },
+        "process": raw.get("process", []),
+        "dns":     list(merged_dns),
+        "domains": raw.get("domains", []),
+        "flows":   raw.get("flows", []),
+        "sampling": raw.get("sampling", {"rate": 1, "error": 0.0}),
+        "agent_health": raw.get("agent_health", {}),
+        "series":  raw.get("series", {}),
+        "peak":    _peak(raw),
+        "destinations": raw.get("destinations", {}),
+    }
+    _evaluate_alerts(mac, time.time())
+    _push_agent(mac)
+    return "ok"
+
+def _covered(mac, raw):
+    """Seconds a report covers: its per-second series if it has one, else
+    the interval the agent was told to use. Caller holds `lock`."""
+    series  = raw.get("series") or {}
+    covered = len(series.get("upload") or []) * (series.get("step") or 0)
+    return covered or report_policy.get(mac, {}).get("interval", REPORT_INTERVAL)
+
+def _record_history(mac, raw, timestamp, covered):
+    """Add a report to the agent's rate history; the caller holds `lock`.
+
+    Late (replayed) reports land in their own, older buckets.
+    """
+    h = agent_history.get(mac)
+    if h is None:
+        h = agent_history[mac] = history.AgentHistory(HISTORY_PROCS)
+    h.add_report(timestamp, raw.get("usage", {}), raw.get("series") or {},
+                 raw.get("process", []), covered)
+
+def _store_report(mac, raw, timestamp, covered):
+    """Queue the report's bytes for the persistent store (never blocks)."""
+    series = raw.get("series") or {}
+    if series.get("step") and series.get("upload"):
+        up   = sum(series["upload"])           * series["step"]
+        down = sum(series.get("download", [])) * series["step"]
+    else:
+        usage = raw.get("usage", {})
+        up, down = usage.get("upload", 0) * covered, usage.get("download", 0) * covered
+    procs = []
+    for p in raw.get("process", []):
+        if p.get("name"):
+            speed = p.get("speed", {})
+            procs.append((p["name"], speed.get("upload", 0) * covered,
+                          speed.get("download", 0) * covered))
+    identity = {"hostname": raw.get("name", "Unknown"), "username": raw.get("username", "Unknown"),
+                "ip": raw.get("ip", "Unknown"), "os": raw.get("os", "Unknown")}
+    usage_store.add(mac, timestamp, identity, up, down, covered, procs)
+
+def _ingest_worker():
+    """Apply queued reports under one `lock` acquisition per batch: whole
+    /usage/batch requests, and single /usage reports gathered up to
+    INGEST_BATCH. Request threads only validate and enqueue."""
+    while True:
+        units = [ingest_queue.get()]
+        count = len(units[0][0])
+        while count < INGEST_BATCH:
+            try:
+                units.append(ingest_queue.get_nowait())
+            except queue.Empty:
+                break
+            count += len(units[-1][0])
+        prepared = [[_prepare(raw) for raw in reports] for reports, _, _ in units]
+
+        lines = []
+        with lock:
+            for (reports, statuses, _), preps in zip(units, prepared):
+                for raw, p in zip(reports, preps):
+                    status = "invalid"
+                    if not collecting:
+                        status = "ignored"  # stopped while this waited — drop it like /usage would
+                    elif p:
+                        mac, dns, timestamp = p
+                        try:
+                            status = _ingest(mac, raw, dns, timestamp)
+                        except Exception as e:
+                            status = "failed"
+                            lines.append(("ingest_failed", {"mac": mac, "error": repr(e)}))
+                        if status in ("ok", "stale"):
+                            usage = raw.get("usage", {})
+                            lines.append(("report", {
+                                "mac":   mac,
+                                "host":  f"{raw.get('username', 'Unknown')}@{raw.get('name', 'Unknown')}",
+                                "ip":    raw.get("ip", "Unknown"),
+                                "os":    raw.get("os", "Unknown"),
+                                "up":    f"{usage.get('upload', 0):.0f}",
+                                "down":  f"{usage.get('download', 0):.0f}",
+                                "procs": len(raw.get("process", [])),
+                                "dns":   len(dns),
+                                "next":  report_policy.get(mac, {}).get("interval", REPORT_INTERVAL),
+                                **({"status": status} if status != "ok" else {}),
+                            }))
+                    if statuses is not None:
+                        statuses.append(status)
+            ingest_stats["applied"]  += count
+            ingest_stats["batches"]  += 1
+            ingest_stats["batch_max"] = max(ingest_stats["batch_max"], count)
+        for _, _, done in units:
+            if done is not None:
+                done.set()
+        for event, fields in lines:
+            _log(event, **fields)
+
+
+# -----------------------------------------------------------------------
+# Report directives
+# -----------------------------------------------------------------------
+
+def _fleet_stretch(now):
+    """Factor applied to routine intervals so the fleet stays under
+    FLEET_REPORTS_MAX reports/s. Recomputed every FLEET_WINDOW seconds from
+    the intervals agents would get unstretched, so it does not feed back on
+    itself. Caller holds `policy_lock`."""
+    if now - _fleet["at"] >= FLEET_WINDOW:
+        for mac in [m for m, p in report_policy.items() if now - p["seen"] > 2 * REPORT_MAX]:
+            del report_policy[mac]
+        wanted = sum(1.0 / p["base"] for p in report_policy.values())
+        _fleet["at"]      = now
+        _fleet["stretch"] = max(1.0, wanted / FLEET_REPORTS_MAX)
+    return _fleet["stretch"]
+
+def _directives(mac, now, usage):
+    """Interval, process top-N and DNS inclusion for the agent's next report,
+    given the `usage` rates of the report just received.
+
+    Agents open in the dashboard and agents bursting above their own average
+    report quickly; idle agents report rarely with fewer processes. Under
+    fleet-wide overload the routine intervals are stretched and idle agents
+    defer their DNS names. Caller holds `policy_lock`; other readers only
+    `get` from report_policy.
+    """
+    bps  = usage.get("upload", 0) + usage.get("download", 0)
+    prev = report_policy.get(mac)
+    avg  = bps if prev is None else prev["avg"] + LOAD_EWMA * (bps - prev["avg"])
+
+    live  = now - live_views.get(mac, 0) <= LIVE_VIEW_TTL
+    burst = prev is not None and bps > BURST_FACTOR * max(prev["avg"], IDLE_BPS)
+    idle  = avg < IDLE_BPS and not burst
+    if live:
+        base, top_n = REPORT_LIVE, TOP_N_LIVE
+    elif burst:
+        base, top_n = REPORT_BURST, TOP_N_DEFAULT
+    elif idle:
+        base, top_n = REPORT_IDLE, TOP_N_IDLE
+    else:
+        base, top_n = REPORT_INTERVAL, TOP_N_DEFAULT
+
+    report_policy[mac] = {"avg": avg, "base": base, "interval": base, "seen": now}
+    stretch  = _fleet_stretch(now)
+    interval = base
+    dns      = True
+    if stretch > 1 and not (live or burst):
+        interval = min(REPORT_MAX, round(base * stretch, 1))
+        top_n    = min(top_n, TOP_N_IDLE)
+        dns      = not idle
+    report_policy[mac]["interval"] = interval
+    return {"interval": interval, "top_n": top_n, "dns": dns}
+
+def _stale_after(mac):
+    """Seconds without a report before an agent counts as inactive."""
+    p = report_policy.get(mac)
+    return max(INACTIVE_AFTER, 2 * p["interval"]) if p else INACTIVE_AFTER
 
 # -----------------------------------------------------------------------
 # Agent receiver
@@ -183,13 +528,20 @@ def list_macs():
 def control():
     global collecting
     collecting = not collecting
-    print(f"[control] {'COLLECTING' if collecting else 'STOPPED'}")
+    _log("control", collecting=collecting)
 
     if not collecting:
         # Flush all agent data when stopped
         with lock:
             agent_data.clear()
-        print("[control] Agent data cleared")
+            agent_history.clear()
+            recent_reports.clear()
+            blacklist_hits.clear()
+            alert_table.clear()
+            stream_hub.reset()
+        with policy_lock:
+            report_policy.clear()
+        _log("cleared")
 
     return jsonify({"collecting": collecting})
 
@@ -197,28 +549,128 @@ def control():
 def get_collecting():
     return jsonify({"collecting": collecting})
 
+def _busy():
+    """503 telling an agent to retry once the ingest queue has drained."""
+    with policy_lock:
+        ingest_stats["rejected"] += 1
+    return (jsonify({"error": "Ingest queue full", "retry_after": INGEST_RETRY,
+                     "collecting": collecting}),
+            503, {"Retry-After": str(INGEST_RETRY)})
+
 @app.route("/usage", methods=["POST"])
 def agent_usage():
-    raw = request.get_json(silent=True)
-    if not raw:
-        return jsonify({"error": "No JSON body"}), 400
+    """Validate a report, queue it for _ingest_worker and answer with the
+    agent's directives; 503 + Retry-After while the queue is full."""
+    if collecting and ingest_queue.full():
+        return _busy()              # before spending time on decoding
+    ack    = None
+    queued = False
+    if request.mimetype == wire.CONTENT_TYPE:
+        with wire_lock:
+            try:
+                ack, raw, session = wire.decode_report(request.get_data(), wire_sessions)
+            except wire.ResyncRequired as e:
+                return jsonify({"error": str(e), "resync": True, "collecting": collecting}), 409
+            except wire.WireError as e:
+                return jsonify({"error": f"Bad report: {e}"}), 400
+            # Queue before the session moves on: after a 503 the agent sends
+            # its next report against the same base, which must still decode.
+            if collecting:
+                try:
+                    ingest_queue.put_nowait(([raw], None, None))
+                except queue.Full:
+                    return _busy()
+                queued = True
+            wire_sessions[raw["mac"]] = session
+    else:
+        raw = request.get_json(silent=True)
+        if not raw:
+            return jsonify({"error": "No JSON body"}), 400
 
     mac = _normalize_mac(raw.get("mac", ""))
     if not re.match(r"^([0-9a-f]{2}:){5}[0-9a-f]{2}$", mac):
         return jsonify({"error": "Missing or invalid mac"}), 400
 
+    response = {"status": "ok", "collecting": collecting}
     if collecting:
         # Only ingest when collecting
-        mac = _ingest(raw)
-        d = agent_data[mac]
-        print(f"[{d['os']}] {d['username']}@{d['hostname']} ({d['ip']})  "
-              f"↑{d['usage']['upload']:.0f} B/s  "
-              f"↓{d['usage']['download']:.0f} B/s  "
-              f"procs={len(d['process'])}  dns={len(d['dns'])}")
+        if not queued:
+            try:
+                ingest_queue.put_nowait(([raw], None, None))
+            except queue.Full:
+                return _busy()
+        with policy_lock:
+            ingest_stats["accepted"] += 1
+            response["directives"] = _directives(mac, time.time(), raw.get("usage", {}))
     else:
-        print(f"[stopped] Ignored data from {mac}")
-
-    return jsonify({"status": "ok", "collecting": collecting})
+        _log("ignored", mac=mac)
+
+    if ack is not None:
+        response["ack"] = ack
+    return jsonify(response)
+
+def _batch_items():
+    """Reports in a /usage/batch body: a JSON array, or NDJSON with one
+    report per line. Unparseable NDJSON lines come back as None."""
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        items = []
+        for line in request.get_data().splitlines():
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+        return items
+    items = request.get_json(silent=True)
+    return items if isinstance(items, list) else None
+
+@app.route("/usage/batch", methods=["POST"])
+def agent_usage_batch():
+    """Many reports at once, for relays and agents flushing a backlog.
+
+    The reports are applied in order under one `lock` acquisition and the
+    answer has one status per item, in order: "ok", "stale" (older than the
+    agent's state: counted in history, only its domains kept), "duplicate"
+    (already applied), "invalid", "ignored" (not collecting) or "queued"
+    (not applied within USAGE_BATCH_WAIT; it still will be).
+    """
+    items = _batch_items()
+    if items is None:
+        return jsonify({"error": "Expected a JSON array or NDJSON reports"}), 400
+    if len(items) > USAGE_BATCH_MAX:
+        return jsonify({"error": f"At most {USAGE_BATCH_MAX} reports per batch"}), 413
+
+    results = [None] * len(items)
+    reports, index = [], []
+    for i, raw in enumerate(items):
+        if not isinstance(raw, dict):
+            results[i] = {"status": "invalid", "error": "Not a JSON report"}
+            continue
+        mac = _normalize_mac(raw.get("mac", ""))
+        if not re.match(r"^([0-9a-f]{2}:){5}[0-9a-f]{2}$", mac):
+            results[i] = {"status": "invalid", "error": "Missing or invalid mac"}
+        elif not collecting:
+            results[i] = {"mac": mac, "status": "ignored"}
+        else:
+            results[i] = {"mac": mac, "status": "queued"}
+            reports.append(raw)
+            index.append(i)
+
+    if reports:
+        statuses, done = [], threading.Event()
+        try:
+            ingest_queue.put_nowait((reports, statuses, done))
+        except queue.Full:
+            return _busy()
+        with policy_lock:
+            ingest_stats["accepted"] += len(reports)
+        if done.wait(USAGE_BATCH_WAIT):
+            for i, status in zip(index, statuses):
+                results[i]["status"] = status
+
+    counts = collections.Counter(r["status"] for r in results)
+    return jsonify({"status": "ok", "collecting": collecting,
+                    "counts": dict(counts), "results": results})
 
 # -----------------------------------------------------------------------
 # Data endpoints
@@ -237,11 +689,216 @@ def get_one(mac_address):
     with lock:
         if mac not in agent_data:
             return jsonify({"error": "Agent not found"}), 404
+        # Someone is watching this agent — ask it for faster reports.
+        live_views[mac] = time.time()
         d = dict(agent_data[mac])
+        d["interval"] = report_policy.get(mac, {}).get("interval", REPORT_INTERVAL)
 
     vendor = _get_mac_vendor(mac)
     return jsonify({**d, "vendor": vendor})
 
+@app.route("/history/<mac_address>", methods=["GET"])
+def get_history(mac_address):
+    """Upload/download rate history of one agent.
+
+    ?from= and ?to= are Unix times (default: the last HISTORY_WINDOW
+    seconds), ?points= the most points per series (0 = every bucket), and
+    each ?process= adds that process' history.
+    """
+    mac    = _normalize_mac(mac_address)
+    now    = time.time()
+    end    = request.args.get("to",     now,                  type=float)
+    start  = request.args.get("from",   end - HISTORY_WINDOW, type=float)
+    points = request.args.get("points", HISTORY_POINTS,       type=int)
+    if start > end or points < 0:
+        return jsonify({"error": "need from <= to and points >= 0"}), 400
+
+    with lock:
+        h = agent_history.get(mac)
+        if h is None:
+            return jsonify({"error": "No history for this agent"}), 404
+        step, total = h.total.query(start, end)
+        procs = {}
+        for name in request.args.getlist("process"):
+            if name in h.procs:
+                procs[name] = h.procs[name].query(start, end)
+        tracked = sorted(h.procs)
+
+    def thin(rows):
+        rows = history.lttb(rows, points) if points else rows
+        return [[t, round(up, 2), round(down, 2)] for t, up, down in rows]
+
+    return jsonify({
+        "mac":       mac,
+        "from":      start,
+        "to":        end,
+        "step":      step,
+        "points":    thin(total),
+        "processes": {name: {"step": p_step, "points": thin(rows)}
+                      for name, (p_step, rows) in procs.items()},
+        "tracked":   tracked,
+    })
+
+# -----------------------------------------------------------------------
+# Usage reports (persistent store)
+# -----------------------------------------------------------------------
+
+def _report_range():
+    """(from, to, n) from the query string; default the last 24 hours."""
+    end   = request.args.get("to",   time.time(),  type=float)
+    start = request.args.get("from", end - 86400,  type=float)
+    n     = request.args.get("n",    REPORT_TOP_N, type=int)
+    return start, end, n
+
+def _ranked(totals, n, key):
+    rows = sorted(totals.items(), key=lambda kv: kv[1][0] + kv[1][1], reverse=True)[:n]
+    return [{key: k, "upload": round(up), "download": round(down), "bytes": round(up + down)}
+            for k, (up, down) in rows]
+
+@app.route("/report", methods=["GET"])
+def usage_report():
+    """Top agents and processes by bytes between ?from= and ?to= (Unix
+    times, default the last 24 hours), from the persistent store. Ranges
+    older than STORE_RAW_DAYS are counted in whole hours."""
+    start, end, n = _report_range()
+    if start > end or n < 1:
+        return jsonify({"error": "need from <= to and n >= 1"}), 400
+    agents = _ranked(usage_store.agent_totals(start, end), n, "mac")
+    known  = usage_store.agents()
+    for a in agents:
+        info = known.get(a["mac"], {})
+        a["hostname"] = info.get("hostname", "Unknown")
+        a["username"] = info.get("username", "Unknown")
+    return jsonify({
+        "from":      start,
+        "to":        end,
+        "agents":    agents,
+        "processes": _ranked(usage_store.process_totals(start, end), n, "name"),
+        "pending":   usage_store.pending(),
+        "dropped":   usage_store.dropped,
+    })
+
+@app.route("/report/<mac_address>", methods=["GET"])
+def agent_report(mac_address):
+    """Bytes of one agent and its top processes between ?from= and ?to=."""
+    mac = _normalize_mac(mac_address)
+    start, end, n = _report_range()
+    if start > end or n < 1:
+        return jsonify({"error": "need from <= to and n >= 1"}), 400
+    up, down = usage_store.agent_totals(start, end, mac).get(mac, (0, 0))
+    return jsonify({
+        "mac":       mac,
+        "from":      start,
+        "to":        end,
+        "upload":    round(up),
+        "download":  round(down),
+        "bytes":     round(up + down),
+        "processes": _ranked(usage_store.process_totals(start, end, mac), n, "name"),
+    })
+
+# -----------------------------------------------------------------------
+# Agent health
+# -----------------------------------------------------------------------
+
+def _health_issues(h):
+    """Reasons an agent's numbers may be incomplete, from its last report."""
+    issues = []
+    if h.get("drops"):
+        issues.append("kernel_drops")
+    if h.get("cpu_percent", 0) > HEALTH_CPU_MAX:
+        issues.append("high_cpu")
+    seen = h.get("attributed", 0) + h.get("unattributed", 0)
+    if seen and h.get("unattributed", 0) / seen > HEALTH_UNATTRIBUTED_MAX:
+        issues.append("unattributed")
+    if h.get("callback_us", {}).get("p99", 0) > HEALTH_CALLBACK_P99_US:
+        issues.append("slow_callback")
+    return issues
+
+@app.route("/health", methods=["GET"])
+def agents_health():
+    """Self-reported agent health, agents with issues first."""
+    with lock:
+        rows = [
+            {
+                "mac":       mac,
+                "hostname":  d["hostname"],
+                "timestamp": d["timestamp"],
+                "sampling":  d.get("sampling", {"rate": 1, "error": 0.0}),
+                "health":    d.get("agent_health", {}),
+            }
+            for mac, d in agent_data.items()
+        ]
+    for row in rows:
+        row["issues"] = _health_issues(row["health"])
+    rows.sort(key=lambda row: (not row["issues"], -row["health"].get("cpu_percent", 0)))
+    return jsonify({"agents": rows, "overloaded": sum(1 for row in rows if row["issues"])})
+
+# -----------------------------------------------------------------------
+# Top destinations
+# -----------------------------------------------------------------------
+
+def _network(ip, prefix):
+    try:
+        return str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False))
+    except ValueError:
+        return None
+
+def _merge_destinations(summaries, n, prefix=32):
+    """Merge the agents' heavy-hitter summaries into one top-`n` list.
+
+    Each summary bounds what it does not list by its `floor`, so a listed
+    address is charged every other agent's floor as possible extra bytes:
+    the true fleet total of an entry lies in [bytes - error, bytes]. With
+    `prefix` < 32 addresses are grouped into networks and only the listed
+    addresses count, so subnet totals are lower bounds plus the listed
+    errors.
+    """
+    merged = {}
+    floors = 0
+    total  = 0
+    for s in summaries:
+        floors += s.get("floor", 0)
+        total  += s.get("total", 0)
+        groups  = {}
+        for e in s.get("top", []):
+            net = _network(e["ip"], prefix)
+            if net is None:
+                continue
+            g = groups.setdefault(net, [0, 0, 0])
+            g[0] += e["upload"]
+            g[1] += e["download"]
+            g[2] += e["error"]
+        for net, (up, down, error) in groups.items():
+            m = merged.setdefault(net, {"upload": 0, "download": 0, "error": 0,
+                                        "agents": 0, "floors": 0})
+            m["upload"]   += up
+            m["download"] += down
+            m["error"]    += error
+            m["agents"]   += 1
+            m["floors"]   += s.get("floor", 0)
+
+    rows = []
+    for net, m in merged.items():
+        listed_floors = m.pop("floors")
+        if prefix == 32:
+            m["error"] += floors - listed_floors
+        m["bytes"]  = m["upload"] + m["download"] + m["error"]
+        rows.append({"destination": net if prefix < 32 else net.split("/")[0], **m})
+    rows.sort(key=lambda r: r["bytes"], reverse=True)
+    return {"total": total, "floor": floors, "top": rows[:n]}
+
+@app.route("/destinations", methods=["GET"])
+def top_destinations():
+    """Fleet-wide top remote IPs (or networks with ?prefix=24) by bytes."""
+    n      = request.args.get("n",      TOP_DESTINATIONS, type=int)
+    prefix = request.args.get("prefix", 32,               type=int)
+    if not 8 <= prefix <= 32 or n < 1:
+        return jsonify({"error": "prefix must be 8-32 and n positive"}), 400
+    with lock:
+        summaries = [d["destinations"] for d in agent_data.values() if d.get("destinations")]
+    return jsonify({"agents": len(summaries), "prefix": prefix,
+                    **_merge_destinations(summaries, n, prefix)})
+
 # -----------------------------------------------------------------------
 # Active status
 # -----------------------------------------------------------------------
@@ -257,7 +914,7 @@ def active_status():
             if mac in agent_data:
                 d = agent_data[mac]
                 result[mac] = {
-                    "is_active": (now - d["timestamp"]) <= 10,
+                    "is_active": (now - d["timestamp"]) <= _stale_after(mac),
                     "hostname":  d["hostname"],
                     "username":  d["username"],
                     "ip":        d["ip"],
@@ -275,7 +932,7 @@ def active_status():
         for mac, d in agent_data.items():
             if mac not in result:
                 result[mac] = {
-                    "is_active": (now - d["timestamp"]) <= 10,
+                    "is_active": (now - d["timestamp"]) <= _stale_after(mac),
                     "hostname":  d["hostname"],
                     "username":  d["username"],
                     "ip":        d["ip"],
@@ -316,17 +973,17 @@ def delete_blacklist_domain():
 
 @app.route("/check_blacklist", methods=["GET"])
 def check_blacklist():
-    bl_domains = load_blacklist()["domains"]
-    results    = []
+    results = []
     with lock:
         for mac, d in agent_data.items():
-            blocked = _check_blacklist_dns(d["dns"], bl_domains)
+            hits = blacklist_hits.get(mac, {})
             results.append({
                 "mac":                mac,
                 "hostname":           d["hostname"],
                 "username":           d["username"],
-                "accessed_blacklist": bool(blocked),
-                "blocked_domains":    list(blocked),
+                "accessed_blacklist": bool(hits),
+                "blocked_domains":    list(hits),
+                "blocked_bytes":      dict(hits),
             })
     return jsonify(results)
 
@@ -341,6 +998,9 @@ def set_limit():
         return jsonify({"error": "Invalid value"}), 400
     config["total_usage_limit"] = int(mb * 1024 * 1024)
     save_config(config)
+    with lock:
+        for mac in agent_data:
+            _evaluate_alerts(mac, time.time())
     return jsonify({"message": "Limit updated", "limit_MB": mb})
 
 @app.route("/check_limit", methods=["GET"])
@@ -365,72 +1025,187 @@ def check_limit():
 # Alerts
 # -----------------------------------------------------------------------
 
+def _evaluate_alerts(mac, now):
+    """Bring the agent's usage and blacklist alerts in line with its latest
+    state and resolve its inactivity alert if it is reporting again. The
+    caller holds `lock`."""
+    d     = agent_data[mac]
+    who   = {"hostname": d["hostname"], "username": d["username"]}
+    limit = config["total_usage_limit"]
+    total = d["total_usage"]["upload"] + d["total_usage"]["download"]
+
+    # Byte figures grow with every report, so they go in as detail: an open
+    # alert is re-sent only when it opens, resolves or its fields change.
+    usage = {}
+    if total > limit:
+        usage[None] = {**who, "severity": "medium", "message": "Data usage limit exceeded",
+                       "limit_MB": round(limit / (1024 * 1024), 2)}
+    alert_table.update(mac, "high_usage", usage, now,
+                       detail={None: {"total_usage_MB": round(total / (1024 * 1024), 2)}})
+
+    hits = blacklist_hits.get(mac, {})
+    alert_table.update(mac, "blacklist", {
+        site: {**who, "severity": "high", "message": f"{site} accessed"} for site in hits
+    }, now, detail={site: {"bytes": site_bytes} for site, site_bytes in hits.items()})
+
+    if now - d["timestamp"] <= _stale_after(mac):
+        alert_table.update(mac, "inactive", {}, now)
+
+def _alert_timer():
+    """Every ALERT_TICK seconds, open inactivity alerts for agents that went
+    quiet and for monitored MACs that never reported, resolve those that no
+    longer apply and forget old resolved alerts."""
+    while True:
+        time.sleep(ALERT_TICK)
+        now = time.time()
+        with lock:
+            monitored = set(mac_addresses)
+            for mac in set(agent_data) | monitored | alert_table.macs():
+                current = {}
+                d = agent_data.get(mac)
+                if d is not None:
+                    if now - d["timestamp"] > _stale_after(mac):
+                        current[None] = {"hostname": d["hostname"], "username": d["username"],
+                                         "severity": "low", "message": "Agent not reporting",
+                                         "last_report": d["timestamp"]}
+                elif mac in monitored:
+                    current[None] = {"hostname": "Unknown", "username": "Unknown",
+                                     "severity": "low", "message": "Agent not connected",
+                                     "last_report": None}
+                alert_table.update(mac, "inactive", current, now)
+            alert_table.prune(now)
+
+
+def _alert_view(rec, now):
+    """An alert record as /alerts returns it (with its idle time if inactive)."""
+    view = dict(rec)
+    if rec["type"] == "inactive":
+        last = rec.get("last_report")
+        view["seconds_idle"] = -1 if last is None else int((rec["resolved_at"] or now) - last)
+    return view
+
 @app.route("/alerts", methods=["GET"])
 def get_alerts():
-    alerts     = []
-    now        = time.time()
-    INACTIVE   = 10
-    limit      = config["total_usage_limit"]
-    bl_domains = load_blacklist()["domains"]
+    """Open alerts, oldest first, and a `cursor`.
+
+    With ?since=<cursor> only the alerts opened, changed, acknowledged or
+    resolved (`resolved_at` set) after the answer that returned that cursor
+    come back, as `changes`. If the cursor is too old or from before a
+    restart, `reset` is true and `changes` holds every open alert.
+    """
+    since = request.args.get("since")
+    now   = time.time()
+    with lock:
+        if since is None:
+            records = alert_table.open()
+        else:
+            reset, records = alert_table.changes(since)
+        views = [_alert_view(rec, now) for rec in records]
+        body  = {"total_alerts": len(alert_table), "cursor": alert_table.cursor()}
+
+    if since is None:
+        body["alerts"] = views
+    else:
+        body.update({"reset": reset, "changes": views})
+    return jsonify(body)
 
+@app.route("/alerts/<int:alert_id>/ack", methods=["POST"])
+def acknowledge_alert(alert_id):
+    """Mark an alert acknowledged; it stays open until its condition clears."""
     with lock:
-        # ── Alerts for connected agents ────────────────────────────────────
-        for mac, d in agent_data.items():
-            hostname = d["hostname"]
-            username = d["username"]
-            total    = d["total_usage"]["upload"] + d["total_usage"]["download"]
-
-            # 1. Inactive
-            if now - d["timestamp"] > INACTIVE:
-                alerts.append({
-                    "mac":          mac,
-                    "hostname":     hostname,
-                    "username":     username,
-                    "type":         "inactive",
-                    "severity":     "low",
-                    "message":      "Agent not reporting",
-                    "seconds_idle": int(now - d["timestamp"]),
-                })
-
-            # 2. Usage limit exceeded
-            if total > limit:
-                alerts.append({
-                    "mac":            mac,
-                    "hostname":       hostname,
-                    "username":       username,
-                    "type":           "high_usage",
-                    "severity":       "medium",
-                    "total_usage_MB": round(total / (1024 * 1024), 2),
-                    "limit_MB":       round(limit / (1024 * 1024), 2),
-                    "message":        "Data usage limit exceeded",
-                })
-
-            # 3. Blacklist access
-            for site in _check_blacklist_dns(d["dns"], bl_domains):
-                alerts.append({
-                    "mac":      mac,
-                    "hostname": hostname,
-                    "username": username,
-                    "type":     "blacklist",
-                    "severity": "high",
-                    "site":     site,
-                    "message":  f"{site} accessed",
-                })
-
-        # ── Inactive alert for MACs in file but no agent connected ─────────
-        for mac in mac_addresses:
-            if mac not in agent_data:
-                alerts.append({
-                    "mac":          mac,
-                    "hostname":     "Unknown",
-                    "username":     "Unknown",
-                    "type":         "inactive",
-                    "severity":     "low",
-                    "message":      "Agent not connected",
-                    "seconds_idle": -1,
-                })
+        rec = alert_table.acknowledge(alert_id)
+        if rec is None:
+            return jsonify({"error": "Alert not found"}), 404
+        view = _alert_view(rec, time.time())
+    return jsonify({"alert": view})
 
-    return jsonify({"total_alerts": len(alerts), "alerts": alerts})
+# -----------------------------------------------------------------------
+# Dashboard stream
+# -----------------------------------------------------------------------
+
+def _push_agent(mac):
+    """Publish the agent's live numbers to /stream clients (what the
+    dashboard shows of it; flows, domains and destinations stay behind
+    /data/<mac>). The caller holds `lock`."""
+    d = agent_data[mac]
+    stream_hub.publish("agents", mac, {
+        "mac":         mac,
+        "hostname":    d["hostname"],
+        "username":    d["username"],
+        "ip":          d["ip"],
+        "os":          d["os"],
+        "timestamp":   d["timestamp"],
+        "state":       d["state"],
+        "interval":    report_policy.get(mac, {}).get("interval", REPORT_INTERVAL),
+        "usage":       d["usage"],
+        "total_usage": d["total_usage"],
+        "peak":        d["peak"],
+        "process":     d["process"],
+        "dns":         sorted(d["dns"]),
+        "sampling":    d["sampling"],
+    })
+
+def _push_alert(rec):
+    """Publish an alert transition to /stream clients; resolved alerts are
+    sent once and then dropped from the stream's state."""
+    stream_hub.publish("alerts", rec["id"], _alert_view(rec, time.time()),
+                       final=rec["resolved_at"] is not None)
+
+alert_table.on_change = _push_alert
+
+@app.route("/stream", methods=["GET"])
+def event_stream():
+    """Server-sent events replacing the dashboard's polls.
+
+    The first event, `snapshot`, holds the stream's `subscriber` id and the
+    current `agents` (by MAC) and open `alerts` (by id). Then each `update`
+    holds only the fields that changed per agent or alert since the last
+    event; an alert whose `resolved_at` is set is gone. Changes are merged
+    per client and sent at most every STREAM_INTERVAL seconds, and a client
+    that falls far behind gets a fresh `snapshot` instead of a backlog.
+    """
+    if len(stream_hub) >= STREAM_MAX:
+        return jsonify({"error": "Too many stream clients"}), 503
+    sub = stream_hub.subscribe()
+
+    def events():
+        try:
+            yield f"retry: {STREAM_RETRY * 1000}\n\n"
+            while True:
+                item = stream_hub.next(sub, STREAM_KEEPALIVE)
+                mac  = stream_watch.get(sub.id)
+                if mac:
+                    live_views[mac] = time.time()
+                if item is None:
+                    yield ": keepalive\n\n"
+                    continue
+                event, data = item
+                if event == "snapshot":
+                    data = {"subscriber": sub.id, "agents": {}, "alerts": {}, **data}
+                yield f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+                time.sleep(STREAM_INTERVAL)
+        finally:
+            stream_hub.unsubscribe(sub)
+            stream_watch.pop(sub.id, None)
+
+    return Response(events(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/stream/<int:subscriber>/watch", methods=["POST"])
+def watch_agent(subscriber):
+    """The agent open in a stream client's dashboard ({"mac": null} for
+    none). It is asked for fast reports while the stream stays open, as
+    polling /data/<mac> does."""
+    if subscriber not in stream_hub:
+        return jsonify({"error": "Stream not found"}), 404
+    mac = (request.get_json(silent=True) or {}).get("mac")
+    if mac:
+        mac = _normalize_mac(mac)
+        stream_watch[subscriber] = mac
+        live_views[mac] = time.time()
+    else:
+        stream_watch.pop(subscriber, None)
+    return jsonify({"subscriber": subscriber, "mac": mac or None})
 
 # -----------------------------------------------------------------------
 # Status
@@ -438,15 +1213,56 @@ def get_alerts():
 
 @app.route("/status", methods=["GET"])
 def status():
+    with lock:
+        ingest      = dict(ingest_stats)
+        open_alerts = len(alert_table)
+    push = {"clients": len(stream_hub), "resyncs": stream_hub.resyncs}
+    ingest.update({
+        "depth":       ingest_queue.qsize(),
+        "capacity":    INGEST_QUEUE_MAX,
+        "batch_avg":   round(ingest["applied"] / ingest["batches"], 1) if ingest["batches"] else 0,
+        "log_depth":   log_queue.qsize(),
+        "store_depth": usage_store.pending(),
+        "store_dropped": usage_store.dropped,
+    })
     return jsonify({
         "agents":     len(agent_data),
         "collecting": collecting,
         "limit_MB":   round(config["total_usage_limit"] / (1024 * 1024), 2),
+        "alerts":     open_alerts,
+        "ingest":     ingest,
+        "stream":     push,
     })
 
 # -----------------------------------------------------------------------
 # Run
 # -----------------------------------------------------------------------
 
+_started      = False
+_started_lock = threading.Lock()
+
+def start():
+    """Start the console logger, store writer, ingest worker and alert timer
+    once per process. Not done on import: the debug reloader imports this
+    module in a watching parent too, which must not run a second SQLite
+    writer or ingest worker."""
+    global _started
+    with _started_lock:
+        if _started:
+            return
+        _started = True
+    _log_listener.start()
+    usage_store.start()
+    threading.Thread(target=_ingest_worker, name="ingest", daemon=True).start()
+    threading.Thread(target=_alert_timer,   name="alerts", daemon=True).start()
+
+@app.before_request
+def _start_on_first_request():
+    start()     # under a WSGI server, which never runs __main__
+
 if __name__ == "__main__":
+    # With debug=True this file runs in the reloader's parent as well; only
+    # the child that serves requests (WERKZEUG_RUN_MAIN set) starts work.
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start()
     app.run(debug=True, host="0.0.0.0", port=5000)
\ No newline at end of file
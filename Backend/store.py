@@ -0,0 +1,334 @@
+"""Persistent usage store for the master (SQLite, WAL mode).
+
+`_ingest` hands each report to `Store.add()`, which only puts it on a
+bounded queue; one writer thread drains the queue and inserts in batches,
+one transaction per batch. Ingest latency therefore does not depend on
+how much history is stored, and a full queue drops reports (counted in
+`dropped`) instead of blocking the request.
+
+Raw samples are partitioned by UTC day into their own tables:
+
+    agent_YYYYMMDD(mac_id, t, up, down, seconds)    bytes per report
+    proc_YYYYMMDD(mac_id, t, name_id, up, down)     bytes per process per report
+
+clustered on (mac_id, t) (WITHOUT ROWID), so inserts and range queries
+only touch one day's b-tree and a query for one agent reads its rows
+contiguously. Once a day is older than `raw_days` it is compacted: its
+rows are summed into the hourly tables
+
+    agent_hourly(mac_id, hour, up, down, seconds)
+    proc_hourly(mac_id, hour, name_id, up, down)
+
+and its tables are dropped, which costs the same however many rows they
+held. Hourly rows older than `hourly_days` are deleted. MACs and process
+names are interned as small integers (`agents`, `names`); `agents` also
+keeps the last known identity of every MAC so reports can name hosts that
+are offline.
+
+Queries open their own connection; WAL lets them run while the writer
+inserts.
+"""
+import calendar
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+RAW_DAYS      = 7
+HOURLY_DAYS   = 400
+BATCH         = 2000       # reports per transaction, at most
+FLUSH_EVERY   = 1.0        # seconds a report may wait for a fuller batch
+QUEUE_MAX     = 50000      # reports waiting for the writer
+CACHE_KIB     = 65536      # writer's page cache
+COMPACT_EVERY = 3600       # seconds between retention passes
+DAY           = 86400
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS names (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);
+CREATE TABLE IF NOT EXISTS agents (
+    id INTEGER PRIMARY KEY, mac TEXT UNIQUE NOT NULL,
+    hostname TEXT, username TEXT, ip TEXT, os TEXT, last_seen REAL);
+CREATE TABLE IF NOT EXISTS agent_hourly (
+    mac_id INTEGER, hour INTEGER, up INTEGER, down INTEGER, seconds REAL,
+    PRIMARY KEY (mac_id, hour)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS proc_hourly (
+    mac_id INTEGER, hour INTEGER, name_id INTEGER, up INTEGER, down INTEGER,
+    PRIMARY KEY (mac_id, hour, name_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS agent_hourly_hour ON agent_hourly (hour);
+CREATE INDEX IF NOT EXISTS proc_hourly_hour  ON proc_hourly (hour);
+"""
+
+# Two reports of one agent in the same second (or one process listed
+# twice) add up rather than conflict.
+_ADD_AGENT = ("INSERT INTO {table} {values} ON CONFLICT DO UPDATE SET "
+              "up = up + excluded.up, down = down + excluded.down, "
+              "seconds = seconds + excluded.seconds")
+_ADD_PROC  = ("INSERT INTO {table} {values} ON CONFLICT DO UPDATE SET "
+              "up = up + excluded.up, down = down + excluded.down")
+_VALUES    = "VALUES (?, ?, ?, ?, ?)"
+
+
+def day_of(t):
+    return int(t // DAY)
+
+def _suffix(day):
+    return time.strftime("%Y%m%d", time.gmtime(day * DAY))
+
+def _day_of_suffix(suffix):
+    return day_of(calendar.timegm(time.strptime(suffix, "%Y%m%d")))
+
+def _print(event, **fields):
+    print(" ".join(["[store]", event, *(f"{k}={v}" for k, v in fields.items())]))
+
+def _partitions(db):
+    """Days that have raw tables, oldest first."""
+    return sorted(_day_of_suffix(name[len("agent_"):]) for (name,) in db.execute(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name GLOB 'agent_[0-9]*'"))
+
+
+class Store:
+    """Report samples in `path`; call `start()` to run the writer thread.
+
+    `log(event, **fields)` receives the writer's errors and compactions;
+    they are printed by default.
+    """
+
+    def __init__(self, path, raw_days=RAW_DAYS, hourly_days=HOURLY_DAYS,
+                 batch=BATCH, flush_every=FLUSH_EVERY, queue_max=QUEUE_MAX, log=_print):
+        self.path        = path
+        self.log         = log
+        self.raw_days    = raw_days
+        self.hourly_days = hourly_days
+        self.batch       = batch
+        self.flush_every = flush_every
+        self.dropped     = 0                    # reports lost to a full queue
+        self.written     = 0                    # reports committed
+        self._queue      = queue.Queue(queue_max)
+        self._macs       = {}                   # mac -> id (writer thread)
+        self._names      = {}                   # process name -> id (writer thread)
+        self._days       = set()                # days with raw tables (writer thread)
+        self._thread     = None
+
+        db = self._connect()
+        db.executescript(_SCHEMA)
+        db.close()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")   # consistent after a crash; may lose the last batch
+        return db
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="store-writer", daemon=True)
+        self._thread.start()
+
+    # ── request threads ──────────────────────────────────────────────────────
+
+    def add(self, mac, t, identity, up, down, seconds, processes):
+        """Queue one report ending at `t`: `up`/`down` bytes over `seconds`,
+        and `processes` as [(name, up bytes, down bytes)]. Never blocks."""
+        try:
+            self._queue.put_nowait((mac, t, identity, up, down, seconds, processes))
+        except queue.Full:
+            self.dropped += 1
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=10.0):
+        """Wait until everything queued so far is written."""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    # ── writer thread ────────────────────────────────────────────────────────
+
+    def open_writer(self):
+        """Connection and caches for `write` and `compact`."""
+        db = self._connect()
+        db.execute(f"PRAGMA cache_size=-{CACHE_KIB}")
+        self._macs  = dict(db.execute("SELECT mac, id FROM agents").fetchall())
+        self._names = dict(db.execute("SELECT name, id FROM names").fetchall())
+        self._days  = set(_partitions(db))
+        return db
+
+    def _run(self):
+        db = self.open_writer()
+        next_compact = 0.0
+        while True:
+            rows, events = [], []
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_every
+            while True:
+                if isinstance(item, threading.Event):
+                    events.append(item)
+                    break
+                rows.append(item)
+                if len(rows) >= self.batch:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if rows:
+                try:
+                    self.write(db, rows)
+                    self.written += len(rows)
+                except sqlite3.Error as e:
+                    self.log("store_write_failed", lost=len(rows), error=e)
+            if time.monotonic() >= next_compact:
+                try:
+                    self.compact(db)
+                except sqlite3.Error as e:
+                    self.log("store_compact_failed", error=e)
+                next_compact = time.monotonic() + COMPACT_EVERY
+            for event in events:
+                event.set()
+
+    def _intern(self, db, cache, table, column, value):
+        vid = cache.get(value)
+        if vid is None:
+            db.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (value,))
+            vid = cache[value] = db.execute(
+                f"SELECT id FROM {table} WHERE {column} = ?", (value,)).fetchone()[0]
+        return vid
+
+    def _partition(self, db, day):
+        s = _suffix(day)
+        if day not in self._days:
+            db.execute(f"CREATE TABLE IF NOT EXISTS agent_{s} (mac_id INTEGER, t INTEGER, "
+                       "up INTEGER, down INTEGER, seconds REAL, "
+                       "PRIMARY KEY (mac_id, t)) WITHOUT ROWID")
+            db.execute(f"CREATE TABLE IF NOT EXISTS proc_{s} (mac_id INTEGER, t INTEGER, "
+                       "name_id INTEGER, up INTEGER, down INTEGER, "
+                       "PRIMARY KEY (mac_id, t, name_id)) WITHOUT ROWID")
+            self._days.add(day)
+        return s
+
+    def write(self, db, rows):
+        """Insert queued reports in one transaction."""
+        cutoff = day_of(time.time()) - self.raw_days
+        agents, procs, hourly, proc_hourly, identities = {}, {}, [], [], {}
+        db.execute("BEGIN")
+        try:
+            for mac, t, identity, up, down, seconds, processes in rows:
+                mid  = self._intern(db, self._macs, "agents", "mac", mac)
+                pids = [(self._intern(db, self._names, "names", "name", name),
+                         round(p_up), round(p_down)) for name, p_up, p_down in processes]
+                day  = day_of(t)
+                if day <= cutoff:
+                    # Replayed from before raw retention: straight into the rollup.
+                    hour = int(t // 3600)
+                    hourly.append((mid, hour, round(up), round(down), seconds))
+                    proc_hourly.extend((mid, hour, nid, p_up, p_down) for nid, p_up, p_down in pids)
+                else:
+                    agents.setdefault(day, []).append((mid, int(t), round(up), round(down), seconds))
+                    procs.setdefault(day, []).extend(
+                        (mid, int(t), nid, p_up, p_down) for nid, p_up, p_down in pids)
+                if identity and t >= identities.get(mid, (0,))[0]:
+                    identities[mid] = (t, identity)
+
+            for day, day_rows in agents.items():
+                s = self._partition(db, day)
+                db.executemany(_ADD_AGENT.format(table=f"agent_{s}", values=_VALUES), day_rows)
+                db.executemany(_ADD_PROC.format(table=f"proc_{s}", values=_VALUES), procs[day])
+            db.executemany(_ADD_AGENT.format(table="agent_hourly", values=_VALUES), hourly)
+            db.executemany(_ADD_PROC.format(table="proc_hourly", values=_VALUES), proc_hourly)
+            db.executemany(
+                "UPDATE agents SET hostname = ?, username = ?, ip = ?, os = ?, last_seen = ? "
+                "WHERE id = ? AND (last_seen IS NULL OR last_seen <= ?)",
+                [(i.get("hostname"), i.get("username"), i.get("ip"), i.get("os"), t, mid, t)
+                 for mid, (t, i) in identities.items()])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            # Ids and partitions created in this transaction are gone too.
+            self._macs.clear()
+            self._names.clear()
+            self._days = set(_partitions(db))
+            raise
+
+    def compact(self, db, now=None):
+        """Roll raw days older than `raw_days` into the hourly tables and drop
+        them; delete hourly rows older than `hourly_days`."""
+        today = day_of(now if now is not None else time.time())
+        for day in sorted(d for d in self._days if d <= today - self.raw_days):
+            s = _suffix(day)
+            db.execute("BEGIN")
+            try:
+                # (WHERE true keeps SQLite from reading ON CONFLICT as a join constraint.)
+                db.execute(_ADD_AGENT.format(table="agent_hourly", values=(
+                    "SELECT mac_id, t / 3600 AS hour, SUM(up), SUM(down), SUM(seconds) "
+                    f"FROM agent_{s} WHERE true GROUP BY mac_id, hour")))
+                db.execute(_ADD_PROC.format(table="proc_hourly", values=(
+                    "SELECT mac_id, t / 3600 AS hour, name_id, SUM(up), SUM(down) "
+                    f"FROM proc_{s} WHERE true GROUP BY mac_id, hour, name_id")))
+                db.execute(f"DROP TABLE agent_{s}")
+                db.execute(f"DROP TABLE proc_{s}")
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            self._days.discard(day)
+            self.log("store_compacted", day=s)
+
+        first_hour = (today - self.hourly_days) * 24
+        db.execute("DELETE FROM agent_hourly WHERE hour < ?", (first_hour,))
+        db.execute("DELETE FROM proc_hourly  WHERE hour < ?", (first_hour,))
+
+    # ── queries ──────────────────────────────────────────────────────────────
+
+    def _totals(self, kind, key, join, start, end, mac):
+        """[(key, up, down)] from the raw and hourly `kind` tables in [start, end)."""
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            where, args = "", ()
+            if mac:
+                row = db.execute("SELECT id FROM agents WHERE mac = ?", (mac,)).fetchone()
+                if row is None:
+                    return []
+                where, args = "AND mac_id = ?", (row[0],)
+            parts, params = [], []
+            for day in _partitions(db):
+                if day_of(start) <= day <= day_of(end):
+                    parts.append(f"SELECT * FROM {kind}_{_suffix(day)} "
+                                 f"WHERE t >= ? AND t < ? {where}")
+                    params += [start, end, *args]
+            # Compacted days only have hours: count every hour the range touches.
+            parts.append(f"SELECT * FROM {kind}_hourly WHERE hour >= ? AND hour <= ? {where}")
+            params += [int(start // 3600), int(end // 3600), *args]
+            return db.execute(f"SELECT {key}, SUM(up), SUM(down) FROM "
+                              f"({' UNION ALL '.join(parts)}) AS u {join} GROUP BY 1",
+                              params).fetchall()
+        finally:
+            db.close()
+
+    def agent_totals(self, start, end, mac=None):
+        """{mac: (up bytes, down bytes)} between `start` and `end`."""
+        rows = self._totals("agent", "agents.mac", "JOIN agents ON agents.id = u.mac_id",
+                            start, end, mac)
+        return {m: (up or 0, down or 0) for m, up, down in rows}
+
+    def process_totals(self, start, end, mac=None):
+        """{process name: (up bytes, down bytes)} between `start` and `end`."""
+        rows = self._totals("proc", "names.name", "JOIN names ON names.id = u.name_id",
+                            start, end, mac)
+        return {n: (up or 0, down or 0) for n, up, down in rows}
+
+    def agents(self):
+        """{mac: identity} of every agent the store has seen."""
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            rows = db.execute("SELECT mac, hostname, username, ip, os, last_seen FROM agents "
+                              "WHERE last_seen IS NOT NULL").fetchall()
+        finally:
+            db.close()
+        return {mac: {"hostname": h, "username": u, "ip": ip, "os": o, "last_seen": seen}
+                for mac, h, u, ip, o, seen in rows}
+
+    def size(self):
+        """Bytes on disk, database plus write-ahead log."""
+        return sum(os.path.getsize(p) for p in (self.path, self.path + "-wal")
+                   if os.path.exists(p))
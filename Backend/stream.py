@@ -0,0 +1,131 @@
+"""Push channel for the dashboard: keyed state, coalesced per subscriber.
+
+The server publishes the latest state of each object it wants pushed (an
+agent's live numbers, an alert record) under a (kind, key) pair. The hub
+keeps that latest state, for the snapshot a new subscriber starts from,
+and gives every subscriber only the fields that changed.
+
+Subscribers do not get a queue of events. Each one has one pending entry
+per key, and newer changes are merged into it, so an agent that reports
+ten times between two reads is sent once, with its latest values. A
+subscriber that falls so far behind that `max_pending` keys are waiting
+is dropped back to a snapshot of the current state. So memory per
+subscriber is bounded however slow it reads, and it always ends up with
+the latest state.
+"""
+import itertools
+import threading
+
+PENDING_MAX = 5000      # keys waiting for one subscriber before it is sent a snapshot instead
+
+
+class Subscriber:
+    """One stream client: changed fields per (kind, key) not sent yet."""
+
+    __slots__ = ("id", "pending", "resync")
+
+    def __init__(self, sub_id):
+        self.id      = sub_id
+        self.pending = {}       # (kind, key) -> fields changed since the last read
+        self.resync  = True     # next read is a full snapshot
+
+
+class Hub:
+    """Latest state per (kind, key) and the subscribers it is pushed to."""
+
+    def __init__(self, max_pending=PENDING_MAX):
+        self.max_pending = max_pending
+        self.resyncs     = 0                    # snapshots sent to subscribers that fell behind
+        self._cond       = threading.Condition()
+        self._state      = {}                   # (kind, key) -> latest state
+        self._subs       = {}                   # id -> Subscriber
+        self._ids        = itertools.count(1)
+
+    # ─── Publishing ───────────────────────────────────────────────────────────
+
+    def publish(self, kind, key, state, final=False):
+        """Record the latest `state` (a dict, not modified afterwards) of
+        (kind, key) and queue what changed for every subscriber. A `final`
+        state is sent once and then forgotten (a resolved alert)."""
+        with self._cond:
+            prev = self._state.pop((kind, key), None)
+            if not final:
+                self._state[(kind, key)] = state
+            if not self._subs:
+                return
+            if prev is None:
+                fields = state
+            else:
+                fields = {k: v for k, v in state.items() if prev.get(k) != v}
+                if not fields:
+                    return
+            for sub in self._subs.values():
+                self._add(sub, (kind, key), fields)
+            self._cond.notify_all()
+
+    def reset(self):
+        """Forget every state; subscribers are sent an empty snapshot."""
+        with self._cond:
+            self._state.clear()
+            for sub in self._subs.values():
+                sub.pending.clear()
+                sub.resync = True
+            self._cond.notify_all()
+
+    # ─── Subscribing ──────────────────────────────────────────────────────────
+
+    def subscribe(self):
+        with self._cond:
+            sub = Subscriber(next(self._ids))
+            self._subs[sub.id] = sub
+            return sub
+
+    def unsubscribe(self, sub):
+        with self._cond:
+            self._subs.pop(sub.id, None)
+
+    def next(self, sub, timeout):
+        """Wait up to `timeout` seconds for something to send `sub`.
+
+        Returns ("snapshot", {kind: {key: state}}) after subscribing or
+        falling behind, ("update", {kind: {key: changed fields}}) otherwise,
+        or None if nothing changed in time.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: sub.resync or sub.pending, timeout)
+            if sub.resync:
+                sub.resync  = False
+                sub.pending = {}
+                return "snapshot", self._group(self._state)
+            if not sub.pending:
+                return None
+            pending, sub.pending = sub.pending, {}
+        return "update", self._group(pending)
+
+    def __contains__(self, sub_id):
+        return sub_id in self._subs
+
+    def __len__(self):
+        return len(self._subs)
+
+    # ─── Internals ────────────────────────────────────────────────────────────
+
+    def _add(self, sub, kk, fields):
+        if sub.resync:
+            return                              # the snapshot will carry it
+        entry = sub.pending.get(kk)
+        if entry is not None:
+            entry.update(fields)
+        elif len(sub.pending) >= self.max_pending:
+            sub.pending = {}
+            sub.resync  = True
+            self.resyncs += 1
+        else:
+            sub.pending[kk] = dict(fields)
+
+    @staticmethod
+    def _group(items):
+        out = {}
+        for (kind, key), fields in items.items():
+            out.setdefault(kind, {})[key] = fields
+        return out
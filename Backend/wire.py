@@ -0,0 +1,242 @@
+"""Decoder for the agents' compact binary `/usage` report format.
+
+The agent side (LinuxAgent/wire.py) documents the layout. Reports carry
+deltas against the last report this server acknowledged for the same MAC,
+so the decoder keeps a small session per agent and rebuilds the legacy
+JSON-shaped dict that `_ingest` understands.
+"""
+import ipaddress
+import struct
+import zlib
+
+CONTENT_TYPE = "application/x-netmon-report"
+VERSION      = 1
+MAGIC        = b"NM"
+
+FLAG_IDENTITY = 1
+FLAG_ZLIB     = 2
+MAX_BODY      = 1 << 20     # decompressed size cap
+
+HEALTH_LATENCIES = ("callback_us", "refresh_us", "send_us")
+HEALTH_QUANTILES = ("count", "p50", "p90", "p99", "max")
+
+_header = struct.Struct("!2sBB")
+
+
+class WireError(ValueError):
+    """Malformed or unsupported report."""
+
+class ResyncRequired(WireError):
+    """Delta report against a base this server does not hold."""
+
+
+class _Reader:
+    __slots__ = ("buf", "pos")
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def uvarint(self):
+        n = shift = 0
+        buf = self.buf
+        while True:
+            if self.pos >= len(buf) or shift > 63:
+                raise WireError("truncated varint")
+            b = buf[self.pos]
+            self.pos += 1
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                return n
+            shift += 7
+
+    def svarint(self):
+        n = self.uvarint()
+        return -((n + 1) >> 1) if n & 1 else n >> 1
+
+    def raw(self, size):
+        end = self.pos + size
+        if end > len(self.buf):
+            raise WireError("truncated field")
+        out = self.buf[self.pos:end]
+        self.pos = end
+        return out
+
+    def str(self):
+        return self.raw(self.uvarint()).decode("utf-8", errors="replace")
+
+
+def _parse(data):
+    if len(data) < _header.size:
+        raise WireError("short report")
+    magic, version, flags = _header.unpack_from(data)
+    if magic != MAGIC:
+        raise WireError("bad magic")
+    if version != VERSION:
+        raise WireError(f"unsupported version {version}")
+    body = data[_header.size:]
+    if flags & FLAG_ZLIB:
+        try:
+            d    = zlib.decompressobj()
+            body = d.decompress(body, MAX_BODY)
+        except zlib.error as e:
+            raise WireError(f"bad zlib body: {e}")
+        if d.unconsumed_tail:
+            raise WireError("report too large")
+    r    = _Reader(body)
+    seq  = r.uvarint()
+    base = r.uvarint()
+    ts   = r.uvarint()
+    mac  = ":".join(f"{b:02x}" for b in r.raw(6))
+    return r, mac, flags, seq, base, ts
+
+def decode_report(data, sessions):
+    """Decode one binary report into a legacy-shaped dict.
+
+    `sessions` maps mac -> decoder state and is only read; the caller must
+    hold the lock guarding it. Returns (seq, report, session): once the
+    report is accepted, the caller stores `session` under its mac, so the
+    next delta decodes against it. Raises ResyncRequired when the report is
+    a delta against a base this server never saw (e.g. after a restart),
+    and WireError for anything malformed.
+    """
+    r, mac, flags, seq, base, ts = _parse(data)
+
+    if base == 0:
+        if not flags & FLAG_IDENTITY:
+            raise WireError("full report without identity")
+        prev = {"seq": 0, "identity": {}, "total": (0, 0), "procs": {}, "names": {}}
+    else:
+        prev = sessions.get(mac)
+        if prev is None or prev["seq"] != base:
+            raise ResyncRequired(f"unknown base {base} for {mac}")
+
+    identity = prev["identity"]
+    if flags & FLAG_IDENTITY:
+        identity = {k: r.str() for k in ("name", "username", "ip", "os", "state")}
+
+    up, down = r.uvarint() / 100, r.uvarint() / 100
+    total    = (prev["total"][0] + r.svarint(), prev["total"][1] + r.svarint())
+
+    names   = dict(prev["names"])
+    procs   = {}
+    process = []
+    for _ in range(r.uvarint()):
+        ref = r.uvarint()
+        nid = ref >> 1
+        if ref & 1:
+            names[nid] = r.str()
+        elif nid not in names:
+            raise ResyncRequired(f"unknown process id {nid} for {mac}")
+        name  = names[nid]
+        speed = (r.uvarint() / 100, r.uvarint() / 100)
+        last  = prev["procs"].get(name, (0, 0))
+        tot   = (last[0] + r.svarint(), last[1] + r.svarint())
+        procs[name] = tot
+        process.append({
+            "name":  name,
+            "speed": {"upload": speed[0], "download": speed[1]},
+            "total": {"upload": tot[0],   "download": tot[1]},
+        })
+
+    dns = [r.str() for _ in range(r.uvarint())]
+
+    domains = []
+    if r.pos < len(r.buf):
+        for _ in range(r.uvarint()):
+            name  = r.str()
+            speed = (r.uvarint() / 100, r.uvarint() / 100)
+            tot   = (r.uvarint(), r.uvarint())
+            domains.append({
+                "name":  name,
+                "speed": {"upload": speed[0], "download": speed[1]},
+                "total": {"upload": tot[0],   "download": tot[1]},
+            })
+
+    flows = []
+    if r.pos < len(r.buf):
+        for _ in range(r.uvarint()):
+            proto       = r.str()
+            local_port  = r.uvarint()
+            remote_ip   = str(ipaddress.IPv4Address(bytes(r.raw(4))))
+            remote_port = r.uvarint()
+            owner       = r.str()
+            speed       = (r.uvarint() / 100, r.uvarint() / 100)
+            tot         = (r.uvarint(), r.uvarint())
+            flows.append({
+                "proto":       proto,
+                "local_port":  local_port,
+                "remote_ip":   remote_ip,
+                "remote_port": remote_port,
+                "process":     owner,
+                "speed": {"upload": speed[0], "download": speed[1]},
+                "total": {"upload": tot[0],   "download": tot[1]},
+            })
+
+    sampling = {"rate": 1, "error": 0.0}
+    if r.pos < len(r.buf):
+        sampling = {"rate": r.uvarint(), "error": r.uvarint() / 10000}
+        for entry in process + domains:
+            error = r.uvarint() / 100
+            if error:
+                entry["error"] = error
+
+    health = None
+    if r.pos < len(r.buf):
+        health = {"capture": r.str()}
+        for key in ("packets", "attributed", "unattributed"):
+            health[key] = r.uvarint()
+        drops = r.uvarint()
+        health["drops"]           = drops - 1 if drops else None
+        health["cpu_percent"]     = r.uvarint() / 100
+        health["rss_bytes"]       = r.uvarint()
+        health["worker_restarts"] = r.uvarint()
+        for key in HEALTH_LATENCIES:
+            summary = {"count": r.uvarint()}
+            for q in HEALTH_QUANTILES[1:]:
+                summary[q] = r.uvarint() / 10
+            health[key] = summary
+
+    series = None
+    if r.pos < len(r.buf):
+        step   = r.uvarint() / 1000
+        pairs  = [(r.uvarint(), r.uvarint()) for _ in range(r.uvarint())]
+        series = {
+            "step":     step,
+            "upload":   [up   for up, _down in pairs],
+            "download": [down for _up, down in pairs],
+        }
+
+    dests = None
+    if r.pos < len(r.buf):
+        dests = {key: r.uvarint() for key in ("capacity", "total", "floor")}
+        top   = []
+        for _ in range(r.uvarint()):
+            ip   = str(ipaddress.IPv4Address(bytes(r.raw(4))))
+            up, down, error = r.uvarint(), r.uvarint(), r.uvarint()
+            top.append({"ip": ip, "bytes": up + down + error,
+                        "upload": up, "download": down, "error": error})
+        dests["top"] = top
+
+    session = {
+        "seq":      seq,
+        "identity": identity,
+        "total":    total,
+        "procs":    procs,
+        "names":    names,
+    }
+    return seq, {
+        **identity,
+        "timestamp":   ts,
+        "mac":         mac,
+        "usage":       {"upload": up,       "download": down},
+        "total_usage": {"upload": total[0], "download": total[1]},
+        "process":     process,
+        "dns":         dns,
+        "domains":     domains,
+        "flows":       flows,
+        "sampling":    sampling,
+        **({"agent_health": health} if health is not None else {}),
+        **({"series": series} if series is not None else {}),
+        **({"destinations": dests} if dests is not None else {}),
+    }, session
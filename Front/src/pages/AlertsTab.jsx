@@ -1,6 +1,6 @@
 import React, { useState, useEffect, useRef, useMemo } from "react";
-import axios from "axios";
-import { useSelector } from "react-redux";
+import { useDispatch, useSelector } from "react-redux";
+import { acknowledgeAlert, getAlerts, pollAlerts } from "../redux/alertsSlice";
 
 const SEVERITY_RANK = { high: 0, medium: 1, low: 2 };
 
@@ -28,10 +28,17 @@ const SEVERITY_COLOR = {
   low:    { bg: "#4a558022", border: "#4a558055", badge: "#4a5580", text: "#4a5580" },
 };
 
+// Idle time of an inactive alert, counted from the agent's last report
+// (an alert is only re-sent when it opens, resolves, is acknowledged or its
+// severity or message changes; not every second, nor on every report).
+const secondsIdle = (alert) =>
+  alert.last_report ? Math.max(0, Math.floor(Date.now() / 1000 - alert.last_report)) : alert.seconds_idle;
+
 const AlertsTab = ({ onAlertCount, selectedLab = "All" }) => {
-  const allPCs = useSelector((state) => state.pcs.pcs);
+  const allPCs    = useSelector((state) => state.pcs.pcs);
+  const rawAlerts = useSelector(getAlerts);
+  const dispatch  = useDispatch();
 
-  const [rawAlerts,     setRawAlerts]     = useState([]);
   const [loading,       setLoading]       = useState(true);
   const [error,         setError]         = useState("");
   const [filterSeverity,setFilterSeverity]= useState("all");
@@ -50,8 +57,7 @@ const AlertsTab = ({ onAlertCount, selectedLab = "All" }) => {
   const fetchAlerts = async () => {
     setError("");
     try {
-      const res = await axios.get("http://127.0.0.1:5000/alerts");
-      setRawAlerts(res.data.alerts || []);
+      await dispatch(pollAlerts());
     } catch (err) {
       setError("Failed to fetch alerts — is the server running?");
     } finally {
@@ -192,10 +198,11 @@ const AlertsTab = ({ onAlertCount, selectedLab = "All" }) => {
         </div>
       ) : (
         <div style={{ display: "flex", flexDirection: "column", gap: "8px" }}>
-          {displayedAlerts.map((alert, idx) => {
-            const s = SEVERITY_COLOR[alert.severity] ?? SEVERITY_COLOR.low;
+          {displayedAlerts.map((alert) => {
+            const s    = SEVERITY_COLOR[alert.severity] ?? SEVERITY_COLOR.low;
+            const idle = secondsIdle(alert);
             return (
-              <div key={idx} style={{
+              <div key={alert.id} style={{
                 display: "flex", alignItems: "flex-start", gap: "12px",
                 background: s.bg, border: `1px solid ${s.border}`,
                 borderRadius: "8px", padding: "12px 16px",
@@ -252,11 +259,26 @@ const AlertsTab = ({ onAlertCount, selectedLab = "All" }) => {
                   {alert.type === "blacklist" && (
                     <div>Site: <span style={{ color: s.text, fontWeight: 600 }}>{alert.site}</span></div>
                   )}
-                  {alert.type === "inactive" && (
+                  {alert.type === "inactive" && idle >= 0 && (
                     <div>Idle: <span style={{ color: s.text, fontWeight: 600 }}>
-                      {Math.floor(alert.seconds_idle / 60)}m {alert.seconds_idle % 60}s
+                      {Math.floor(idle / 60)}m {idle % 60}s
                     </span></div>
                   )}
+                  {alert.acknowledged_at ? (
+                    <div style={{ marginTop: "4px" }}>Acknowledged</div>
+                  ) : (
+                    <button
+                      onClick={() => dispatch(acknowledgeAlert(alert.id)).catch(() => {})}
+                      style={{
+                        marginTop: "6px", padding: "3px 10px", borderRadius: "6px",
+                        border: `1px solid ${s.border}`, background: "transparent",
+                        color: s.text, fontFamily: mono, fontSize: "10px",
+                        fontWeight: 600, cursor: "pointer", letterSpacing: "0.06em",
+                      }}
+                    >
+                      ACK
+                    </button>
+                  )}
                 </div>
 
               </div>
@@ -1,15 +1,18 @@
 import React, { useState, useEffect, useRef, useMemo } from "react";
 import { useSelector } from "react-redux";
 import axios from "axios";
+import { getAgents, getStreamState } from "../redux/liveSlice";
 import {
   LineChart, Line, XAxis, YAxis, CartesianGrid,
   Tooltip, Legend, ResponsiveContainer
 } from "recharts";
 
-const BASE          = "http://127.0.0.1:5000";
-const POLL_INTERVAL = 3000;
-const MAX_POINTS    = 20;
-const mono          = "'JetBrains Mono', monospace";
+const BASE            = "http://127.0.0.1:5000";
+const POLL_INTERVAL   = 3000;         // history refresh while the stream is down
+const HISTORY_REFRESH = 30000;        // history refresh while reports are pushed
+const MAX_POINTS      = 120;          // per PC, thinned by the server (LTTB)
+const HISTORY_SPAN    = 15 * 60;      // seconds of history in the chart
+const mono            = "'JetBrains Mono', monospace";
 
 const LAB_RANGES = {
   All:      [0, 100],
@@ -47,6 +50,11 @@ function fmtBytes(b, speed = false) {
   return `${b.toFixed(0)} B${suffix}`;
 }
 
+function fmtTime(t) {
+  const d = new Date(t * 1000);
+  return [d.getHours(), d.getMinutes(), d.getSeconds()].map((n) => String(n).padStart(2, "0")).join(":");
+}
+
 // ── Detail Modal ──────────────────────────────────────────────────────────────
 const DetailModal = ({ item, type, onClose }) => {
   if (!item) return null;
@@ -129,53 +137,26 @@ const CustomTooltip = ({ active, payload, label }) => {
 };
 
 // ── Top Sites ─────────────────────────────────────────────────────────────────
-const LabTopSites = ({ assignedPCs, colorMap, onSelect }) => {
-  const [sites,   setSites]   = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [rawData, setRawData] = useState({});
-
-  useEffect(() => {
-    if (!assignedPCs?.length) return;
-
-    const fetch_ = async () => {
-      try {
-        const results = await Promise.all(
-          assignedPCs.map((pc) =>
-            axios.get(`${BASE}/data/${pc.mac}`)
-              .then((r) => ({ pc, dns: r.data?.dns ?? [], hostname: r.data?.hostname }))
-              .catch(() => ({ pc, dns: [], hostname: null }))
-          )
-        );
-
-        const domainMap = {};
-        results.forEach(({ pc, dns, hostname }) => {
-          dns.filter(filterDomain).forEach((domain) => {
-            if (!domainMap[domain]) domainMap[domain] = [];
-            if (!domainMap[domain].find((p) => p.id === pc.id)) {
-              domainMap[domain].push({ ...pc, hostname, color: colorMap[pc.id] });
-            }
-          });
-        });
-
-        setRawData(domainMap);
-
-        const sorted = Object.entries(domainMap)
-          .sort((a, b) => b[1].length - a[1].length)
-          .slice(0, 15)
-          .map(([domain, pcs]) => ({ domain, count: pcs.length }));
-
-        setSites(sorted);
-      } catch (err) {
-        console.error("Failed to fetch top sites:", err);
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetch_();
-    const id = setInterval(fetch_, 10000);
-    return () => clearInterval(id);
-  }, [assignedPCs]);
+const LabTopSites = ({ assignedPCs, agents, loading, colorMap, onSelect }) => {
+  const { sites, rawData } = useMemo(() => {
+    const domainMap = {};
+    assignedPCs.forEach((pc) => {
+      const agent = agents[pc.mac];
+      (agent?.dns ?? []).filter(filterDomain).forEach((domain) => {
+        if (!domainMap[domain]) domainMap[domain] = [];
+        if (!domainMap[domain].find((p) => p.id === pc.id)) {
+          domainMap[domain].push({ ...pc, hostname: agent.hostname, color: colorMap[pc.id] });
+        }
+      });
+    });
+
+    const sorted = Object.entries(domainMap)
+      .sort((a, b) => b[1].length - a[1].length)
+      .slice(0, 15)
+      .map(([domain, pcs]) => ({ domain, count: pcs.length }));
+
+    return { sites: sorted, rawData: domainMap };
+  }, [assignedPCs, agents, colorMap]);
 
   const maxCount = sites[0]?.count || 1;
 
@@ -227,59 +208,33 @@ const LabTopSites = ({ assignedPCs, colorMap, onSelect }) => {
 };
 
 // ── Top Processes ─────────────────────────────────────────────────────────────
-const LabTopProcesses = ({ assignedPCs, colorMap, onSelect }) => {
-  const [procs,   setProcs]   = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [rawData, setRawData] = useState({});
-
-  useEffect(() => {
-    if (!assignedPCs?.length) return;
-
-    const fetch_ = async () => {
-      try {
-        const results = await Promise.all(
-          assignedPCs.map((pc) =>
-            axios.get(`${BASE}/data/${pc.mac}`)
-              .then((r) => ({ pc, process: r.data?.process ?? [], hostname: r.data?.hostname }))
-              .catch(() => ({ pc, process: [], hostname: null }))
-          )
-        );
-
-        const procMap = {};
-        results.forEach(({ pc, process, hostname }) => {
-          process.forEach((p) => {
-            if (!procMap[p.name]) procMap[p.name] = { upload: 0, download: 0, pcs: [] };
-            procMap[p.name].upload   += p.speed?.upload   ?? 0;
-            procMap[p.name].download += p.speed?.download ?? 0;
-            if (!procMap[p.name].pcs.find((x) => x.id === pc.id)) {
-              procMap[p.name].pcs.push({
-                ...pc, hostname, color: colorMap[pc.id],
-                upload:   p.speed?.upload   ?? 0,
-                download: p.speed?.download ?? 0,
-              });
-            }
+const LabTopProcesses = ({ assignedPCs, agents, loading, colorMap, onSelect }) => {
+  const { procs, rawData } = useMemo(() => {
+    const procMap = {};
+    assignedPCs.forEach((pc) => {
+      const agent    = agents[pc.mac];
+      const hostname = agent?.hostname;
+      (agent?.process ?? []).forEach((p) => {
+        if (!procMap[p.name]) procMap[p.name] = { upload: 0, download: 0, pcs: [] };
+        procMap[p.name].upload   += p.speed?.upload   ?? 0;
+        procMap[p.name].download += p.speed?.download ?? 0;
+        if (!procMap[p.name].pcs.find((x) => x.id === pc.id)) {
+          procMap[p.name].pcs.push({
+            ...pc, hostname, color: colorMap[pc.id],
+            upload:   p.speed?.upload   ?? 0,
+            download: p.speed?.download ?? 0,
           });
-        });
+        }
+      });
+    });
 
-        setRawData(procMap);
+    const sorted = Object.entries(procMap)
+      .sort((a, b) => (b[1].upload + b[1].download) - (a[1].upload + a[1].download))
+      .slice(0, 10)
+      .map(([name, stats]) => ({ name, upload: stats.upload, download: stats.download, count: stats.pcs.length }));
 
-        const sorted = Object.entries(procMap)
-          .sort((a, b) => (b[1].upload + b[1].download) - (a[1].upload + a[1].download))
-          .slice(0, 10)
-          .map(([name, stats]) => ({ name, upload: stats.upload, download: stats.download, count: stats.pcs.length }));
-
-        setProcs(sorted);
-      } catch (err) {
-        console.error("Failed to fetch top processes:", err);
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetch_();
-    const id = setInterval(fetch_, POLL_INTERVAL);
-    return () => clearInterval(id);
-  }, [assignedPCs]);
+    return { procs: sorted, rawData: procMap };
+  }, [assignedPCs, agents, colorMap]);
 
   const maxSpeed = Math.max(...procs.map((p) => p.upload + p.download), 1);
 
@@ -345,11 +300,12 @@ const LabTopProcesses = ({ assignedPCs, colorMap, onSelect }) => {
 // ── AnalysisTab ───────────────────────────────────────────────────────────────
 const AnalysisTab = ({ selectedLab, filteredPCs }) => {
   const allPCs      = useSelector((state) => state.pcs.pcs);
+  const agents      = useSelector(getAgents);
+  const streaming   = useSelector(getStreamState);
   const [chartMode, setChartMode] = useState("download");
-  const [history,   setHistory]   = useState([]);
+  const [points,    setPoints]    = useState({});   // PC id -> [[t, upload, download]]
   const [modal,     setModal]     = useState(null);
   const [modalType, setModalType] = useState(null);
-  const [totals,    setTotals]    = useState({ upload: 0, download: 0 });
 
   const assignedPCs = useMemo(() => {
     const [start, end] = LAB_RANGES[selectedLab] ?? [0, 100];
@@ -364,65 +320,84 @@ const AnalysisTab = ({ selectedLab, filteredPCs }) => {
     return map;
   }, [assignedPCs]);
 
+  // Live numbers come from the push stream, the chart from the server's
+  // history, so it survives reloads and does not depend on how long the tab
+  // is open. Between history fetches each pushed report extends its line.
   useEffect(() => {
     if (!assignedPCs.length) return;
-    setHistory([]);
+    setPoints({});
 
-    const poll = async () => {
+    const load = async () => {
       try {
+        const from    = Math.floor(Date.now() / 1000) - HISTORY_SPAN;
         const results = await Promise.all(
           assignedPCs.map((pc) =>
-            axios.get(`${BASE}/data/${pc.mac}`)
-              .then((r) => ({
-                id:        pc.id,
-                download:  r.data?.usage?.download       ?? 0,
-                upload:    r.data?.usage?.upload         ?? 0,
-                totalUp:   r.data?.total_usage?.upload   ?? 0,
-                totalDown: r.data?.total_usage?.download ?? 0,
-              }))
-              .catch(() => ({ id: pc.id, download: 0, upload: 0, totalUp: 0, totalDown: 0 }))
+            axios.get(`${BASE}/history/${pc.mac}`, { params: { from, points: MAX_POINTS } })
+              .then((r) => [pc.id, r.data?.points ?? []])
+              .catch(() => [pc.id, []])
           )
         );
-
-        setTotals({
-          upload:   results.reduce((s, r) => s + r.totalUp,   0),
-          download: results.reduce((s, r) => s + r.totalDown, 0),
-        });
-
-        const now   = new Date();
-        const label = `${String(now.getHours()).padStart(2,"0")}:${String(now.getMinutes()).padStart(2,"0")}:${String(now.getSeconds()).padStart(2,"0")}`;
-        const point = { time: label };
-        results.forEach(({ id, download, upload, totalUp, totalDown }) => {
-          point[`${id}_dl`]   = download;
-          point[`${id}_ul`]   = upload;
-          point[`${id}_tup`]  = totalUp;
-          point[`${id}_tdwn`] = totalDown;
-        });
-
-        setHistory((prev) => {
-          const next = [...prev, point];
-          return next.length > MAX_POINTS ? next.slice(next.length - MAX_POINTS) : next;
-        });
+        setPoints(Object.fromEntries(results));
       } catch (err) {
-        console.error("Analysis poll error:", err);
+        console.error("Analysis history error:", err);
       }
     };
 
-    poll();
-    const id = setInterval(poll, POLL_INTERVAL);
+    load();
+    const id = setInterval(load, streaming ? HISTORY_REFRESH : POLL_INTERVAL);
     return () => clearInterval(id);
-  }, [assignedPCs]);
+  }, [assignedPCs, streaming]);
 
-  const latest = history[history.length - 1];
+  useEffect(() => {
+    setPoints((prev) => {
+      let next = prev;
+      assignedPCs.forEach((pc) => {
+        const agent = agents[pc.mac];
+        const line  = prev[pc.id];
+        if (!agent || !line || (line.length && line[line.length - 1][0] >= agent.timestamp)) return;
+        if (next === prev) next = { ...prev };
+        next[pc.id] = [...line, [agent.timestamp, agent.usage?.upload ?? 0, agent.usage?.download ?? 0]];
+      });
+      return next;
+    });
+  }, [agents, assignedPCs]);
+
+  // One row per timestamp; PCs without a point there are bridged by connectNulls.
+  const history = useMemo(() => {
+    const rows = {};
+    Object.entries(points).forEach(([id, line]) => {
+      line.forEach(([t, upload, download]) => {
+        const row = rows[t] ?? (rows[t] = { t, time: fmtTime(t) });
+        row[`${id}_dl`] = download;
+        row[`${id}_ul`] = upload;
+      });
+    });
+    return Object.values(rows).sort((a, b) => a.t - b.t);
+  }, [points]);
+
+  const live = useMemo(() => Object.fromEntries(assignedPCs.map((pc) => {
+    const agent = agents[pc.mac];
+    return [pc.id, {
+      download:  agent?.usage?.download       ?? 0,
+      upload:    agent?.usage?.upload         ?? 0,
+      totalUp:   agent?.total_usage?.upload   ?? 0,
+      totalDown: agent?.total_usage?.download ?? 0,
+    }];
+  })), [agents, assignedPCs]);
+
+  const totals = {
+    upload:   Object.values(live).reduce((s, p) => s + p.totalUp,   0),
+    download: Object.values(live).reduce((s, p) => s + p.totalDown, 0),
+  };
 
   const statsRows = assignedPCs.map((pc, i) => ({
     id:        pc.id,
     mac:       pc.mac,
     color:     COLORS[i % COLORS.length],
-    download:  latest?.[`${pc.id}_dl`]   ?? 0,
-    upload:    latest?.[`${pc.id}_ul`]   ?? 0,
-    totalUp:   latest?.[`${pc.id}_tup`]  ?? 0,
-    totalDown: latest?.[`${pc.id}_tdwn`] ?? 0,
+    download:  live[pc.id]?.download  ?? 0,
+    upload:    live[pc.id]?.upload    ?? 0,
+    totalUp:   live[pc.id]?.totalUp   ?? 0,
+    totalDown: live[pc.id]?.totalDown ?? 0,
   })).sort((a, b) => b.download - a.download); // live sorted
 
   const totalDownload = statsRows.reduce((s, p) => s + p.download, 0);
@@ -506,10 +481,10 @@ const AnalysisTab = ({ selectedLab, filteredPCs }) => {
                 return (
                   <React.Fragment key={pc.id}>
                     {(chartMode === "download" || chartMode === "both") && (
-                      <Line type="monotone" dataKey={`${pc.id}_dl`} name={`${pc.id} ↓`} stroke={color} strokeWidth={2} dot={false} activeDot={{ r: 4 }} />
+                      <Line type="monotone" dataKey={`${pc.id}_dl`} name={`${pc.id} ↓`} stroke={color} strokeWidth={2} dot={false} activeDot={{ r: 4 }} connectNulls />
                     )}
                     {(chartMode === "upload" || chartMode === "both") && (
-                      <Line type="monotone" dataKey={`${pc.id}_ul`} name={`${pc.id} ↑`} stroke={color} strokeWidth={2} strokeDasharray="4 2" dot={false} activeDot={{ r: 4 }} />
+                      <Line type="monotone" dataKey={`${pc.id}_ul`} name={`${pc.id} ↑`} stroke={color} strokeWidth={2} strokeDasharray="4 2" dot={false} activeDot={{ r: 4 }} connectNulls />
                     )}
                   </React.Fragment>
                 );
@@ -571,6 +546,8 @@ const AnalysisTab = ({ selectedLab, filteredPCs }) => {
       <div style={{ marginBottom: "20px" }}>
         <LabTopProcesses
           assignedPCs={assignedPCs}
+          agents={agents}
+          loading={!streaming}
           colorMap={colorMap}
           onSelect={(item) => { setModal(item); setModalType("process"); }}
         />
@@ -582,6 +559,8 @@ const AnalysisTab = ({ selectedLab, filteredPCs }) => {
       </div>
       <LabTopSites
         assignedPCs={assignedPCs}
+        agents={agents}
+        loading={!streaming}
         colorMap={colorMap}
         onSelect={(item) => { setModal(item); setModalType("site"); }}
       />
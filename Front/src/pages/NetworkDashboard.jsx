@@ -1,11 +1,13 @@
 import { useState, useEffect, useMemo } from "react";
-import { useSelector } from "react-redux";
+import { useDispatch, useSelector } from "react-redux";
 import React from "react";
 import axios from "axios";
 import PCMonitorTab from "./PCMonitorTab";
 import AlertsTab from "./AlertsTab";
 import ConfigTab from "./ConfigTab";
 import AnalysisTab from "./AnalysisTab";
+import { getAlertCount, pollAlerts } from "../redux/alertsSlice";
+import { getStreamState, openStream } from "../redux/liveSlice";
 
 const TABS = [
   { id: "monitor",  label: "PC Monitor" },
@@ -34,18 +36,23 @@ const NetworkDashboard = () => {
   const [selectedLab, setSelectedLab] = useState("All");
   const [noOfRows,    setNoOfRows]    = useState(4);
 
-  const mockPCs = useSelector((state) => state.pcs.pcs);
+  const mockPCs    = useSelector((state) => state.pcs.pcs);
+  const openAlerts = useSelector(getAlertCount);
+  const streaming  = useSelector(getStreamState);
+  const dispatch   = useDispatch();
 
-  // ── Poll /status + /alerts every 5s ──────────────────────────────────────
+  // ── Push stream: agents and alerts for every tab ─────────────────────────
+  useEffect(() => openStream(dispatch), [dispatch]);
+
+  // ── Poll /status every 5s (+ alert changes while the stream is down) ─────
   useEffect(() => {
     const poll = async () => {
       try {
-        const [statusRes, alertsRes] = await Promise.all([
+        const [statusRes] = await Promise.all([
           axios.get("http://127.0.0.1:5000/status"),
-          axios.get("http://127.0.0.1:5000/alerts"),
+          streaming ? null : dispatch(pollAlerts()),
         ]);
-        setAgentCount(statusRes.data.agents       || 0);
-        setAlertCount(alertsRes.data.total_alerts || 0);
+        setAgentCount(statusRes.data.agents || 0);
         setIsLive((statusRes.data.agents || 0) > 0);
         setCollecting(statusRes.data.collecting ?? true);
       } catch (_) {}
@@ -53,7 +60,9 @@ const NetworkDashboard = () => {
     poll();
     const id = setInterval(poll, 5000);
     return () => clearInterval(id);
-  }, []);
+  }, [dispatch, streaming]);
+
+  useEffect(() => { setAlertCount(openAlerts); }, [openAlerts]);
 
   // ── Timer counts up while live + collecting ───────────────────────────────
   useEffect(() => {
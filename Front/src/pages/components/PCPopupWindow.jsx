@@ -1,7 +1,9 @@
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useMemo, useState } from "react";
 import pcImage from "./assets/pciamge.png";
 import { useSelector } from "react-redux";
 import axios from "axios";
+import { getAlerts } from "../../redux/alertsSlice";
+import { getAgents, getSubscriber, watchAgent } from "../../redux/liveSlice";
 
 const FETCH_INTERVAL = 3000;
 
@@ -19,76 +21,63 @@ function fmtSpeed(bps) { return fmtBytes(bps) + "/s"; }
 const PCPopupWindow = ({ selectedId }) => {
   const allPCs     = useSelector((state) => state.pcs.pcs);
   const selectedPC = allPCs.find((pc) => pc.id === selectedId);
+  const allAlerts  = useSelector(getAlerts);
+  const agents     = useSelector(getAgents);
+  const subscriber = useSelector(getSubscriber);   // null while the stream is down
 
-  const [pcData,   setPcData]   = useState(null);
-  const [pcAlerts, setPcAlerts] = useState([]);
-  const [error,    setError]    = useState(null);
+  const [polled, setPolled] = useState(null);
+  const [error,  setError]  = useState(null);
 
   // ── Reset on every PC change ──────────────────────────────────────────────
   useEffect(() => {
-    setPcData(null);
+    setPolled(null);
     setError(null);
-    setPcAlerts([]);
   }, [selectedId]);   // ← clears stale data before new fetch fires
 
-  // ── Fetch agent data ──────────────────────────────────────────────────────
+  // ── Agent data: pushed over the stream; the server is told which agent is
+  //    open so it asks it for fast reports ──────────────────────────────────
   useEffect(() => {
+    if (subscriber == null || !selectedPC?.mac || selectedPC.mac === "00:00:00:00:00:00") return;
+    watchAgent(subscriber, selectedPC.mac);
+    return () => { watchAgent(subscriber, null); };
+  }, [subscriber, selectedPC?.mac]);
+
+  // ── Without the stream, poll /data/<mac> as before ────────────────────────
+  useEffect(() => {
+    if (subscriber != null) return;
     if (!selectedPC?.mac || selectedPC.mac === "00:00:00:00:00:00") return;
     const fetch_ = async () => {
       try {
         const res = await axios.get(`http://127.0.0.1:5000/data/${selectedPC.mac}`);
-        setPcData(res.data);
+        setPolled(res.data);
         setError(null);
       } catch { setError("Agent offline"); }
     };
     fetch_();
     const id = setInterval(fetch_, FETCH_INTERVAL);
     return () => clearInterval(id);
-  }, [selectedPC?.mac]);
+  }, [subscriber, selectedPC?.mac]);
 
-  // ── Fetch alerts ──────────────────────────────────────────────────────────
-  useEffect(() => {
-    if (!selectedPC?.mac || selectedPC.mac === "00:00:00:00:00:00") return;
-    const fetch_ = async () => {
-      try {
-        const res  = await axios.get("http://127.0.0.1:5000/alerts");
-        const RANK = { high: 0, medium: 1, low: 2 };
-        setPcAlerts(
-          (res.data.alerts || [])
-            .filter((a) => a.mac === selectedPC.mac)
-            .sort((a, b) => (RANK[a.severity] ?? 3) - (RANK[b.severity] ?? 3))
-        );
-      } catch (_) {}
-    };
-    fetch_();
-    const id = setInterval(fetch_, 5000);
-    return () => clearInterval(id);
-  }, [selectedPC?.mac]);
+  const pcData = subscriber != null ? agents[selectedPC?.mac] ?? null : polled;
 
-  useEffect(() => {
-    if (!selectedPC?.mac || selectedPC.mac === "00:00:00:00:00:00") return;
-    const fetch_ = async () => {
-      try {
-        const res  = await axios.get("http://127.0.0.1:5000/alerts");
-        const RANK = { high: 0, medium: 1, low: 2 };
-        setPcAlerts(
-          (res.data.alerts || [])
-            .filter((a) => a.mac === selectedPC.mac)
-            .sort((a, b) => (RANK[a.severity] ?? 3) - (RANK[b.severity] ?? 3))
-        );
-      } catch (_) {}
-    };
-    fetch_();
-    const id = setInterval(fetch_, 5000);
-    return () => clearInterval(id);
-  }, [selectedPC?.mac]);
+  // ── Alerts (kept current by the dashboard's stream) ───────────────────────
+  const pcAlerts = useMemo(() => {
+    const RANK = { high: 0, medium: 1, low: 2 };
+    return allAlerts
+      .filter((a) => a.mac === selectedPC?.mac)
+      .sort((a, b) => (RANK[a.severity] ?? 3) - (RANK[b.severity] ?? 3));
+  }, [allAlerts, selectedPC?.mac]);
 
   const unassigned = selectedPC?.mac === "00:00:00:00:00:00";
-  const isOnline   = pcData && (Date.now() / 1000 - pcData.timestamp) <= 10;
+  // Idle agents report less often (server directives); allow two intervals.
+  const staleAfter = Math.max(10, 2 * (pcData?.interval ?? 5));
+  const isOnline   = pcData && (Date.now() / 1000 - pcData.timestamp) <= staleAfter;
   const state      = pcData?.state ?? "sending";
 
   const processes  = pcData?.process ?? [];
   const dnsList    = pcData?.dns     ?? [];
+  const sampleRate = pcData?.sampling?.rate  ?? 1;
+  const sampleErr  = pcData?.sampling?.error ?? 0;
 
   const maxSpeed = Math.max(
     ...processes.map((p) => (p.speed?.upload ?? 0) + (p.speed?.download ?? 0)),
@@ -124,6 +113,12 @@ const PCPopupWindow = ({ selectedId }) => {
           {isOnline ? "live" : "offline"}
         </span>
 
+        {sampleRate > 1 && (
+          <span title={`Agent counts 1 in ${sampleRate} packets; process totals are estimates (95% confidence)`} style={{ fontSize: "10px", padding: "3px 10px", borderRadius: "20px", fontWeight: 600, letterSpacing: "0.08em", textTransform: "uppercase", background: "#2a1e0e", color: "#ffaa00", border: "1px solid #4a3a1a" }}>
+            sampled 1/{sampleRate} ±{(sampleErr * 100).toFixed(1)}%
+          </span>
+        )}
+
         <span style={{ fontSize: "10px", padding: "3px 10px", borderRadius: "20px", fontWeight: 600, letterSpacing: "0.08em", marginLeft: "auto", background: "#141828", color: "#4a5580", border: "1px solid #1e2540" }}>
           {selectedId}
         </span>
@@ -148,14 +143,17 @@ const PCPopupWindow = ({ selectedId }) => {
       {/* ── Speed row ── */}
       <div style={{ display: "grid", gridTemplateColumns: "repeat(4, 1fr)", border: "1px solid #1e2540", borderBottom: "none" }}>
         {[
-          { label: "Upload Speed",      value: fmtSpeed(pcData?.usage?.upload   ?? 0), color: "#00ffb2" },
-          { label: "Download Speed",    value: fmtSpeed(pcData?.usage?.download ?? 0), color: "#00c2ff" },
+          { label: "Upload Speed",      value: fmtSpeed(pcData?.usage?.upload   ?? 0), color: "#00ffb2", peak: pcData?.peak?.upload },
+          { label: "Download Speed",    value: fmtSpeed(pcData?.usage?.download ?? 0), color: "#00c2ff", peak: pcData?.peak?.download },
           { label: "Total Uploaded",    value: fmtBytes(pcData?.total_usage?.upload   ?? 0), color: "#5de8b8" },
           { label: "Total Downloaded",  value: fmtBytes(pcData?.total_usage?.download ?? 0), color: "#5bb8e8" },
-        ].map(({ label, value, color }, i) => (
+        ].map(({ label, value, color, peak }, i) => (
           <div key={label} style={{ padding: "18px 20px", borderRight: i < 3 ? "1px solid #1e2540" : "none", background: "#0e1221" }}>
             <div style={{ fontSize: "10px", color: "#4a5580", textTransform: "uppercase", letterSpacing: "0.08em", marginBottom: "8px" }}>{label}</div>
             <div style={{ fontSize: "1.3rem", fontWeight: 600, color }}>{value}</div>
+            {peak > 0 && (
+              <div title="Highest 1-second rate in the last report" style={{ fontSize: "10px", color: "#4a5580", marginTop: "4px" }}>peak {fmtSpeed(peak)}</div>
+            )}
           </div>
         ))}
       </div>
@@ -164,7 +162,7 @@ const PCPopupWindow = ({ selectedId }) => {
         <div style={{ textAlign: "center", padding: "3rem", color: "#4a5580", fontSize: "13px", border: "1px solid #1e2540", borderRadius: "0 0 10px 10px" }}>
           Assign a MAC address to view network data.
         </div>
-      ) : error ? (
+      ) : error && subscriber == null ? (
         <div style={{ textAlign: "center", padding: "3rem", color: "#ff4f6a", fontSize: "13px", border: "1px solid #1e2540", borderRadius: "0 0 10px 10px" }}>
           {error}
         </div>
@@ -197,7 +195,7 @@ const PCPopupWindow = ({ selectedId }) => {
                         const totDn = proc.total?.download ?? 0;
                         const barW  = Math.round(((spdUp + spdDn) / maxSpeed) * 100);
                         return (
-                          <tr key={i} style={{ borderBottom: "1px solid #1e2540" }}>
+                          <tr key={i} style={{ borderBottom: "1px solid #1e2540" }} title={proc.error ? `±${fmtSpeed(proc.error)} (95%)` : undefined}>
                             <td style={{ padding: "8px 12px", fontSize: "11px", color: "#4a5580", width: "18px" }}>{i + 1}</td>
                             <td style={{ padding: "8px 12px", fontSize: "11px", color: "#e2e8f0", fontWeight: 600, maxWidth: "120px", overflow: "hidden", textOverflow: "ellipsis", whiteSpace: "nowrap" }} title={proc.name}>{proc.name}</td>
                             <td style={{ padding: "8px 12px" }}>
@@ -260,10 +258,10 @@ const PCPopupWindow = ({ selectedId }) => {
                   No alerts for this PC
                 </div>
               ) : (
-                pcAlerts.map((alert, i) => {
+                pcAlerts.map((alert) => {
                   const s = SEVERITY[alert.severity] ?? SEVERITY.low;
                   return (
-                    <div key={i} style={{ padding: "10px 16px", borderBottom: "1px solid #1e2540", background: s.bg, display: "flex", alignItems: "flex-start", gap: "10px" }}>
+                    <div key={alert.id} style={{ padding: "10px 16px", borderBottom: "1px solid #1e2540", background: s.bg, display: "flex", alignItems: "flex-start", gap: "10px" }}>
                       <span style={{ fontSize: "10px", fontWeight: 700, padding: "2px 8px", borderRadius: "20px", background: s.badge, color: "#080b14", flexShrink: 0, textTransform: "uppercase" }}>
                         {alert.severity}
                       </span>
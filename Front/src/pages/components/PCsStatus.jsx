@@ -1,13 +1,38 @@
-import React, { useEffect, useState } from "react";
+import React, { useEffect, useMemo, useState } from "react";
+import { useSelector } from "react-redux";
 import PCItem from "./PCItem";
 import axios from "axios";
+import { getAlerts } from "../../redux/alertsSlice";
+import { getAgents, getStreamState } from "../../redux/liveSlice";
 
 const PCsStatus = ({ mockPCs, selectedLab, filteredPCs, noOfRows, setClicked }) => {
   const [error,     setError]     = useState("");
-  const [macStatus, setMacStatus] = useState({});
-  const [macFlags,  setMacFlags]  = useState({});
-
+  const [polled,    setPolled]    = useState({ macStatus: {}, macFlags: {} });
+
+  const agents    = useSelector(getAgents);
+  const alerts    = useSelector(getAlerts);
+  const streaming = useSelector(getStreamState);
+
+  // ── From the push stream: an agent is active until its inactivity alert
+  //    opens; blacklist and limit flags are its open alerts ──────────────────
+  const pushed = useMemo(() => {
+    const macStatus = {};
+    const macFlags  = {};
+    Object.values(agents).forEach(({ mac, hostname }) => {
+      macStatus[mac] = { is_active: true, hostname };
+    });
+    alerts.forEach(({ mac, type }) => {
+      if (type === "inactive" && macStatus[mac]) macStatus[mac].is_active = false;
+      if (!macFlags[mac]) macFlags[mac] = {};
+      if (type === "blacklist")  macFlags[mac].accessed_blacklist = true;
+      if (type === "high_usage") macFlags[mac].limit_exceeded     = true;
+    });
+    return { macStatus, macFlags };
+  }, [agents, alerts]);
+
+  // ── Without the stream, poll as before ────────────────────────────────────
   useEffect(() => {
+    if (streaming) return;
     const fetchData = async () => {
       try {
         const [activeRes, blacklistRes, limitRes] = await Promise.all([
@@ -16,8 +41,6 @@ const PCsStatus = ({ mockPCs, selectedLab, filteredPCs, noOfRows, setClicked })
           axios.get("http://127.0.0.1:5000/check_limit"),
         ]);
 
-        setMacStatus(activeRes.data);
-
         const flags = {};
         blacklistRes.data.forEach(({ mac, accessed_blacklist }) => {
           if (!flags[mac]) flags[mac] = {};
@@ -27,7 +50,7 @@ const PCsStatus = ({ mockPCs, selectedLab, filteredPCs, noOfRows, setClicked })
           if (!flags[mac]) flags[mac] = {};
           flags[mac].limit_exceeded = exceeded;
         });
-        setMacFlags(flags);
+        setPolled({ macStatus: activeRes.data, macFlags: flags });
 
       } catch (err) {
         setError("Error fetching data");
@@ -38,7 +61,9 @@ const PCsStatus = ({ mockPCs, selectedLab, filteredPCs, noOfRows, setClicked })
     fetchData();
     const interval = setInterval(fetchData, 5000);
     return () => clearInterval(interval);
-  }, []);
+  }, [streaming]);
+
+  const { macStatus, macFlags } = streaming ? pushed : polled;
 
   const getActive        = (pc) => macStatus[pc.mac]?.is_active        ?? false;
   const getHostname      = (pc) => macStatus[pc.mac]?.hostname          ?? pc.id;
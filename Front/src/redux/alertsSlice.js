@@ -0,0 +1,58 @@
+import { createSlice, createSelector } from "@reduxjs/toolkit";
+import axios from "axios";
+
+// Open alerts by id, kept in step with the server by the /stream push
+// (see liveSlice) or, without it, by polling /alerts?since=<cursor>: each
+// answer only carries the alerts opened, changed or resolved since the
+// previous one.
+const initialState = {
+  byId:   {},
+  cursor: null,
+};
+
+const alertsSlice = createSlice({
+  name: "alerts",
+  initialState,
+  reducers: {
+    applyAlerts: (state, action) => {
+      // Pushed changes carry only the fields that changed
+      const { reset, changes, cursor } = action.payload;
+      if (reset) state.byId = {};
+      for (const change of changes) {
+        const alert = { ...state.byId[change.id], ...change };
+        if (alert.resolved_at) delete state.byId[alert.id];
+        else state.byId[alert.id] = alert;
+      }
+      if (cursor !== undefined) state.cursor = cursor;
+    },
+    updateAlert: (state, action) => {
+      if (state.byId[action.payload.id]) state.byId[action.payload.id] = action.payload;
+    },
+  },
+});
+
+export const { applyAlerts, updateAlert } = alertsSlice.actions;
+
+export const pollAlerts = () => async (dispatch, getState) => {
+  const cursor = getState().alerts.cursor;
+  const res    = await axios.get("http://127.0.0.1:5000/alerts", {
+    params: cursor ? { since: cursor } : {},
+  });
+  dispatch(applyAlerts({
+    reset:   !cursor || res.data.reset,
+    changes: res.data.changes ?? res.data.alerts ?? [],
+    cursor:  res.data.cursor,
+  }));
+};
+
+export const acknowledgeAlert = (id) => async (dispatch) => {
+  const res = await axios.post(`http://127.0.0.1:5000/alerts/${id}/ack`);
+  dispatch(updateAlert(res.data.alert));
+};
+
+export const getAlerts = createSelector(
+  (state) => state.alerts.byId,
+  (byId) => Object.values(byId)
+);
+export const getAlertCount = (state) => Object.keys(state.alerts.byId).length;
+export default alertsSlice.reducer;
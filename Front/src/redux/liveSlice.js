@@ -0,0 +1,71 @@
+import { createSlice } from "@reduxjs/toolkit";
+import axios from "axios";
+import { applyAlerts } from "./alertsSlice";
+
+// Live agent state pushed by the server over /stream (server-sent events).
+// The first event is a snapshot of every agent and open alert; later ones
+// carry only the fields that changed, which are merged in here.
+const initialState = {
+  agents:     {},
+  subscriber: null,
+  connected:  false,
+};
+
+const liveSlice = createSlice({
+  name: "live",
+  initialState,
+  reducers: {
+    streamSnapshot: (state, action) => {
+      state.agents     = action.payload.agents;
+      state.subscriber = action.payload.subscriber;
+      state.connected  = true;
+    },
+    streamUpdate: (state, action) => {
+      for (const [mac, fields] of Object.entries(action.payload)) {
+        state.agents[mac] = { ...state.agents[mac], ...fields };
+      }
+    },
+    streamClosed: (state) => {
+      state.connected  = false;
+      state.subscriber = null;
+    },
+  },
+});
+
+export const { streamSnapshot, streamUpdate, streamClosed } = liveSlice.actions;
+
+const alertList = (alerts) =>
+  Object.entries(alerts ?? {}).map(([id, fields]) => ({ ...fields, id: Number(id) }));
+
+// Open the stream and feed it into the store; returns a function closing it.
+// The browser reconnects by itself and the server starts over with a snapshot.
+export const openStream = (dispatch) => {
+  const source = new EventSource("http://127.0.0.1:5000/stream");
+  source.addEventListener("snapshot", (e) => {
+    const data = JSON.parse(e.data);
+    dispatch(streamSnapshot({ agents: data.agents, subscriber: data.subscriber }));
+    dispatch(applyAlerts({ reset: true, changes: alertList(data.alerts) }));
+  });
+  source.addEventListener("update", (e) => {
+    const data = JSON.parse(e.data);
+    if (data.agents) dispatch(streamUpdate(data.agents));
+    if (data.alerts) dispatch(applyAlerts({ reset: false, changes: alertList(data.alerts) }));
+  });
+  source.onerror = () => dispatch(streamClosed());
+  return () => { source.close(); dispatch(streamClosed()); };
+};
+
+// Tell the server which agent this dashboard has open (null for none), so it
+// asks that agent for fast reports while the stream stays open.
+export const watchAgent = async (subscriber, mac) => {
+  try {
+    await axios.post(`http://127.0.0.1:5000/stream/${subscriber}/watch`, { mac });
+  } catch (err) {
+    console.error("Failed to watch agent:", err);
+  }
+};
+
+export const getAgents      = (state) => state.live.agents;
+export const getSubscriber  = (state) => state.live.subscriber;
+export const getStreamState = (state) => state.live.connected;
+export default liveSlice.reducer;
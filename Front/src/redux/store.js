@@ -1,10 +1,14 @@
 import { configureStore } from "@reduxjs/toolkit";
+import alertsReducer from "./alertsSlice";
 import blackListReducer from "./blackListSlice";
+import liveReducer from "./liveSlice";
 import pcsReducer from "./pcsSlice";
 
 const store = configureStore({
   reducer: {
+    alerts: alertsReducer,
     blacklist: blackListReducer,
+    live: liveReducer,
     pcs: pcsReducer,
   },
 });
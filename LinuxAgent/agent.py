@@ -1,29 +1,89 @@
 import time
 import json
 import threading
-import urllib.request
 import socket
 import platform
 import psutil
 import getpass
+import ipaddress
 import os
-from collections import defaultdict
-from scapy.all import sniff, DNS, DNSQR, IP, TCP, UDP
+import signal
+import sys
+import argparse
+
+# checkpoint.py and sketch.py are shared with the Windows agent
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import capture
+import checkpoint
+import counters
+import dnsmap
+import flows
+import health
+import procnames
+import rates
+import sampling
+import sketch
+import sockindex
+import transport
+import wire
+import worker
 
 # ─── Config ───────────────────────────────────────────────────────────────────
-SEND_INTERVAL  = 5
-TOP_N_PROCS    = 10
+SEND_INTERVAL  = 5          # seconds; the master may change it, see apply_directives()
+TOP_N_PROCS    = 10         # likewise
+INCLUDE_DNS    = True       # likewise; when False, DNS names wait for a later report
+INTERVAL_RANGE = (1, 300)   # bounds on a master-chosen SEND_INTERVAL
+TOP_N_MAX      = 100
+TOP_N_DOMAINS  = 10
+TOP_N_FLOWS    = 10
+FLOW_CAPACITY  = 16384      # tracked 5-tuples; fixed memory regardless of churn
+PROC_SLOTS     = 4096       # process names with their own counters; the rest count as "other"
+TOP_N_DESTINATIONS = 10
+DEST_CAPACITY  = 256        # remote IPs in the heavy-hitter sketch, see sketch.py
 CACHE_REFRESH  = 0.5
+CAPTURE_MODE   = "auto"     # "auto" | "mmap" | "raw" | "scapy"
+CAPTURE_PROCESS = False     # capture in a separate worker process (not with "scapy")
+SAMPLING       = "auto"     # "auto" adapts 1-in-N sampling to load; an int fixes N (1 = off)
+SAMPLE_MAX_PPS = 20000      # packets/s "auto" lets through before sampling
+SAMPLE_CPU     = 50         # agent CPU % (of one core) above which "auto" samples harder
+WIRE_FORMAT    = "binary"   # "binary" (falls back to "json" on old masters) | "json"
+SPOOL_DIR      = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool")
+CONFIG_FILE    = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.json")
+STATE_FILE     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.state")
+SPOOL_MAX_MB   = 16
+REPLAY_BATCH   = 20         # spooled reports replayed per interval, in one /usage/batch request
+RATE_STEP      = 1.0        # seconds between interface counter samples (report series)
 
 # ─── Shared state ─────────────────────────────────────────────────────────────
-lock                = threading.Lock()
-interval_dns        = set()
-interval_proc_bytes = defaultdict(lambda: {"upload": 0, "download": 0})
-proc_total_bytes    = defaultdict(lambda: {"upload": 0, "download": 0})
-port_pid_cache      = {}
+packet_counters     = counters.PacketCounters(PROC_SLOTS, "other")  # written by the capture thread only
+domain_counters     = counters.PacketCounters(worker.DOMAIN_SLOTS)  # bytes per domain, same rules
+domain_map          = dnsmap.DomainMap()          # remote IP -> domain, capture thread only
+flow_table          = flows.FlowTable(FLOW_CAPACITY)  # written by the capture thread only
+dest_sketch         = sketch.SpaceSaving(DEST_CAPACITY)  # reporter thread only
+sock_index          = sockindex.SocketIndex()
+proc_names          = procnames.ProcNameCache()
 _local_ip           = None
 _iface              = None
+_ring               = None
+_sock               = None                        # raw backend socket
+_sock_stats         = None                        # kernel counters of _sock
+_sample_rate        = 1                           # 1-in-N packets counted, see sampling.py
+_filter_switch      = None                        # capture.FilterSwitch of the mmap/raw backend
+_rate_ctl           = sampling.RateController(SAMPLE_MAX_PPS, SAMPLE_CPU)
+_cpu_procs          = {}                          # pid -> psutil.Process, for cpu_percent()
+_capture_name       = "none"                      # backend in use, for agent_health
+_pkt_stats          = health.PacketStats()        # written by the capture thread only
+_refresh_timer      = health.Timer()              # port-cache refresh duration
+_send_timer         = health.Timer()              # /usage POST duration
+_worker             = None                        # worker.CaptureWorker when CAPTURE_PROCESS
+_encoder            = wire.ReportEncoder()
+_client             = None
+_spool              = None
+_batch_replay       = True                        # master has /usage/batch (until a 404 says not)
+_state              = None                        # checkpoint.Checkpoint of lifetime totals
 io_baseline         = None
+sniff = DNS = DNSQR = IP = TCP = UDP = None       # Scapy, see _load_scapy()
+_rates              = rates.RateSampler(psutil.net_io_counters, RATE_STEP)
 
 # ─── Utilities ────────────────────────────────────────────────────────────────
 
@@ -64,12 +124,6 @@ def get_interface(local_ip):
                 return iface
     return None
 
-def pid_to_name(pid):
-    try:
-        return psutil.Process(pid).name()
-    except Exception:
-        return f"PID-{pid}"
-
 def check_root():
     if os.geteuid() != 0:
         print("Error: agent must be run as root (use sudo)")
@@ -78,32 +132,119 @@ def check_root():
 # ─── Thread 1: port→PID cache refresher ──────────────────────────────────────
 
 def port_cache_refresher():
-    global port_pid_cache
     while True:
-        cache = {}
+        flow_table.now = packet_counters.now = domain_counters.now = time.monotonic()
         try:
-            for conn in psutil.net_connections(kind="inet"):
-                if conn.pid and conn.laddr:
-                    cache[conn.laddr.port] = conn.pid
+            with _refresh_timer:
+                proc_names.retain(sock_index.refresh())
         except Exception:
             pass
-        port_pid_cache = cache
-        time.sleep(CACHE_REFRESH)
-
-# ─── Thread 2: Scapy sniffer ──────────────────────────────────────────────────
+        if _worker is not None:
+            collect_worker()
+        sock_index.wait(CACHE_REFRESH)
+
+def collect_worker():
+    """Fold the capture worker's counters into the agent's (multi-process mode).
+
+    Port bytes are charged to the process owning the port right now, so
+    attribution is as fresh as the port cache.
+    """
+    code = _worker.supervise()
+    if code is not None:
+        print(f"[{time.strftime('%X')}] [worker] Capture worker exited ({code}) — restarting")
+
+    for qname in _worker.events():
+        packet_counters.add_dns(qname)
+    for domain, up, down, var in _worker.domain_deltas():
+        _charge(domain_counters, domain, up, down, var)
+    for proto, port, up, down, var, packets in _worker.port_deltas():
+        pid = sock_index.pids.get((proto, port))
+        if pid is None:
+            sock_index.request(proto, port)
+            _pkt_stats.unattributed += packets
+            continue
+        _pkt_stats.attributed += packets
+        _charge(packet_counters, proc_names.get(pid), up, down, var)
+
+def _charge(target, name, up, down, var):
+    if up:
+        target.add_bytes(name, True, up, var)
+        var = 0.0
+    if down:
+        target.add_bytes(name, False, down, var)
+
+# ─── Thread 2: packet capture ─────────────────────────────────────────────────
+
+def record_dns(qname, answers=None):
+    _pkt_stats.packets += 1
+    packet_counters.add_dns(qname)
+    if answers:
+        for ip, ttl in answers:
+            domain_map.learn(ip, qname, ttl)
+
+def record_packet(proto, is_upload, local_port, remote_ip, remote_port, length):
+    stats = _pkt_stats
+    stats.packets += 1
+    start = time.perf_counter_ns() if not stats.packets % health.TIME_EVERY else 0
+    var   = 0.0
+    if _sample_rate > 1:
+        length, var = sampling.scale(_sample_rate, length)
+
+    domain = domain_map.get(remote_ip)
+    if domain is not None:
+        domain_counters.add_bytes(domain, is_upload, length, var)
+
+    # A port the index does not know yet goes to the refresher; until it
+    # answers, the packet counts as unattributed and its flow gets an owner
+    # when the report is built (flow_process).
+    slot = -1
+    pid  = sock_index.pids.get((proto, local_port))
+    if pid is not None:
+        slot = packet_counters.add_bytes(proc_names.get(pid), is_upload, length, var)
+        stats.attributed += 1
+    else:
+        sock_index.request(proto, local_port)
+        stats.unattributed += 1
+
+    flow_table.add(flows.flow_key(proto, local_port, remote_ip, remote_port),
+                   slot, is_upload, length)
+    if start:
+        stats.callback.record(time.perf_counter_ns() - start)
+
+def _load_scapy():
+    """Import the Scapy pieces the fallback backend needs, on first use.
+
+    Only the sniffer and the Ethernet/IP/TCP/UDP/DNS layers are loaded;
+    `scapy.all` would pull in every layer Scapy has, which costs seconds and
+    tens of MB before the first packet.
+    """
+    global sniff, DNS, DNSQR, IP, TCP, UDP
+    if sniff is None:
+        from scapy.layers.dns import DNS, DNSQR
+        from scapy.layers.inet import IP, TCP, UDP
+        from scapy.sendrecv import sniff
+
+def _scapy_answers(dns):
+    if not dns.qr or not dns.ancount:
+        return None
+    answers = []
+    for rr in dns.an:
+        if rr.type == capture.DNS_TYPE_A:        # IPv4 only, see capture.dns_answers
+            answers.append((int(ipaddress.ip_address(rr.rdata)), rr.ttl))
+    return answers
 
 def packet_callback(pkt):
     if pkt.haslayer(DNS) and pkt.haslayer(DNSQR):
         qname = pkt[DNSQR].qname.decode(errors="ignore").rstrip(".")
         if qname:
-            with lock:
-                interval_dns.add(qname)
+            record_dns(qname, _scapy_answers(pkt[DNS]))
         return
 
     if not pkt.haslayer(IP):
         return
 
     src, dst = pkt[IP].src, pkt[IP].dst
+    proto    = pkt[IP].proto
     length   = len(pkt)
 
     src_port = dst_port = None
@@ -117,21 +258,19 @@ def packet_callback(pkt):
     if not (is_upload or is_download):
         return
 
-    local_port = src_port if is_upload else dst_port
+    local_port  = src_port if is_upload else dst_port
+    remote_port = dst_port if is_upload else src_port
     if local_port is None:
         return
 
-    pid = port_pid_cache.get(local_port)
-    if pid is None:
-        return
-
-    name = pid_to_name(pid)
-    key  = "upload" if is_upload else "download"
-    with lock:
-        interval_proc_bytes[name][key] += length
-        proc_total_bytes[name][key]    += length
+    remote = dst if is_upload else src
+    record_packet(proto, is_upload, local_port, int(ipaddress.ip_address(remote)),
+                  remote_port, length)
 
-def start_sniffer():
+def start_scapy_sniffer():
+    global _capture_name
+    _capture_name = "scapy"
+    _load_scapy()
     print(f"[scapy] Sniffing on interface: {_iface}")
     sniff(
         prn=packet_callback,
@@ -140,87 +279,451 @@ def start_sniffer():
         iface=_iface,      # explicit interface — more reliable on Linux
     )
 
+def start_ring_capture():
+    global _ring, _filter_switch, _capture_name
+    _ring = capture.Ring(_iface)
+    _filter_switch = capture.FilterSwitch(_apply_sample_rate)
+    _capture_name  = "mmap"
+    print(f"[mmap] Capturing on interface: {_iface} "
+          f"({_ring.block_nr} x {_ring.block_size // 1024} KiB blocks)")
+    _ring.run(_local_ip, record_dns, record_packet, _filter_switch)
+
+def start_raw_capture():
+    global _sock, _sock_stats, _filter_switch, _capture_name
+    _sock          = capture.open_socket(_iface)
+    _sock_stats    = capture.SocketStats(_sock)
+    _filter_switch = capture.FilterSwitch(_apply_sample_rate)
+    _capture_name  = "raw"
+    print(f"[raw] Capturing on interface: {_iface}")
+    capture.run(_sock, _local_ip, record_dns, record_packet, _filter_switch)
+
+def start_sniffer():
+    if CAPTURE_MODE == "scapy":
+        return start_scapy_sniffer()
+    if CAPTURE_MODE == "mmap":
+        return start_ring_capture()
+    if CAPTURE_MODE == "raw":
+        return start_raw_capture()
+
+    for name, start in (("mmap", start_ring_capture), ("raw", start_raw_capture)):
+        try:
+            return start()
+        except OSError as e:
+            print(f"[{name}] Unavailable ({e})")
+    print("[capture] Falling back to Scapy")
+    start_scapy_sniffer()
+
+def capture_drops():
+    """Kernel drop counters of the mmap or raw backend, or None for Scapy."""
+    if _worker is not None:
+        return _worker.stats()
+    if _ring is not None:
+        return _ring.stats()
+    if _sock_stats is not None:
+        return _sock_stats.stats()
+    return None
+
+# ─── Sampling ─────────────────────────────────────────────────────────────────
+
+def set_sample_rate(rate):
+    """Count 1 in `rate` packets from now on; False if the backend cannot sample.
+
+    Sampling is done by the kernel filter, so the Scapy backend always
+    counts every packet. The capture loop switches the filter and starts
+    scaling by the new rate only from frames the new filter let through
+    (see capture.FilterSwitch); the worker does the same on its side.
+    """
+    if _worker is not None:
+        if rate != _sample_rate:
+            _worker.set_rate(rate)
+            _apply_sample_rate(rate)
+        return True
+    if _filter_switch is None:
+        return False
+    return _filter_switch.request(rate)
+
+def _apply_sample_rate(rate):
+    global _sample_rate
+    _sample_rate = rate
+    print(f"[{time.strftime('%X')}] [sampling] Counting 1 in {rate} packets")
+
+def agent_usage():
+    """(CPU %, RSS bytes) of the agent and its capture worker.
+
+    CPU is measured since the previous call, so call it once per interval.
+    """
+    pids = [os.getpid()]
+    if _worker is not None and _worker.pid:
+        pids.append(_worker.pid)
+    cpu = rss = 0
+    for pid in pids:
+        proc = _cpu_procs.get(pid)
+        if proc is None:
+            proc = _cpu_procs[pid] = psutil.Process(pid)
+        try:
+            cpu += proc.cpu_percent()
+            rss += proc.memory_info().rss
+        except psutil.Error:
+            _cpu_procs.pop(pid, None)
+    return cpu, rss
+
+def iface_packets():
+    nic = psutil.net_io_counters(pernic=True).get(_iface) if _iface else None
+    io  = nic or psutil.net_io_counters()
+    return io.packets_sent + io.packets_recv
+
+def adapt_sampling(pps, cpu):
+    """Pick the sampling rate for the next interval from load."""
+    if SAMPLING == "auto":
+        rate = _rate_ctl.update(pps, cpu)
+    else:
+        rate = max(1, int(SAMPLING))
+    if not set_sample_rate(rate):
+        _rate_ctl.rate = _sample_rate
+
+def sampling_summary(interval_snap, variance):
+    """Current rate and the 95% relative error of the interval's attributed bytes."""
+    total = sum(v["upload"] + v["download"] for v in interval_snap.values())
+    err   = sampling.error(sum(variance.values()))
+    return {"rate": _sample_rate, "error": round(err / total, 4) if total else 0.0}
+
 # ─── Send to master ───────────────────────────────────────────────────────────
 
-def _send(master_ip, master_port, payload):
-    url = f"http://{master_ip}:{master_port}/usage"
+def _send_binary(payload):
+    """Send `payload` in the compact format; None if the master lacks support."""
+    global WIRE_FORMAT
+    try:
+        body = _encoder.encode(payload)
+    except ValueError as e:
+        # A bad figure in the report, not a network failure: spooling it
+        # would only fail again on every retry.
+        print(f"[{time.strftime('%X')}] Cannot encode report ({e}) — sending it as JSON")
+        return None
+    try:
+        response = _client.post("/usage", wire.CONTENT_TYPE, body)
+    except transport.HTTPError as e:
+        if e.code == 409:
+            # Master lost our delta base (e.g. restart) — resend in full.
+            _encoder.reset()
+            response = _client.post("/usage", wire.CONTENT_TYPE, _encoder.encode(payload))
+        elif e.code in (400, 415):
+            print(f"[{time.strftime('%X')}] Master does not accept compact reports — using JSON")
+            WIRE_FORMAT = "json"
+            return None
+        else:
+            raise
+    if "ack" in response:
+        _encoder.ack(response["ack"])
+    return response
+
+def _send_json(payload):
+    return _client.post("/usage", "application/json", json.dumps(payload).encode("utf-8"))
+
+def apply_directives(directives):
+    """Adopt the master's interval, process top-N and DNS choice for later reports."""
+    global SEND_INTERVAL, TOP_N_PROCS, INCLUDE_DNS
+    if not isinstance(directives, dict):
+        return
     try:
-        data = json.dumps(payload).encode("utf-8")
-        req  = urllib.request.Request(url, method="POST")
-        req.add_header("Content-Type", "application/json")
-        with urllib.request.urlopen(req, data=data, timeout=5) as resp:
-            response   = json.loads(resp.read().decode("utf-8"))
-            collecting = response.get("collecting", True)
-            print(f"[{time.strftime('%X')}] "
-                  f"↑{payload['usage']['upload']:.0f} B/s  "
-                  f"↓{payload['usage']['download']:.0f} B/s  "
-                  f"procs={len(payload['process'])}  "
-                  f"dns={len(payload['dns'])}  "
-                  f"| {'LIVE' if collecting else 'STOPPED'}")
-            return collecting
+        lo, hi   = INTERVAL_RANGE
+        interval = min(hi, max(lo, float(directives.get("interval", SEND_INTERVAL))))
+        top_n    = min(TOP_N_MAX, max(1, int(directives.get("top_n", TOP_N_PROCS))))
+    except (TypeError, ValueError):
+        return
+    if interval != SEND_INTERVAL:
+        print(f"[{time.strftime('%X')}] Master set report interval to {interval:g} s")
+    SEND_INTERVAL = interval
+    TOP_N_PROCS   = top_n
+    INCLUDE_DNS   = bool(directives.get("dns", True))
+
+def _send(payload):
+    if not _client.available():
+        _spool.append(payload)
+        print(f"[{time.strftime('%X')}] Master unreachable — report spooled")
+        return None
+    try:
+        with _send_timer:
+            response = None
+            if WIRE_FORMAT == "binary":
+                response = _send_binary(payload)
+            if response is None:
+                response = _send_json(payload)
+        collecting = response.get("collecting", True)
+        apply_directives(response.get("directives"))
+        rate       = payload["sampling"]["rate"]
+        sample     = f"sample=1/{rate}  " if rate > 1 else ""
+        print(f"[{time.strftime('%X')}] "
+              f"↑{payload['usage']['upload']:.0f} B/s  "
+              f"↓{payload['usage']['download']:.0f} B/s  "
+              f"procs={len(payload['process'])}  "
+              f"dns={len(payload['dns'])}  "
+              f"{sample}"
+              f"| {'LIVE' if collecting else 'STOPPED'}")
+        return collecting
     except Exception as e:
-        print(f"[{time.strftime('%X')}] Send failed: {e}")
+        _spool.append(payload)
+        print(f"[{time.strftime('%X')}] Send failed: {e} — report spooled")
+        return None
+
+def _replay_batch(entries):
+    """Send spooled (record, cursor) entries as one NDJSON /usage/batch request.
+
+    Returns the cursor of the last one the master answered for; every
+    status it gives ("ok", "stale", "duplicate", ...) is final. None if
+    the master is busy or unreachable; other HTTP errors are raised.
+    """
+    body = b"".join(json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+                    for record, _ in entries)
+    try:
+        response = _client.post("/usage/batch", "application/x-ndjson", body)
+    except transport.HTTPError as e:
+        if e.code == 503:
+            return None                 # master busy — retry after its Retry-After
+        raise
+    except Exception:
         return None
+    results = response.get("results", [])
+    return entries[min(len(results), len(entries)) - 1][1] if results else None
+
+def _replay_spool():
+    """Send up to REPLAY_BATCH spooled reports, oldest first, as full JSON:
+    one /usage/batch request, or one /usage request each on older masters."""
+    global _batch_replay
+    entries = _spool.peek(REPLAY_BATCH)
+    sent    = None
+    if _batch_replay and entries:
+        try:
+            sent, entries = _replay_batch(entries), []
+        except transport.HTTPError as e:
+            if e.code in (404, 405):
+                print(f"[{time.strftime('%X')}] Master has no /usage/batch — replaying one by one")
+                _batch_replay = False
+            # otherwise fall back to one request per report this time
+    for record, cursor in entries:
+        try:
+            _send_json(record)
+        except transport.HTTPError as e:
+            if e.code == 503:
+                break                   # master busy — retry after its Retry-After
+            # otherwise rejected by the master — do not retry
+        except Exception:
+            break
+        sent = cursor
+    if sent is not None:
+        _spool.commit(sent)
+        print(f"[{time.strftime('%X')}] Replayed spooled reports"
+              f"{'' if _spool.empty() else ' (more pending)'}")
+
+# ─── Self-telemetry ───────────────────────────────────────────────────────────
+
+def health_snapshot():
+    """Cumulative packet counters and latency histograms."""
+    if _worker is not None:
+        packets, callback = _worker.packets(), _worker.callback.snapshot()
+    else:
+        packets, callback = _pkt_stats.packets, _pkt_stats.callback.snapshot()
+    return {
+        "packets":      packets,
+        "attributed":   _pkt_stats.attributed,
+        "unattributed": _pkt_stats.unattributed,
+        "callback":     callback,
+        "refresh":      _refresh_timer.hist.snapshot(),
+        "send":         _send_timer.hist.snapshot(),
+    }
+
+def agent_health(new, old, drops, cpu, rss):
+    """The report's `agent_health` section for one interval.
+
+    `drops` is the number of packets the kernel dropped, or None when the
+    capture backend cannot tell. Latencies are in microseconds.
+    """
+    return {
+        "capture":         _capture_name,
+        "packets":         new["packets"]      - old["packets"],
+        "attributed":      new["attributed"]   - old["attributed"],
+        "unattributed":    new["unattributed"] - old["unattributed"],
+        "drops":           drops,
+        "callback_us":     health.summary(new["callback"], old["callback"]),
+        "refresh_us":      health.summary(new["refresh"],  old["refresh"]),
+        "send_us":         health.summary(new["send"],     old["send"]),
+        "cpu_percent":     round(cpu, 1),
+        "rss_bytes":       rss,
+        "worker_restarts": _worker.restarts if _worker is not None else 0,
+    }
 
 # ─── Reporter ─────────────────────────────────────────────────────────────────
 
-def reporter(master_ip, master_port, hostname, local_ip, mac, username):
-    global interval_proc_bytes, interval_dns, proc_total_bytes, io_baseline
-    was_collecting = True
+def top_entries(interval_snap, total_snap, n, system_upload, system_download, variance=None,
+                seconds=None):
+    """Top `n` names by interval bytes as report entries with speed and total.
+
+    Captured bytes are scaled down to the interface counters when they
+    exceed them. Names with sampling `variance` get an `error`: the 95%
+    bound on their upload + download speed. Speeds are over `seconds`
+    (default SEND_INTERVAL).
+    """
+    seconds = seconds or SEND_INTERVAL
+    raw_total_up   = sum(v["upload"]   for v in interval_snap.values()) or 1
+    raw_total_down = sum(v["download"] for v in interval_snap.values()) or 1
+    scale_up   = system_upload   / raw_total_up   if raw_total_up   > system_upload   else 1.0
+    scale_down = system_download / raw_total_down if raw_total_down > system_download else 1.0
+
+    all_names = set(interval_snap) | set(total_snap)
+    top = sorted(
+        all_names,
+        key=lambda k: (
+            interval_snap.get(k, {}).get("upload",   0) +
+            interval_snap.get(k, {}).get("download", 0)
+        ),
+        reverse=True
+    )[:n]
+
+    entries = []
+    for name in top:
+        iv  = interval_snap.get(name, {"upload": 0, "download": 0})
+        tot = total_snap.get(name,    {"upload": 0, "download": 0})
+        entry = {
+            "name":  name,
+            "speed": {
+                "upload":   round(iv["upload"]   * scale_up   / seconds, 2),
+                "download": round(iv["download"] * scale_down / seconds, 2),
+            },
+            "total": {
+                "upload":   round(tot["upload"]   * scale_up),
+                "download": round(tot["download"] * scale_down),
+            }
+        }
+        if variance and name in variance:
+            entry["error"] = round(sampling.error(variance[name]) / seconds, 2)
+        entries.append(entry)
+    return entries
+
+def flow_process(proto, local_port):
+    """Current owner of a local port, for flows the capture path left unattributed."""
+    pid = sock_index.pids.get((proto, local_port))
+    return proc_names.get(pid) if pid is not None else ""
+
+def flow_entries(new, old, n, seconds=None):
+    """Top `n` flows between two flow-table snapshots as report entries."""
+    seconds = seconds or SEND_INTERVAL
+    names   = packet_counters.names
+    entries = []
+    for key, slot, iv_up, iv_down, tot_up, tot_down in flows.top_flows(new, old, n):
+        proto, local_port, remote_ip, remote_port = flows.split_key(key)
+        entries.append({
+            "proto":       capture.PROTO_NAMES.get(proto, str(proto)),
+            "local_port":  local_port,
+            "remote_ip":   str(ipaddress.IPv4Address(remote_ip)),
+            "remote_port": remote_port,
+            "process":     names[slot] if slot >= 0 else flow_process(proto, local_port),
+            "speed": {
+                "upload":   round(iv_up   / seconds, 2),
+                "download": round(iv_down / seconds, 2),
+            },
+            "total": {"upload": tot_up, "download": tot_down},
+        })
+    return entries
+
+def destination_summary(new, old, n):
+    """Fold the interval's flow bytes into the sketch; report its top `n` remote IPs."""
+    for ip, (up, down) in flows.by_remote(new, old).items():
+        dest_sketch.add(ip, up, down)
+    top, total, floor = dest_sketch.top(n)
+    return {
+        "capacity": dest_sketch.capacity,
+        "total":    total,
+        "floor":    floor,
+        "top": [
+            {
+                "ip":       str(ipaddress.IPv4Address(ip)),
+                "bytes":    up + down + error,
+                "upload":   up,
+                "download": down,
+                "error":    error,
+            }
+            for ip, up, down, error in top
+        ],
+    }
+
+def reporter(hostname, local_ip, mac, username):
+    global io_baseline
+    was_collecting    = True
+    last_drops        = 0
+    total_base        = packet_counters.snapshot()
+    domain_total_base = domain_counters.snapshot()
+
+    health_base       = health_snapshot()
+    dns_held          = set()           # names deferred while INCLUDE_DNS is off
+
+    # Each interval starts where the previous one ended, on a sampler tick,
+    # so time spent building and sending a report is never lost.
+    last                 = _rates.start()
+    interval_base        = packet_counters.snapshot()
+    domain_interval_base = domain_counters.snapshot()
+    flow_base            = flow_table.snapshot()
+    pkts_before          = iface_packets()
 
     while True:
-        with lock:
-            interval_proc_bytes.clear()
-            interval_dns.clear()
-
-        io_before = psutil.net_io_counters()
-        time.sleep(SEND_INTERVAL)
-        io_after  = psutil.net_io_counters()
-
-        system_upload   = io_after.bytes_sent - io_before.bytes_sent
-        system_download = io_after.bytes_recv - io_before.bytes_recv
-        upload_bps      = round(system_upload   / SEND_INTERVAL, 2)
-        download_bps    = round(system_download / SEND_INTERVAL, 2)
-
-        io_now     = psutil.net_io_counters()
-        total_up   = max(0, io_now.bytes_sent - io_baseline.bytes_sent)
-        total_down = max(0, io_now.bytes_recv - io_baseline.bytes_recv)
-
-        with lock:
-            proc_interval_snap = {k: dict(v) for k, v in interval_proc_bytes.items()}
-            proc_total_snap    = {k: dict(v) for k, v in proc_total_bytes.items()}
-            dns_snapshot       = list(interval_dns)
-
-        raw_total_up   = sum(v["upload"]   for v in proc_interval_snap.values()) or 1
-        raw_total_down = sum(v["download"] for v in proc_interval_snap.values()) or 1
-        scale_up   = system_upload   / raw_total_up   if raw_total_up   > system_upload   else 1.0
-        scale_down = system_download / raw_total_down if raw_total_down > system_download else 1.0
-
-        all_proc_names = set(proc_interval_snap) | set(proc_total_snap)
-        top_procs = sorted(
-            all_proc_names,
-            key=lambda n: (
-                proc_interval_snap.get(n, {}).get("upload",   0) +
-                proc_interval_snap.get(n, {}).get("download", 0)
-            ),
-            reverse=True
-        )[:TOP_N_PROCS]
-
-        process_list = []
-        for name in top_procs:
-            iv  = proc_interval_snap.get(name, {"upload": 0, "download": 0})
-            tot = proc_total_snap.get(name,    {"upload": 0, "download": 0})
-            process_list.append({
-                "name":  name,
-                "speed": {
-                    "upload":   round(iv["upload"]   * scale_up   / SEND_INTERVAL, 2),
-                    "download": round(iv["download"] * scale_down / SEND_INTERVAL, 2),
-                },
-                "total": {
-                    "upload":   round(tot["upload"]   * scale_up),
-                    "download": round(tot["download"] * scale_down),
-                }
-            })
+        ticks   = max(1, round(SEND_INTERVAL / RATE_STEP))
+        sample  = _rates.wait(last.tick + ticks)
+        elapsed = (sample.t - last.t) or SEND_INTERVAL
+        snap    = packet_counters.snapshot()
+        dsnap   = domain_counters.snapshot()
+        fsnap   = flow_table.snapshot()
+        pkts    = iface_packets()
+        pps     = (pkts - pkts_before) / elapsed
+
+        system_upload   = sample.sent - last.sent
+        system_download = sample.recv - last.recv
+        upload_bps      = round(system_upload   / elapsed, 2)
+        download_bps    = round(system_download / elapsed, 2)
+        series_up, series_down = _rates.series(last, sample)
+
+        # Lifetime totals continue from the last checkpoint of a previous run.
+        total_up   = _state.total[0] + max(0, sample.sent - io_baseline.bytes_sent)
+        total_down = _state.total[1] + max(0, sample.recv - io_baseline.bytes_recv)
+
+        proc_interval_snap   = counters.delta(snap, interval_base)
+        proc_total_snap      = checkpoint.merged(counters.delta(snap, total_base),
+                                                 _state.saved["procs"])
+        if len(dns_held) < counters.DNS_BACKLOG:
+            dns_held        |= packet_counters.drain_dns()
+        dns_snapshot         = []
+        if INCLUDE_DNS:
+            dns_snapshot, dns_held = list(dns_held), set()
+        domain_interval_snap = counters.delta(dsnap, domain_interval_base)
+        domain_total_snap    = checkpoint.merged(counters.delta(dsnap, domain_total_base),
+                                                 _state.saved["domains"])
+        proc_variance        = counters.variance(snap, interval_base)
+        domain_variance      = counters.variance(dsnap, domain_interval_base)
+        flow_list            = flow_entries(fsnap, flow_base, TOP_N_FLOWS, elapsed)
+        destinations         = destination_summary(fsnap, flow_base, TOP_N_DESTINATIONS)
+        cpu, rss             = agent_usage()
+        # Spans from the previous report, so it includes that report's send.
+        health_now           = health_snapshot()
+
+        last                 = sample
+        interval_base        = snap
+        domain_interval_base = dsnap
+        flow_base            = fsnap
+        pkts_before          = pkts
+
+        interval_drops = None
+        drops = capture_drops()
+        if drops:
+            if drops["drops"] < last_drops:
+                last_drops = 0      # a restarted capture worker counts from 0 again
+            interval_drops = drops["drops"] - last_drops
+            if interval_drops:
+                print(f"[{time.strftime('%X')}] [{_capture_name}] Kernel dropped "
+                      f"{interval_drops} packets "
+                      f"(total {drops['drops']}, freezes {drops['freeze_q']})")
+            last_drops = drops["drops"]
+
+        process_list = top_entries(proc_interval_snap, proc_total_snap, TOP_N_PROCS,
+                                   system_upload, system_download, proc_variance, elapsed)
+        domain_list  = top_entries(domain_interval_snap, domain_total_snap, TOP_N_DOMAINS,
+                                   system_upload, system_download, domain_variance, elapsed)
 
         payload = {
             "timestamp":   round(time.time()),
@@ -234,9 +737,22 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
             "total_usage": {"upload": total_up,    "download": total_down},
             "process":     process_list,
             "dns":         dns_snapshot,
+            "domains":     domain_list,
+            "flows":       flow_list,
+            "sampling":    sampling_summary(proc_interval_snap, proc_variance),
+            "agent_health": agent_health(health_now, health_base, interval_drops, cpu, rss),
+            "series":      {"step": RATE_STEP, "upload": series_up, "download": series_down},
+            "destinations": destinations,
         }
+        health_base = health_now
 
-        collecting = _send(master_ip, master_port, payload)
+        _state.save((total_up, total_down),
+                    procs={k: (v["upload"], v["download"]) for k, v in proc_total_snap.items()},
+                    domains={k: (v["upload"], v["download"]) for k, v in domain_total_snap.items()})
+        adapt_sampling(pps, cpu)
+        collecting = _send(payload)
+        if collecting is not None and not _spool.empty():
+            _replay_spool()
 
         if collecting is None:
             continue
@@ -244,10 +760,12 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
         if not collecting:
             if was_collecting:
                 print(f"[{time.strftime('%X')}] Stopped — resetting data...")
-                with lock:
-                    proc_total_bytes.clear()
-                    interval_proc_bytes.clear()
-                    interval_dns.clear()
+                total_base        = packet_counters.snapshot()
+                domain_total_base = domain_counters.snapshot()
+                packet_counters.drain_dns()
+                dns_held.clear()
+                _state.reset()
+                dest_sketch.clear()
                 io_baseline    = psutil.net_io_counters()
                 was_collecting = False
         else:
@@ -258,14 +776,39 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
 
 # ─── Entry point ──────────────────────────────────────────────────────────────
 
-def main():
-    global _local_ip, _iface, io_baseline
+def master_address(argv=None):
+    """Master IP and port: flags, then MASTER_IP/MASTER_PORT, then the config
+    file; prompts only when none of them names a master and stdin is a tty."""
+    ap = argparse.ArgumentParser(description="Network usage agent (Linux)")
+    ap.add_argument("--master", help="master IP (or env MASTER_IP)")
+    ap.add_argument("--port",   help="master port (or env MASTER_PORT; default 5000)")
+    ap.add_argument("--config", help=f'JSON file with "master" and "port" (default {CONFIG_FILE} if present)')
+    args = ap.parse_args(argv)
+
+    config = {}
+    path   = args.config or (CONFIG_FILE if os.path.exists(CONFIG_FILE) else None)
+    if path:
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            ap.error(f"cannot read config {path}: {e}")
+
+    master_ip   = args.master or os.environ.get("MASTER_IP")   or config.get("master")
+    master_port = args.port   or os.environ.get("MASTER_PORT") or config.get("port")
+    if not master_ip:
+        if not sys.stdin.isatty():
+            ap.error("no master given (use --master, MASTER_IP or a config file)")
+        master_ip   = input("Master IP   : ").strip()
+        master_port = master_port or input("Master port [5000]: ").strip()
+    return master_ip, str(master_port or 5000)
 
-    check_root()
+def main():
+    global _local_ip, _iface, io_baseline, _client, _spool, _worker, flow_table, _capture_name, _state
 
     print("=== Network Usage Agent (Linux) ===")
-    master_ip   = input("Master IP   : ").strip()
-    master_port = input("Master port [5000]: ").strip() or "5000"
+    master_ip, master_port = master_address()
+    check_root()
 
     hostname  = socket.gethostname()
     _local_ip = get_local_ip()
@@ -287,11 +830,31 @@ def main():
     print(f"\n  Starting...\n")
 
     io_baseline = psutil.net_io_counters()
-
+    _client     = transport.MasterClient(master_ip, master_port)
+    _spool      = transport.Spool(SPOOL_DIR, max_bytes=SPOOL_MAX_MB * 1024 * 1024)
+    _state      = checkpoint.Checkpoint(STATE_FILE)
+    if _state.restored:
+        print(f"[state] Restored lifetime totals (epoch {_state.epoch}): "
+              f"↑{_state.total[0]} B  ↓{_state.total[1]} B  "
+              f"procs={len(_state.saved['procs'])}")
+
+    if CAPTURE_PROCESS and CAPTURE_MODE != "scapy":
+        _worker       = worker.CaptureWorker(_iface, _local_ip, CAPTURE_MODE)
+        flow_table    = _worker.flows
+        _capture_name = "worker"
+        _worker.start()
+        print(f"[worker] Capturing on interface: {_iface} in a separate process")
+        # Exit through `finally` so the shared block is unlinked.
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    else:
+        threading.Thread(target=start_sniffer, daemon=True).start()
     threading.Thread(target=port_cache_refresher, daemon=True).start()
-    threading.Thread(target=start_sniffer,        daemon=True).start()
 
-    reporter(master_ip, master_port, hostname, _local_ip, mac, username)
+    try:
+        reporter(hostname, _local_ip, mac, username)
+    finally:
+        if _worker is not None:
+            _worker.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
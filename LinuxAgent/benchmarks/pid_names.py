@@ -0,0 +1,45 @@
+"""Per-packet cost of resolving a PID to a process name.
+
+Compares the old `psutil.Process(pid).name()` call made for every attributed
+packet with the ProcNameCache lookup that replaced it.
+
+    cd LinuxAgent && python3 benchmarks/pid_names.py
+"""
+import os
+import sys
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import procnames  # noqa: E402
+
+PACKETS = 50_000
+
+
+def uncached(pid):
+    try:
+        return psutil.Process(pid).name()
+    except Exception:
+        return f"PID-{pid}"
+
+def bench(label, fn, pids):
+    n     = len(pids)
+    start = time.perf_counter()
+    for i in range(PACKETS):
+        fn(pids[i % n])
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<10} {elapsed / PACKETS * 1e9:>10.0f} ns/packet")
+
+def main():
+    # Packets are spread over a handful of busy processes, like a real host.
+    pids = psutil.pids()[:8] + [os.getpid()] * 8
+    print(f"{PACKETS} packets over {len(set(pids))} PIDs")
+
+    bench("before", uncached, pids)
+    cache = procnames.ProcNameCache()
+    bench("after", cache.get, pids)
+    print(f"  cache      {cache.stats()}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""Offline replay of the agent's packet path, per capture backend.
+
+Feeds recorded pcap files and/or synthetic traffic mixes through the same
+parsing and attribution code the agent runs on live traffic, without root
+or a network: the port → PID map is stubbed so every local port resolves
+from memory, and no master is contacted.
+
+Backends:
+  mmap   frames packed into TPACKET_V3 blocks, walked by capture.walk_block
+  raw    one copy into a receive buffer per frame, then capture.dispatch_frame
+  scapy  scapy Ether() decode + agent.packet_callback (fewer packets, it is slow)
+
+For every (traffic, backend) pair it reports packets/s, ns/packet, memory
+blocks left allocated per packet, peak traced memory, and the cost of
+building and encoding one report from the resulting counters. CPython has
+no allocation counter, so "blocks/packet" is the growth of
+sys.getallocatedblocks() over the run: what the packet path keeps (table
+and dict growth, leaks), not its short-lived temporaries.
+
+    cd LinuxAgent && python3 benchmarks/replay.py
+    python3 benchmarks/replay.py --pcap trace.pcap --backend mmap --json new.json
+    python3 benchmarks/replay.py --json new.json --compare old.json
+
+Results are written as JSON with --json so runs from two commits can be
+compared (--compare prints the ratio against an earlier file).
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+import agent      # noqa: E402
+import capture    # noqa: E402
+import counters   # noqa: E402
+import dnsmap     # noqa: E402
+import flows      # noqa: E402
+import health     # noqa: E402
+import procnames  # noqa: E402
+import sockindex  # noqa: E402
+import wire       # noqa: E402
+
+LOCAL_IP      = "10.0.0.2"
+PACKETS       = 200_000     # per synthetic mix
+SCAPY_PACKETS = 20_000      # scapy decodes ~100x slower
+REPORTS       = 200         # report builds timed per run
+BLOCK_SIZE    = 1 << 18     # agent's Ring default
+PROCESSES     = 32          # stubbed processes owning the local ports
+MIXES         = ("small_udp", "bulk_tcp", "dns_heavy")
+BACKENDS      = ("mmap", "raw", "scapy")
+
+# ─── Frame builders ───────────────────────────────────────────────────────────
+
+_LOCAL  = socket.inet_aton(LOCAL_IP)
+_ETHER  = b"\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02\x08\x00"
+_ip     = struct.Struct("!BBHHHBBH4s4s")
+_tcp    = struct.Struct("!HHIIBBHHH")
+_udp    = struct.Struct("!HHHH")
+_dnshdr = struct.Struct("!HHHHHH")
+_dnsrr  = struct.Struct("!HHHIH")
+
+def _frame(src, dst, proto, sport, dport, payload):
+    """Ethernet/IPv4 frame with a TCP or UDP header around `payload`."""
+    if proto == capture.IPPROTO_TCP:
+        l4 = _tcp.pack(sport, dport, 0, 0, 5 << 4, 0x10, 65535, 0, 0)
+    else:
+        l4 = _udp.pack(sport, dport, 8 + len(payload), 0)
+    total = 20 + len(l4) + len(payload)
+    return _ETHER + _ip.pack(0x45, 0, total, 0, 0, 64, proto, 0, src, dst) + l4 + payload
+
+def _packet(proto, upload, lport, remote, rport, size):
+    """Frame of `size` bytes on the wire between this host and `remote`."""
+    head = 14 + 20 + (20 if proto == capture.IPPROTO_TCP else 8)
+    pad  = bytes(max(0, size - head))
+    if upload:
+        return _frame(_LOCAL, remote, proto, lport, rport, pad)
+    return _frame(remote, _LOCAL, proto, rport, lport, pad)
+
+def _dns_name(name):
+    return b"".join(bytes([len(p)]) + p.encode() for p in name.split(".")) + b"\0"
+
+def _dns_message(name, answers):
+    msg = _dnshdr.pack(0x1234, 0x8180 if answers else 0x0100, 1, len(answers), 0, 0)
+    msg += _dns_name(name) + struct.pack("!HH", capture.DNS_TYPE_A, 1)
+    for ip in answers:
+        msg += _dnsrr.pack(0xC00C, capture.DNS_TYPE_A, 1, 300, 4) + ip
+    return msg
+
+def _remote(rng):
+    return struct.pack("!I", rng.randrange(0x01000000, 0xDF000000))
+
+def mix_small_udp(rng, n, ports):
+    """Many small datagrams over thousands of endpoints, 10% unattributed."""
+    remotes = [(_remote(rng), rng.randrange(1024, 65535)) for _ in range(4096)]
+    out = []
+    for _ in range(n):
+        lport = rng.choice(ports) if rng.random() < 0.9 else rng.randrange(1024, 65535)
+        ip, rport = rng.choice(remotes)
+        out.append(_packet(capture.IPPROTO_UDP, rng.random() < 0.5, lport, ip, rport,
+                           rng.randrange(64, 257)))
+    return out
+
+def mix_bulk_tcp(rng, n, ports):
+    """A few long TCP downloads: full-size segments, one ACK per eight."""
+    streams = [(rng.choice(ports), _remote(rng), 443) for _ in range(16)]
+    out = []
+    for i in range(n):
+        lport, ip, rport = streams[i % len(streams)]
+        if i % 9 == 8:
+            out.append(_packet(capture.IPPROTO_TCP, True, lport, ip, rport, 66))
+        else:
+            out.append(_packet(capture.IPPROTO_TCP, False, lport, ip, rport, 1514))
+    return out
+
+def mix_dns_heavy(rng, n, ports):
+    """Half DNS lookups and answers, half short TCP to the answered hosts."""
+    names = [f"host{i}.example{i % 97}.com" for i in range(2000)]
+    ips   = {name: [_remote(rng) for _ in range(rng.randrange(1, 5))] for name in names}
+    out = []
+    for _ in range(n):
+        r     = rng.random()
+        name  = rng.choice(names)
+        lport = rng.choice(ports)
+        if r < 0.1:
+            out.append(_frame(_LOCAL, _remote(rng), capture.IPPROTO_UDP, lport, 53,
+                              _dns_message(name, [])))
+        elif r < 0.5:
+            out.append(_frame(_remote(rng), _LOCAL, capture.IPPROTO_UDP, 53, lport,
+                              _dns_message(name, ips[name])))
+        else:
+            out.append(_packet(capture.IPPROTO_TCP, r < 0.6, lport, rng.choice(ips[name]),
+                               443, rng.randrange(66, 1515)))
+    return out
+
+# ─── pcap input ───────────────────────────────────────────────────────────────
+
+PCAP_MAGIC = (0xA1B2C3D4, 0xA1B23C4D)   # µs and ns timestamps
+LINKTYPE_ETHERNET = 1
+
+def read_pcap(path, limit=None):
+    """Ethernet frames of a classic (not pcapng) capture file, as (data, wire length)."""
+    with open(path, "rb") as f:
+        head = f.read(24)
+        for order in "<>":
+            magic, = struct.unpack(order + "I", head[:4])
+            if magic in PCAP_MAGIC:
+                break
+        else:
+            raise ValueError(f"{path}: not a pcap file (pcapng is not supported)")
+        linktype, = struct.unpack(order + "I", head[20:24])
+        if linktype & 0xFFFF != LINKTYPE_ETHERNET:
+            raise ValueError(f"{path}: link type {linktype}, need Ethernet")
+        rec = struct.Struct(order + "IIII")
+        out = []
+        while limit is None or len(out) < limit:
+            hdr = f.read(rec.size)
+            if len(hdr) < rec.size:
+                break
+            _sec, _sub, caplen, length = rec.unpack(hdr)
+            out.append((f.read(caplen), length))
+    return out
+
+def guess_local_ip(frames):
+    """Most frequent IPv4 address in the capture, taken as the capturing host."""
+    seen = {}
+    for data, _length in frames:
+        if len(data) >= 34 and data[12:14] == b"\x08\x00":
+            for ip in (data[26:30], data[30:34]):
+                seen[ip] = seen.get(ip, 0) + 1
+    return socket.inet_ntoa(max(seen, key=seen.get)) if seen else LOCAL_IP
+
+def local_ports(frames, local):
+    """Local TCP/UDP ports in `frames`, so the stub can attribute them all."""
+    ports = set()
+    for data, _length in frames:
+        if len(data) < 38 or data[12:14] != b"\x08\x00" or data[23] not in capture.PROTO_NAMES:
+            continue
+        l4 = 14 + (data[14] & 0x0F) * 4
+        if len(data) >= l4 + 4:
+            sport, dport = struct.unpack_from("!HH", data, l4)
+            if data[26:30] == local:
+                ports.add(sport)
+            elif data[30:34] == local:
+                ports.add(dport)
+    return sorted(ports)
+
+# ─── Backends ─────────────────────────────────────────────────────────────────
+
+def pack_blocks(frames):
+    """Lay frames out like a filled TPACKET_V3 ring (all blocks user-owned)."""
+    first, mac = 48, 82         # block header; kernel's tp_mac for Ethernet
+    blocks, block, off, count, prev = [], bytearray(BLOCK_SIZE), first, 0, None
+
+    def close():
+        struct.pack_into("III", block, 8, capture.TP_STATUS_USER, count, first)
+        blocks.append(block)
+
+    for data, length in frames:
+        need = (mac + len(data) + 15) & ~15
+        if off + need > BLOCK_SIZE:
+            close()
+            block, off, count, prev = bytearray(BLOCK_SIZE), first, 0, None
+        if prev is not None:
+            struct.pack_into("I", block, prev, off - prev)
+        struct.pack_into("IIIIIIH", block, off, 0, 0, 0, len(data), length, 0, mac)
+        block[off + mac:off + mac + len(data)] = data
+        prev, off, count = off, off + need, count + 1
+    if count:
+        close()
+    return blocks
+
+def run_mmap(frames):
+    blocks = pack_blocks(frames)
+    def replay():
+        for block in blocks:
+            capture.walk_block(block, memoryview(block), 0, _LOCAL,
+                               agent.record_dns, agent.record_packet)
+    return replay
+
+def run_raw(frames):
+    def replay():
+        buf  = bytearray(capture.SNAPLEN)
+        view = memoryview(buf)
+        for data, length in frames:
+            n = len(data)
+            buf[:n] = data                      # what recv_into does
+            capture.dispatch_frame(view[:n], length, _LOCAL,
+                                   agent.record_dns, agent.record_packet)
+    return replay
+
+def run_scapy(frames):
+    from scapy.layers.l2 import Ether
+    agent._load_scapy()
+    frames = frames[:SCAPY_PACKETS]
+    def replay():
+        for data, _length in frames:
+            agent.packet_callback(Ether(data))
+    replay.packets = len(frames)
+    return replay
+
+RUNNERS = {"mmap": run_mmap, "raw": run_raw, "scapy": run_scapy}
+
+# ─── Agent state ──────────────────────────────────────────────────────────────
+
+class StubSockets(sockindex.SocketIndex):
+    """Port → PID map fixed up front; misses are queued as in the agent."""
+
+    def __init__(self, pids):
+        super().__init__()
+        self.pids = pids
+
+def reset_agent(ports):
+    """Fresh counters and tables, and a stubbed port → PID → name path."""
+    agent._local_ip        = LOCAL_IP
+    agent._sample_rate     = 1
+    agent.packet_counters  = counters.PacketCounters(agent.PROC_SLOTS, "other")
+    agent.domain_counters  = counters.PacketCounters(agent.worker.DOMAIN_SLOTS)
+    agent.domain_map       = dnsmap.DomainMap()
+    agent.flow_table       = flows.FlowTable(agent.FLOW_CAPACITY)
+    agent._pkt_stats       = health.PacketStats()
+    pids = {}
+    for i, port in enumerate(ports):
+        pid = 1000 + i % PROCESSES
+        pids[(capture.IPPROTO_TCP, port)] = pids[(capture.IPPROTO_UDP, port)] = pid
+    agent.sock_index = StubSockets(pids)
+    agent.proc_names = procnames.ProcNameCache()
+    for pid in set(pids.values()):
+        agent.proc_names._entries[pid] = (None, f"app{pid}")
+
+def build_report(bases, system_up, system_down):
+    """The reporter's aggregation and encoding for one interval."""
+    proc_base, domain_base, flow_base = bases
+    snap  = agent.packet_counters.snapshot()
+    dsnap = agent.domain_counters.snapshot()
+    proc_iv   = counters.delta(snap, proc_base)
+    domain_iv = counters.delta(dsnap, domain_base)
+    proc_var  = counters.variance(snap, proc_base)
+    payload = {
+        "timestamp":   0,
+        "name":        "bench",
+        "username":    "bench",
+        "ip":          LOCAL_IP,
+        "mac":         "02:00:00:00:00:01",
+        "os":          "Linux",
+        "state":       "sending",
+        "usage":       {"upload": system_up, "download": system_down},
+        "total_usage": {"upload": system_up, "download": system_down},
+        "process":     agent.top_entries(proc_iv, proc_iv, agent.TOP_N_PROCS,
+                                         system_up, system_down, proc_var),
+        "dns":         list(agent.packet_counters.drain_dns()),
+        "domains":     agent.top_entries(domain_iv, domain_iv, agent.TOP_N_DOMAINS,
+                                         system_up, system_down,
+                                         counters.variance(dsnap, domain_base)),
+        "flows":       agent.flow_entries(agent.flow_table.snapshot(), flow_base,
+                                          agent.TOP_N_FLOWS),
+        "sampling":    agent.sampling_summary(proc_iv, proc_var),
+    }
+    return wire.ReportEncoder().encode(payload)
+
+# ─── Measurement ──────────────────────────────────────────────────────────────
+
+def measure(source, backend, frames, ports):
+    replay  = RUNNERS[backend](frames)
+    packets = getattr(replay, "packets", len(frames))
+    up      = sum(length for data, length in frames[:packets] if data[26:30] == _LOCAL)
+    down    = sum(length for _data, length in frames[:packets]) - up
+
+    # Timed pass, as the agent runs (gc on, no tracing).
+    reset_agent(ports)
+    bases = (agent.packet_counters.snapshot(), agent.domain_counters.snapshot(),
+             agent.flow_table.snapshot())
+    blocks = sys.getallocatedblocks()
+    start  = time.perf_counter_ns()
+    replay()
+    elapsed = time.perf_counter_ns() - start
+    kept    = sys.getallocatedblocks() - blocks
+
+    start = time.perf_counter_ns()
+    for _ in range(REPORTS):
+        size = len(build_report(bases, up, down))
+    report_ns = (time.perf_counter_ns() - start) / REPORTS
+
+    # Second pass under tracemalloc for the memory peak.
+    reset_agent(ports)
+    gc.collect()
+    tracemalloc.start()
+    replay()
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stats = agent._pkt_stats
+    return {
+        "source":             source,
+        "backend":            backend,
+        "packets":            packets,
+        "seconds":            round(elapsed / 1e9, 4),
+        "pps":                round(packets / (elapsed / 1e9)),
+        "ns_per_packet":      round(elapsed / packets, 1),
+        "blocks_per_packet":  round(kept / packets, 4),
+        "peak_kib":           round(peak / 1024, 1),
+        "attributed":         stats.attributed,
+        "unattributed":       stats.unattributed,
+        "report_us":          round(report_ns / 1000, 1),
+        "report_bytes":       size,
+    }
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(results, old_path):
+    with open(old_path) as f:
+        old = {(r["source"], r["backend"]): r for r in json.load(f)["results"]}
+    print(f"\nvs {old_path} (ns/packet and report time, new / old)")
+    for r in results:
+        o = old.get((r["source"], r["backend"]))
+        if o:
+            print(f"  {r['source']:<14} {r['backend']:<6} "
+                  f"{r['ns_per_packet'] / o['ns_per_packet']:>6.2f}x  "
+                  f"{r['report_us'] / o['report_us']:>6.2f}x")
+
+def main():
+    global SCAPY_PACKETS, LOCAL_IP, _LOCAL
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--pcap", action="append", default=[], help="classic pcap file (repeatable)")
+    ap.add_argument("--mix", action="append", choices=MIXES,
+                    help="synthetic mix (repeatable; default all unless --pcap is given)")
+    ap.add_argument("--backend", action="append", choices=BACKENDS,
+                    help="capture backend (repeatable; default all)")
+    ap.add_argument("--packets", type=int, default=PACKETS, help="packets per mix / pcap")
+    ap.add_argument("--scapy-packets", type=int, default=SCAPY_PACKETS)
+    ap.add_argument("--local-ip", help="capturing host's address in the pcaps (default: guessed)")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--compare", help="earlier --json output to compare against")
+    args = ap.parse_args()
+    SCAPY_PACKETS = args.scapy_packets
+
+    rng   = random.Random(args.seed)
+    ports = rng.sample(range(1024, 65535), 256)
+    sources = []
+    for path in args.pcap:
+        frames = read_pcap(path, args.packets)
+        ip     = args.local_ip or guess_local_ip(frames)
+        sources.append((os.path.basename(path), ip, frames,
+                        local_ports(frames, socket.inet_aton(ip))))
+    for mix in args.mix or (() if args.pcap else MIXES):
+        frames = globals()["mix_" + mix](rng, args.packets, ports)
+        sources.append((mix, LOCAL_IP, [(data, len(data)) for data in frames], ports))
+
+    results = []
+    print(f"{'source':<14} {'backend':<7} {'packets':>8} {'pkt/s':>10} {'ns/pkt':>8} "
+          f"{'blk/pkt':>8} {'peak KiB':>9} {'report µs':>10}")
+    for source, ip, frames, owned in sources:
+        LOCAL_IP, _LOCAL = ip, socket.inet_aton(ip)
+        for backend in args.backend or BACKENDS:
+            r = measure(source, backend, frames, owned)
+            results.append(r)
+            print(f"{source:<14} {backend:<7} {r['packets']:>8} {r['pps']:>10} "
+                  f"{r['ns_per_packet']:>8} {r['blocks_per_packet']:>8} "
+                  f"{r['peak_kib']:>9} {r['report_us']:>10}")
+
+    if args.json:
+        out = {
+            "commit":    _commit(),
+            "python":    platform.python_version(),
+            "machine":   platform.machine(),
+            "timestamp": round(time.time()),
+            "seed":      args.seed,
+            "results":   results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(out, f, indent=2)
+        print(f"\nwrote {args.json}")
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Agent startup time and memory, each case in a fresh interpreter.
+
+Measures what the agent costs before it sees a packet: importing `agent`
+(all capture backends but Scapy), plus loading the Scapy fallback layers,
+against the old `from scapy.all import ...` for reference. Each case runs
+`--runs` times in a new process; the median import time, whole-process
+wall time and peak RSS are reported.
+
+    cd LinuxAgent && python3 benchmarks/startup.py
+    python3 benchmarks/startup.py --json startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..")
+RUNS = 5
+
+CASES = {
+    "python":       "pass",
+    "agent":        "import agent",
+    "agent+scapy":  "import agent; agent._load_scapy()",
+    "scapy.all":    "import agent; import scapy.all",
+}
+
+_PROBE = """
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_s": elapsed,
+                   "rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}}))
+"""
+
+def run_case(code):
+    probe = _PROBE.format(root=ROOT, code=code)
+    start = time.perf_counter()
+    out   = subprocess.run([sys.executable, "-c", probe], capture_output=True,
+                           text=True, check=True).stdout
+    wall  = time.perf_counter() - start
+    return {**json.loads(out.splitlines()[-1]), "wall_s": wall}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--runs", type=int, default=RUNS)
+    ap.add_argument("--json", help="write results to this file")
+    args = ap.parse_args()
+
+    results = []
+    print(f"{'case':<13} {'import ms':>10} {'process ms':>11} {'peak RSS MiB':>13}")
+    for name, code in CASES.items():
+        runs = [run_case(code) for _ in range(args.runs)]
+        r = {
+            "case":      name,
+            "import_ms": round(statistics.median(x["import_s"] for x in runs) * 1000, 1),
+            "wall_ms":   round(statistics.median(x["wall_s"]   for x in runs) * 1000, 1),
+            "rss_mib":   round(statistics.median(x["rss_kib"]  for x in runs) / 1024, 1),
+        }
+        results.append(r)
+        print(f"{name:<13} {r['import_ms']:>10} {r['wall_ms']:>11} {r['rss_mib']:>13}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"python": platform.python_version(), "timestamp": round(time.time()),
+                       "runs": args.runs, "results": results}, f, indent=2)
+        print(f"\nwrote {args.json}")
+
+if __name__ == "__main__":
+    main()
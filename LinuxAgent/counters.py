@@ -0,0 +1,180 @@
+"""Lock-free packet accumulators for the Linux agent.
+
+The capture thread is the only writer. Byte counters only ever grow and
+live in flat arrays indexed by an interned process id, so the reporter can
+copy them at any time without a lock and diff two copies to get an
+interval. DNS names go through a deque, whose append/popleft are atomic.
+When packets are sampled, the estimate's variance is accumulated the same
+way (see `sampling`). With a capacity, slots idle for IDLE_TIMEOUT are
+handed to new names; as in `flows`, a generation per slot tells the
+reporter a reused slot from a continuing one, and a sequence counter is odd
+while a slot is being reassigned.
+"""
+import time
+from array import array
+from collections import deque
+
+DNS_BACKLOG  = 65536    # max DNS names buffered between two reports
+IDLE_TIMEOUT = 300      # seconds without bytes before a slot may be reused (> flows.IDLE_TIMEOUT)
+SWEEP_EVERY  = 5        # seconds between looks for idle slots while full
+
+
+class PacketCounters:
+    """Per-process upload/download byte counters plus a DNS name queue.
+
+    With a `capacity`, at most that many names have slots, so memory stays
+    bounded whatever the traffic. A new name takes the slot of one idle for
+    IDLE_TIMEOUT; if there is none its bytes go to the `overflow` name (one
+    of the slots), or are not counted without one.
+
+    `now` is a coarse clock the port-cache refresher advances, so the
+    packet path never reads the system clock. Slots outlive the flows that
+    point at them (`flows.FlowTable.proc`) because IDLE_TIMEOUT is longer.
+    A name that comes back after its slot went to another starts its
+    totals again.
+    """
+
+    def __init__(self, capacity=None, overflow=None):
+        self.capacity = capacity
+        self.overflow = overflow
+        self.now   = 0.0
+        self.seq   = 0              # odd while a slot is being reassigned
+        self._ids  = {}             # name -> slot
+        self._free = []             # idle slots to hand out
+        self._next_sweep = 0.0
+        self.names = []             # slot -> name
+        self.up    = array("q")
+        self.down  = array("q")
+        self.var   = array("d")     # sampling variance of up + down
+        self.gen   = array("q")     # bumped when a slot changes hands
+        self._last = array("d")     # `now` of the slot's last bytes
+        self.dns   = deque(maxlen=DNS_BACKLOG)
+
+    # ── capture thread ───────────────────────────────────────────────────────
+
+    def _intern(self, name):
+        slot = len(self.names)
+        # Grow the arrays before publishing the name so a concurrent
+        # snapshot never sees a name without its slots.
+        self.up.append(0)
+        self.down.append(0)
+        self.var.append(0.0)
+        self.gen.append(0)
+        self._last.append(self.now)
+        self.names.append(name)
+        self._ids[name] = slot
+        return slot
+
+    def _slot_for(self, name):
+        """Slot for a name without one, or -1 when there is none to give."""
+        reserve = self.overflow is not None and self.overflow not in self._ids
+        if len(self.names) < self.capacity - reserve:
+            return self._intern(name)
+        if not self._free and self.now >= self._next_sweep:
+            self._sweep()
+        if self._free:
+            slot = self._free.pop()
+            self.seq += 1
+            self.up[slot]    = 0
+            self.down[slot]  = 0
+            self.var[slot]   = 0.0
+            self.gen[slot]  += 1
+            self.names[slot] = name
+            self.seq += 1
+            self._ids[name]  = slot
+            return slot
+        if self.overflow is None:
+            return -1
+        slot = self._ids.get(self.overflow)
+        return self._intern(self.overflow) if slot is None else slot
+
+    def _sweep(self):
+        self._next_sweep = self.now + SWEEP_EVERY
+        cutoff = self.now - IDLE_TIMEOUT
+        last   = self._last
+        for name, slot in list(self._ids.items()):
+            if last[slot] < cutoff and name != self.overflow:
+                del self._ids[name]
+                self._free.append(slot)
+
+    def add_bytes(self, name, is_upload, length, var=0.0):
+        """Count `length` bytes for `name` and return its slot (-1 if not counted)."""
+        slot = self._ids.get(name)
+        if slot is None:
+            slot = self._intern(name) if self.capacity is None else self._slot_for(name)
+            if slot < 0:
+                return -1
+        self._last[slot] = self.now
+        if is_upload:
+            self.up[slot] += length
+        else:
+            self.down[slot] += length
+        if var:
+            self.var[slot] += var
+        return slot
+
+    def add_dns(self, qname):
+        self.dns.append(qname)
+
+    # ── reporter ─────────────────────────────────────────────────────────────
+
+    def snapshot(self, retries=1000):
+        """Copy of the cumulative counters as (names, up, down, var, gen).
+
+        Retries while a slot is being reassigned; after `retries` attempts
+        the last copy is returned as is.
+        """
+        for _ in range(retries):
+            seq = self.seq
+            if seq & 1:
+                time.sleep(0)
+                continue
+            snap = self._copy()
+            if self.seq == seq:
+                return snap
+        return self._copy()
+
+    def _copy(self):
+        n = len(self.names)
+        return self.names[:n], self.up[:n].tolist(), self.down[:n].tolist(), \
+               self.var[:n].tolist(), self.gen[:n].tolist()
+
+    def drain_dns(self):
+        """Remove and return every DNS name queued so far, de-duplicated."""
+        names = set()
+        pop   = self.dns.popleft
+        for _ in range(len(self.dns)):
+            names.add(pop())
+        return names
+
+
+def delta(new, old):
+    """Per-process byte counts between two snapshots, as the reporter expects.
+
+    Returns {name: {"upload": n, "download": n}} for processes that moved.
+    A slot reused since `old` counts from zero.
+    """
+    names, up, down, gen = new[0], new[1], new[2], new[4]
+    old_up, old_down, old_gen = old[1], old[2], old[4]
+    base = len(old_up)
+    out  = {}
+    for i, name in enumerate(names):
+        same = i < base and gen[i] == old_gen[i]
+        u = up[i]   - (old_up[i]   if same else 0)
+        d = down[i] - (old_down[i] if same else 0)
+        if u or d:
+            out[name] = {"upload": u, "download": d}
+    return out
+
+def variance(new, old):
+    """Sampling variance per name between two snapshots, for names that have any."""
+    names, var, gen = new[0], new[3], new[4]
+    old_var, old_gen = old[3], old[4]
+    base = len(old_var)
+    out  = {}
+    for i, name in enumerate(names):
+        same = i < base and gen[i] == old_gen[i]
+        v = var[i] - (old_var[i] if same else 0.0)
+        if v > 0:
+            out[name] = v
+    return out
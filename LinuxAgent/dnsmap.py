@@ -0,0 +1,70 @@
+"""Remote IP → domain map learned from DNS answers, for the Linux agent.
+
+Written and read only by the capture thread. Lookups are a dict get plus a
+flag store, so they are cheap enough to run for every packet.
+"""
+import time
+from collections import OrderedDict
+
+MIN_HOLD     = 300      # seconds an answer is kept regardless of a shorter TTL
+SWEEP_EVERY  = 30       # seconds between expiry sweeps
+
+
+class DomainMap:
+    """Bounded IP → domain map with TTL expiry and CLOCK-style LRU eviction.
+
+    Entries live for max(TTL, MIN_HOLD): connections routinely outlast short
+    CDN TTLs. An entry that is past its expiry but was looked up since the
+    last sweep is kept for another MIN_HOLD, since its connection is still
+    in use. When the map is full, the oldest entry is evicted unless it was
+    used recently, in which case it gets a second chance.
+    """
+
+    def __init__(self, maxsize=8192):
+        self.maxsize    = maxsize
+        self.evictions  = 0
+        self._map       = OrderedDict()     # ip -> [domain, expires, referenced]
+        self._next_sweep = 0.0
+
+    def get(self, ip):
+        entry = self._map.get(ip)
+        if entry is None:
+            return None
+        entry[2] = True
+        return entry[0]
+
+    def learn(self, ip, domain, ttl):
+        now   = time.monotonic()
+        entry = self._map.get(ip)
+        if entry is not None:
+            entry[0] = domain
+            entry[1] = max(entry[1], now + max(ttl, MIN_HOLD))
+            self._map.move_to_end(ip)
+        else:
+            self._map[ip] = [domain, now + max(ttl, MIN_HOLD), False]
+            if len(self._map) > self.maxsize:
+                self._evict()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+    def _evict(self):
+        while len(self._map) > self.maxsize:
+            ip, entry = self._map.popitem(last=False)
+            if entry[2]:
+                entry[2] = False
+                self._map[ip] = entry       # second chance
+            else:
+                self.evictions += 1
+
+    def _sweep(self, now):
+        for ip, entry in list(self._map.items()):
+            if entry[1] <= now:
+                if entry[2]:
+                    entry[1] = now + MIN_HOLD
+                else:
+                    del self._map[ip]
+            entry[2] = False
+        self._next_sweep = now + SWEEP_EVERY
+
+    def __len__(self):
+        return len(self._map)
@@ -0,0 +1,208 @@
+"""Fixed-capacity 5-tuple flow table for the Linux agent.
+
+Flows are keyed by (proto, local port, remote IP, remote port) packed into
+one int. All per-slot state lives in flat 64-bit columns carved out of one
+buffer, so memory is fixed at startup no matter how many flows come and go,
+and the table can be placed in shared memory for the capture worker
+(`worker.py`). Like `counters`, there is a single writer and byte counters
+only grow while a slot is in use. Each slot carries a generation number so
+the reporter can tell a reused slot from a continuing flow, and a sequence
+counter in the header is odd while slots are being (re)assigned so readers
+can take a consistent copy without a lock.
+"""
+import time
+
+IDLE_TIMEOUT   = 120        # seconds without packets before a flow is evicted
+SWEEP_EVERY    = 5          # seconds between idle sweeps
+PANIC_TIMEOUT  = 10         # idle cut-off used when the table is full
+
+_HEADER   = 4                                           # seq, overflow, evicted, spare
+_COLUMNS  = ("ka", "kb", "gen", "proc", "up", "down")   # int64 columns
+_KB_BITS  = 48
+
+
+def flow_key(proto, local_port, remote_ip, remote_port):
+    return (((proto << 16 | local_port) << 32 | remote_ip) << 16) | remote_port
+
+def split_key(key):
+    """(proto, local_port, remote_ip, remote_port) from a packed key."""
+    return key >> 64, (key >> 48) & 0xFFFF, (key >> 16) & 0xFFFFFFFF, key & 0xFFFF
+
+
+class FlowTable:
+    """Slot-allocated flow counters with idle eviction.
+
+    A key is stored as two columns: `ka` = proto << 16 | local port (0 for a
+    free slot) and `kb` = remote IP << 16 | remote port. `proc` holds the
+    owning process' slot in the agent's `PacketCounters`, or -1.
+
+    `now` is a coarse clock the port-cache refresher advances, so the packet
+    path never reads the system clock. When every slot is busy, flows idle
+    for PANIC_TIMEOUT are reclaimed; packets of flows that still find no
+    slot are counted in `overflow` only.
+
+    `buf` may be an existing buffer of `nbytes(capacity)` bytes; flows
+    already recorded in it are picked up, which is how a restarted capture
+    worker carries on where the previous one stopped.
+    """
+
+    def __init__(self, capacity=16384, idle_timeout=IDLE_TIMEOUT, buf=None):
+        self.capacity     = capacity
+        self.idle_timeout = idle_timeout
+        self.now          = 0.0
+        self._next_sweep  = 0.0
+        self._next_panic  = 0.0
+
+        size = self.nbytes(capacity)
+        view = memoryview(bytearray(size) if buf is None else buf)[:size]
+        self._hdr = view[:_HEADER * 8].cast("q")
+        off = _HEADER * 8
+        for name in _COLUMNS:
+            setattr(self, name, view[off:off + capacity * 8].cast("q"))
+            off += capacity * 8
+        self._last = view[off:off + capacity * 8].cast("d")
+        self._view = view
+
+        if self._hdr[0] & 1:
+            self._hdr[0] += 1           # previous writer died mid-update
+        self._index = {}                # key -> slot
+        self._free  = []
+        ka, kb = self.ka, self.kb
+        for slot in range(capacity - 1, -1, -1):
+            if ka[slot]:
+                self._index[ka[slot] << _KB_BITS | kb[slot]] = slot
+            else:
+                self._free.append(slot)
+
+    @staticmethod
+    def nbytes(capacity):
+        return (_HEADER + (len(_COLUMNS) + 1) * capacity) * 8
+
+    @property
+    def overflow(self):
+        return self._hdr[1]
+
+    @property
+    def evicted(self):
+        return self._hdr[2]
+
+    def release(self):
+        """Drop the views onto `buf` so a shared-memory block can be closed."""
+        for name in _COLUMNS:
+            getattr(self, name).release()
+        self._last.release()
+        self._hdr.release()
+        self._view.release()
+
+    # ── capture thread ───────────────────────────────────────────────────────
+
+    def add(self, key, proc, is_upload, length):
+        now  = self.now
+        slot = self._index.get(key)
+        if slot is None:
+            if now >= self._next_sweep:
+                self._sweep(now, self.idle_timeout)
+                self._next_sweep = now + SWEEP_EVERY
+            if not self._free and now >= self._next_panic:
+                self._sweep(now, PANIC_TIMEOUT)
+                self._next_panic = now + 1
+            if not self._free:
+                self._hdr[1] += 1
+                return
+            slot = self._free.pop()
+            hdr  = self._hdr
+            hdr[0] += 1
+            self.up[slot]   = 0
+            self.down[slot] = 0
+            self.gen[slot] += 1
+            self.ka[slot]   = key >> _KB_BITS
+            self.kb[slot]   = key & ((1 << _KB_BITS) - 1)
+            hdr[0] += 1
+            self._index[key] = slot
+        self.proc[slot]  = proc
+        self._last[slot] = now
+        if is_upload:
+            self.up[slot] += length
+        else:
+            self.down[slot] += length
+
+    def _sweep(self, now, idle):
+        cutoff = now - idle
+        last   = self._last
+        stale  = [(key, slot) for key, slot in self._index.items() if last[slot] < cutoff]
+        if not stale:
+            return
+        hdr = self._hdr
+        hdr[0] += 1
+        for key, slot in stale:
+            del self._index[key]
+            self.ka[slot] = 0
+            self._free.append(slot)
+        hdr[2] += len(stale)
+        hdr[0] += 1
+
+    # ── reporter ─────────────────────────────────────────────────────────────
+
+    def snapshot(self, retries=1000):
+        """Consistent copy of the columns as (gen, ka, kb, up, down, proc).
+
+        Retries while slots are being reassigned; after `retries` attempts
+        the last copy is returned as is.
+        """
+        hdr = self._hdr
+        for _ in range(retries):
+            seq = hdr[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            snap = (self.gen.tolist(), self.ka.tolist(), self.kb.tolist(),
+                    self.up.tolist(), self.down.tolist(), self.proc.tolist())
+            if hdr[0] == seq:
+                return snap
+        return (self.gen.tolist(), self.ka.tolist(), self.kb.tolist(),
+                self.up.tolist(), self.down.tolist(), self.proc.tolist())
+
+    def __len__(self):
+        return len(self._index)
+
+
+def top_flows(new, old, n):
+    """Top `n` flows by bytes between two snapshots.
+
+    Returns [(key, proc, interval_up, interval_down, total_up, total_down)].
+    """
+    gen, ka, kb, up, down, proc = new
+    old_gen, _, _, old_up, old_down, _ = old
+    moved = []
+    for slot, a in enumerate(ka):
+        if not a:
+            continue
+        if gen[slot] == old_gen[slot]:
+            du, dd = up[slot] - old_up[slot], down[slot] - old_down[slot]
+        else:
+            du, dd = up[slot], down[slot]
+        if du or dd:
+            moved.append((du + dd, slot, du, dd))
+    moved.sort(reverse=True)
+    return [
+        (ka[slot] << _KB_BITS | kb[slot], proc[slot], du, dd, up[slot], down[slot])
+        for _, slot, du, dd in moved[:n]
+    ]
+
+def by_remote(new, old):
+    """Bytes per remote IP between two snapshots as {ip: [up, down]}."""
+    gen, ka, kb, up, down, _ = new
+    old_gen, _, _, old_up, old_down, _ = old
+    out = {}
+    for slot, a in enumerate(ka):
+        if not a:
+            continue
+        if gen[slot] == old_gen[slot]:
+            du, dd = up[slot] - old_up[slot], down[slot] - old_down[slot]
+        else:
+            du, dd = up[slot], down[slot]
+        if du or dd:
+            entry = out.setdefault(kb[slot] >> 16, [0, 0])
+            entry[0] += du
+            entry[1] += dd
+    return out
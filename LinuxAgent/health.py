@@ -0,0 +1,98 @@
+"""Self-telemetry for the Linux agent.
+
+Latencies go into HDR-style log-linear histograms: 16 sub-buckets per power
+of two, so every recorded value is kept to within ~6% over the whole range
+from nanoseconds to minutes, in a fixed 1000-slot array. Like `counters`,
+buckets only grow and have a single writer; the reporter diffs two copies
+to get the distribution of one interval.
+"""
+import time
+
+SUB_BITS  = 4
+_SUB      = 1 << SUB_BITS
+BUCKETS   = 1000
+TIME_EVERY = 64             # packets between two timed callbacks
+
+
+def _index(v):
+    n = v.bit_length()
+    if n <= SUB_BITS + 1:
+        return v
+    shift = n - SUB_BITS - 1
+    return shift * _SUB + (v >> shift)
+
+def _lower(idx):
+    if idx < 2 * _SUB:
+        return idx
+    shift = idx // _SUB - 1
+    return (idx % _SUB + _SUB) << shift
+
+
+class Histogram:
+    """Log-linear histogram of non-negative integers (nanoseconds here).
+
+    `buf` may be an existing buffer of `nbytes()` bytes, e.g. in the capture
+    worker's shared block.
+    """
+
+    def __init__(self, buf=None):
+        view = memoryview(bytearray(self.nbytes()) if buf is None else buf)
+        self.counts = view[:self.nbytes()].cast("q")
+
+    @staticmethod
+    def nbytes():
+        return BUCKETS * 8
+
+    def record(self, value):
+        idx = _index(value)
+        self.counts[idx if idx < BUCKETS else BUCKETS - 1] += 1
+
+    def snapshot(self):
+        return self.counts.tolist()
+
+    def release(self):
+        self.counts.release()
+
+
+def summary(new, old, unit=1000):
+    """count, p50, p90, p99 and max between two snapshots, in `unit` ns (µs)."""
+    diff  = [a - b for a, b in zip(new, old)]
+    count = sum(diff)
+    out   = {"count": count, "p50": 0.0, "p90": 0.0, "p99": 0.0, "max": 0.0}
+    if not count:
+        return out
+    wanted = [("p50", 0.50), ("p90", 0.90), ("p99", 0.99)]
+    seen   = 0
+    for idx, n in enumerate(diff):
+        if not n:
+            continue
+        seen += n
+        while wanted and seen >= wanted[0][1] * count:
+            out[wanted.pop(0)[0]] = round(_lower(idx) / unit, 1)
+        out["max"] = round(_lower(idx) / unit, 1)
+    return out
+
+
+class PacketStats:
+    """Packet-path counters, written by the capture thread only."""
+
+    def __init__(self):
+        self.packets      = 0
+        self.attributed   = 0
+        self.unattributed = 0
+        self.callback     = Histogram()
+
+
+class Timer:
+    """Histogram fed by a context manager, for code outside the packet path."""
+
+    def __init__(self):
+        self.hist = Histogram()
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.record(time.perf_counter_ns() - self._start)
+        return False
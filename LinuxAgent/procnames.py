@@ -0,0 +1,76 @@
+"""Bounded PID → process-name cache for the Linux agent.
+
+Each entry remembers the process create time, so a PID that is recycled by
+a different process is re-resolved instead of inheriting the old name.
+"""
+import threading
+from collections import OrderedDict
+
+import psutil
+
+
+def _resolve(pid):
+    try:
+        proc = psutil.Process(pid)
+        return proc.create_time(), proc.name()
+    except Exception:
+        return None, f"PID-{pid}"
+
+def _create_time(pid):
+    try:
+        return psutil.Process(pid).create_time()
+    except Exception:
+        return None
+
+
+class ProcNameCache:
+    """LRU map of pid → (create_time, name).
+
+    `get()` runs on the packet path and only touches procfs on a miss.
+    `retain()` runs from the port-cache refresher and drops processes that
+    no longer own sockets, have exited, or whose PID has been reused.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize   = maxsize
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self._entries  = OrderedDict()
+        self._lock     = threading.Lock()   # serialises retain() passes
+
+    def get(self, pid):
+        entry = self._entries.get(pid)
+        if entry is not None:
+            self.hits += 1
+            try:
+                self._entries.move_to_end(pid)
+            except KeyError:
+                pass                # dropped by retain() in the meantime
+            return entry[1]
+
+        self.misses += 1
+        entry = _resolve(pid)
+        self._entries[pid] = entry
+        if len(self._entries) > self.maxsize:
+            try:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            except KeyError:
+                pass
+        return entry[1]
+
+    def retain(self, live_pids):
+        """Drop entries whose process is not in `live_pids` or has been replaced."""
+        with self._lock:
+            for pid, (created, _name) in list(self._entries.items()):
+                if pid not in live_pids or created is None or _create_time(pid) != created:
+                    self._entries.pop(pid, None)
+
+    def stats(self):
+        return {
+            "size":      len(self._entries),
+            "hits":      self.hits,
+            "misses":    self.misses,
+            "evictions": self.evictions,
+        }
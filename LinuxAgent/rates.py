@@ -0,0 +1,68 @@
+"""Fixed-cadence interface byte counters for the Linux agent.
+
+A thread reads `psutil.net_io_counters()` every `step` seconds. Tick k is
+due at origin + k·step on the monotonic clock, so a late wakeup does not
+push back later ticks, and sending a report never shifts the schedule.
+The reporter waits for a tick instead of sleeping. Report boundaries
+therefore fall exactly on samples, and the samples in between give the
+per-second rate series.
+"""
+import threading
+import time
+from collections import deque, namedtuple
+
+Sample = namedtuple("Sample", "tick t sent recv")
+
+
+class RateSampler:
+    """Interface counters sampled on a drift-free `step`-second schedule.
+
+    `read` returns an object with `bytes_sent` and `bytes_recv`. The last
+    `keep` samples are kept, enough for the longest report interval.
+    """
+
+    def __init__(self, read, step=1.0, keep=512):
+        self.read    = read
+        self.step    = step
+        self.skipped = 0                    # ticks missed because a read ran late
+        self._samples = deque(maxlen=keep)
+        self._cond    = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self.wait(0)
+
+    def _run(self):
+        origin = time.monotonic()
+        tick   = 0
+        while True:
+            io = self.read()
+            with self._cond:
+                self._samples.append(Sample(tick, time.monotonic(), io.bytes_sent, io.bytes_recv))
+                self._cond.notify_all()
+            tick += 1
+            delay = origin + tick * self.step - time.monotonic()
+            if delay < 0:
+                # Overran one or more ticks: skip them rather than bunch up.
+                missed        = int(-delay // self.step) + 1
+                tick         += missed
+                self.skipped += missed
+                delay        += missed * self.step
+            time.sleep(delay)
+
+    def wait(self, tick):
+        """Block until tick `tick` (or a later one) is sampled; return the newest sample."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._samples and self._samples[-1].tick >= tick)
+            return self._samples[-1]
+
+    def series(self, first, last):
+        """Per-step (upload, download) bytes/s between samples `first` and `last`."""
+        with self._cond:
+            window = [s for s in self._samples if first.tick <= s.tick <= last.tick]
+        up, down = [], []
+        for a, b in zip(window, window[1:]):
+            dt = (b.t - a.t) or self.step
+            up.append(max(0, round((b.sent - a.sent) / dt)))
+            down.append(max(0, round((b.recv - a.recv) / dt)))
+        return up, down
@@ -0,0 +1,49 @@
+"""Adaptive 1-in-N packet sampling for the Linux agent.
+
+The kernel keeps one frame in N (`capture.sampling_filter`), and every kept
+frame is counted as N times its length. For that Horvitz–Thompson estimate
+an unbiased variance contribution of a kept frame of `length` bytes is
+N·(N-1)·length², so counters accumulate it next to the bytes and error
+bounds for any interval follow from the variance delta.
+"""
+import math
+
+Z95      = 1.96         # two-sided 95% normal quantile
+MAX_RATE = 1024
+
+
+def scale(rate, length):
+    """(scaled length, variance contribution) of one kept frame."""
+    return length * rate, float((rate - 1) * rate * length * length)
+
+def error(variance):
+    """95% error bound in bytes for an estimate with `variance`."""
+    return Z95 * math.sqrt(variance) if variance > 0 else 0.0
+
+
+class RateController:
+    """Picks the sampling rate from the observed packet rate and CPU use.
+
+    The rate is the smallest power of two that keeps processed packets
+    under `max_pps`, doubled again while the agent uses more than
+    `cpu_budget` percent of a core. It only relaxes one step per update,
+    and only while CPU is well under budget, so it does not oscillate.
+    """
+
+    def __init__(self, max_pps=20000, cpu_budget=50.0, max_rate=MAX_RATE):
+        self.max_pps    = max_pps
+        self.cpu_budget = cpu_budget
+        self.max_rate   = max_rate
+        self.rate       = 1
+
+    def update(self, pps, cpu):
+        rate   = self.rate
+        target = 1
+        while pps / target > self.max_pps and target < self.max_rate:
+            target *= 2
+        if cpu > self.cpu_budget:
+            target = max(target, rate * 2)
+        if target < rate:
+            target = rate // 2 if cpu < self.cpu_budget / 2 else rate
+        self.rate = max(1, min(self.max_rate, target))
+        return self.rate
@@ -0,0 +1,155 @@
+"""Incremental (proto, local port) → PID index for the Linux agent.
+
+Socket tables are read from /proc/net/{tcp,udp,tcp6,udp6}, which only lists
+sockets and their inodes. Inodes are mapped to PIDs through /proc/<pid>/fd,
+and only for inodes that were not seen on the previous refresh, so a steady
+set of long-lived connections costs one table read per refresh instead of a
+walk over every process's file descriptors. Inodes no process owns (kernel
+sockets such as NFS, WireGuard or VXLAN) are remembered as such and only
+looked for again after ORPHAN_TTL.
+
+The capture path never reads procfs: a port missing from the index is
+queued with `request()`, and the refresher thread, which does all the
+reading, runs its next refresh early.
+"""
+import os
+import time
+from collections import deque
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+PROC_NET = {
+    IPPROTO_TCP: ("/proc/net/tcp6", "/proc/net/tcp"),
+    IPPROTO_UDP: ("/proc/net/udp6", "/proc/net/udp"),
+}
+
+MIN_REFRESH = 0.1     # seconds between refreshes brought forward by requests
+ORPHAN_TTL  = 30.0    # seconds before an inode no process owned is looked for again
+REQUESTS    = 1024    # ports queued for the refresher at most
+
+# ─── procfs readers ───────────────────────────────────────────────────────────
+
+def read_sockets(path, proto, out, want_port=None):
+    """Add {(proto, local port): inode} entries from one /proc/net table."""
+    try:
+        with open(path) as f:
+            f.readline()                     # header
+            for line in f:
+                fields = line.split()
+                inode  = int(fields[9])
+                if not inode:                # TIME_WAIT and friends have no owner
+                    continue
+                port = int(fields[1][-4:], 16)
+                if want_port is None or port == want_port:
+                    out[(proto, port)] = inode
+    except (OSError, IndexError, ValueError):
+        pass
+    return out
+
+def scan_fds(pids, wanted, found):
+    """Resolve socket inodes in `wanted` to PIDs by reading /proc/<pid>/fd.
+
+    Stops as soon as every wanted inode has been found. Returns `found`.
+    """
+    remaining = set(wanted)
+    for pid in pids:
+        try:
+            fds = os.scandir(f"/proc/{pid}/fd")
+        except OSError:
+            continue
+        with fds:
+            for entry in fds:
+                try:
+                    target = os.readlink(entry.path)
+                except OSError:
+                    continue
+                if target.startswith("socket:["):
+                    inode = int(target[8:-1])
+                    if inode in remaining:
+                        found[inode] = pid
+                        remaining.discard(inode)
+        if not remaining:
+            break
+    return found
+
+def all_pids():
+    return [int(name) for name in os.listdir("/proc") if name.isdigit()]
+
+# ─── Index ────────────────────────────────────────────────────────────────────
+
+class SocketIndex:
+    """(proto, local port) → PID map kept up to date by diffing socket inodes.
+
+    `pids` is replaced wholesale on every refresh and may be read without a
+    lock. Packets of sockets opened since the last refresh go unattributed
+    until the next one; `request()` asks for it to come sooner. A port is
+    queued at most once per refresh, so a port scan or traffic to closed
+    ports costs the packet path a set lookup, and the refresher at most one
+    refresh per MIN_REFRESH.
+    """
+
+    def __init__(self):
+        self.pids       = {}     # (proto, port) -> pid
+        self.wanted     = deque(maxlen=REQUESTS)   # ports the capture path found missing
+        self.generation = 0      # refreshes so far
+        self._asked     = set()  # ports queued during this generation, capture thread only
+        self._asked_gen = 0
+        self._inode_pid = {}     # inode -> pid
+        self._orphans   = {}     # inode -> monotonic time no process was found owning it
+        self.unowned    = set()  # (proto, port) of orphan inodes, not worth requesting
+
+    def _ordered_pids(self, inode_pid):
+        # Processes that already own sockets are the likeliest owners of new ones.
+        known = set(inode_pid.values())
+        return list(known) + [p for p in all_pids() if p not in known]
+
+    def refresh(self):
+        """Re-read the socket tables and resolve only inodes not seen before.
+
+        Returns the set of PIDs that currently own an indexed socket.
+        """
+        for _ in range(len(self.wanted)):
+            self.wanted.popleft()            # this refresh answers them
+        key_inode = {}
+        for proto, paths in PROC_NET.items():
+            for path in paths:               # IPv4 table last so it wins on clashes
+                read_sockets(path, proto, key_inode)
+
+        now     = time.monotonic()
+        live    = set(key_inode.values())
+        known   = {i: p for i, p in self._inode_pid.items() if i in live}
+        orphans = {i: t for i, t in self._orphans.items()
+                   if i in live and now - t < ORPHAN_TTL}
+        unknown = live - known.keys() - orphans.keys()
+        if unknown:
+            scan_fds(self._ordered_pids(known), unknown, known)
+            for inode in unknown - known.keys():
+                orphans[inode] = now
+
+        self._inode_pid = known
+        self._orphans   = orphans
+        self.pids       = {k: known[i] for k, i in key_inode.items() if i in known}
+        self.unowned    = {k for k, i in key_inode.items() if i in orphans}
+        self.generation += 1
+        return set(known.values())
+
+    def request(self, proto, port):
+        """Queue a (proto, port) missing from `pids` for the refresher.
+
+        Called from the packet path; never blocks and never reads procfs.
+        """
+        if self._asked_gen != self.generation:
+            self._asked, self._asked_gen = set(), self.generation
+        key = (proto, port)
+        if key not in self._asked and key not in self.unowned:
+            self._asked.add(key)
+            self.wanted.append(key)
+
+    def wait(self, timeout):
+        """Sleep until the next refresh is due: `timeout` from now, or
+        MIN_REFRESH from now if a port is requested in the meantime."""
+        deadline = time.monotonic() + timeout
+        time.sleep(min(timeout, MIN_REFRESH))
+        while not self.wanted and time.monotonic() < deadline:
+            time.sleep(min(MIN_REFRESH, max(0.0, deadline - time.monotonic())))
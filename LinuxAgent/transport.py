@@ -0,0 +1,197 @@
+"""Master connection and offline spool for the Linux agent.
+
+`MasterClient` keeps one HTTP/1.1 keep-alive connection to the master and
+backs off exponentially while it is unreachable. Reports that could not be
+delivered go to a `Spool` — append-only NDJSON segment files with a total
+size cap — and are replayed oldest-first once the master answers again.
+"""
+import http.client
+import json
+import os
+import random
+import time
+
+# ─── HTTP client ──────────────────────────────────────────────────────────────
+
+class HTTPError(Exception):
+    def __init__(self, code, body):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+        self.body = body
+
+
+class MasterClient:
+    """Keep-alive POST client with exponential backoff between failures."""
+
+    def __init__(self, host, port, timeout=5, backoff_base=1.0, backoff_max=120.0):
+        self.host         = host
+        self.port         = int(port)
+        self.timeout      = timeout
+        self.backoff_base = backoff_base
+        self.backoff_max  = backoff_max
+        self.failures     = 0
+        self._retry_at    = 0.0
+        self._conn        = None
+
+    def available(self):
+        """False while backing off after a failure."""
+        return time.monotonic() >= self._retry_at
+
+    def _fail(self):
+        self.close()
+        self.failures += 1
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+        # Full jitter so a fleet of agents does not reconnect in lockstep.
+        self._retry_at = time.monotonic() + random.uniform(delay / 2, delay)
+
+    def _defer(self, retry_after):
+        """The master is busy: hold off for its Retry-After, plus jitter."""
+        try:
+            delay = max(0.0, float(retry_after))
+        except (TypeError, ValueError):
+            delay = self.backoff_base
+        self._retry_at = time.monotonic() + random.uniform(delay, 1.5 * delay)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def post(self, path, content_type, data):
+        """POST `data` and return the decoded JSON response.
+
+        Raises HTTPError for non-2xx answers and OSError/HTTPException when
+        the master cannot be reached; only the latter start a backoff, and
+        a 503 holds off for the master's Retry-After.
+        """
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self._conn.request("POST", path, body=data, headers={
+                "Content-Type": content_type,
+                "Connection":   "keep-alive",
+            })
+            resp = self._conn.getresponse()
+            body = resp.read()
+        except (OSError, http.client.HTTPException):
+            self._fail()
+            raise
+        if resp.will_close:
+            self.close()
+        self.failures  = 0
+        self._retry_at = 0.0
+        try:
+            decoded = json.loads(body.decode("utf-8")) if body else {}
+        except ValueError:
+            decoded = {}
+        if not 200 <= resp.status < 300:
+            if resp.status == 503:
+                self._defer(resp.getheader("Retry-After"))
+            raise HTTPError(resp.status, decoded)
+        return decoded
+
+# ─── Spool ────────────────────────────────────────────────────────────────────
+
+class Spool:
+    """Bounded on-disk FIFO of undelivered reports.
+
+    Records are appended as lines to `seg-<n>.ndjson` files; a new segment is
+    started every `segment_bytes`. When the spool exceeds `max_bytes` the
+    oldest segments are deleted. The read position is kept in a `head` file
+    so replay resumes where it stopped after an agent restart.
+    """
+
+    def __init__(self, path, segment_bytes=256 * 1024, max_bytes=16 * 1024 * 1024):
+        self.path          = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes     = max_bytes
+        self.dropped       = 0
+        os.makedirs(path, exist_ok=True)
+        self._segments = sorted(
+            int(f[4:-7]) for f in os.listdir(path)
+            if f.startswith("seg-") and f.endswith(".ndjson")
+        )
+        self._head_off = 0
+        try:
+            with open(self._head_file()) as f:
+                seg, off = f.read().split()
+            if self._segments and int(seg) == self._segments[0]:
+                self._head_off = int(off)
+        except (OSError, ValueError):
+            pass
+
+    def _seg_file(self, seg):
+        return os.path.join(self.path, f"seg-{seg}.ndjson")
+
+    def _head_file(self):
+        return os.path.join(self.path, "head")
+
+    def _size(self, seg):
+        try:
+            return os.path.getsize(self._seg_file(seg))
+        except OSError:
+            return 0
+
+    def empty(self):
+        return not self._segments or (
+            len(self._segments) == 1 and self._head_off >= self._size(self._segments[0])
+        )
+
+    def append(self, record):
+        line = json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+        if not self._segments or self._size(self._segments[-1]) + len(line) > self.segment_bytes:
+            self._segments.append(self._segments[-1] + 1 if self._segments else 0)
+        with open(self._seg_file(self._segments[-1]), "ab") as f:
+            f.write(line)
+        self._enforce_cap()
+
+    def _enforce_cap(self):
+        total = sum(self._size(s) for s in self._segments) - self._head_off
+        while len(self._segments) > 1 and total > self.max_bytes:
+            seg = self._segments.pop(0)
+            total -= self._size(seg) - self._head_off
+            with open(self._seg_file(seg), "rb") as f:
+                f.seek(self._head_off)
+                self.dropped += sum(1 for _ in f)
+            os.remove(self._seg_file(seg))
+            self._head_off = 0
+            self._save_head()
+
+    def peek(self, n):
+        """Up to `n` oldest records as (record, cursor) pairs.
+
+        Passing a record's cursor to `commit()` forgets it and everything
+        before it.
+        """
+        out = []
+        for i, seg in enumerate(self._segments):
+            with open(self._seg_file(seg), "rb") as f:
+                f.seek(self._head_off if i == 0 else 0)
+                for line in f:
+                    if len(out) >= n:
+                        return out
+                    if not line.endswith(b"\n"):
+                        break       # torn write from a crash
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    out.append((record, (i, f.tell())))
+        return out
+
+    def commit(self, cursor):
+        idx, off = cursor
+        for seg in self._segments[:idx]:
+            os.remove(self._seg_file(seg))
+        del self._segments[:idx]
+        self._head_off = off
+        if self._segments and off >= self._size(self._segments[0]):
+            os.remove(self._seg_file(self._segments.pop(0)))
+            self._head_off = 0
+        self._save_head()
+
+    def _save_head(self):
+        head = self._head_file()
+        with open(head + ".tmp", "w") as f:
+            f.write(f"{self._segments[0] if self._segments else 0} {self._head_off}")
+        os.replace(head + ".tmp", head)
@@ -0,0 +1,226 @@
+"""Compact binary report encoding for the agent → master `/usage` POST.
+
+Sent as `Content-Type: application/x-netmon-report` instead of JSON. Static
+identity fields are only included on the first report of a session, and
+lifetime totals are sent as deltas against the last report the master
+acknowledged. The layout (all integers are LEB128 varints, signed ones
+zig-zag encoded, strings are length-prefixed UTF-8):
+
+    "NM" version:u8 flags:u8            flags: 1 = identity, 2 = zlib body
+    body:
+      seq base timestamp mac:6s
+      [hostname username ip os state]   if flags & 1
+      usage.upload usage.download       centi-bytes/s
+      Δtotal_usage.upload Δtotal_usage.download
+      n × (ref [name] speed.up speed.down Δtotal.up Δtotal.down)
+      n × dns name
+      [n × (domain speed.up speed.down total.up total.down)]   optional
+      [n × (proto local_port remote_ip:4s remote_port process
+            speed.up speed.down total.up total.down)]         optional
+      [rate error n × process error, n × domain error]        optional
+      [capture packets attributed unattributed drops+1 cpu rss restarts
+       3 × (count p50 p90 p99 max)]                          optional
+      [step_ms n × (upload download)]                        optional
+      [capacity total floor n × (ip:4s upload download error)] optional
+
+Optional sections are positional: when one is present, all before it are
+written too, with a zero count if empty. Sampling `error` is in 1/10000 of
+the total, the per-entry errors in centi-bytes/s like speeds. In
+`agent_health`, drops+1 is 0 when unknown, cpu is in centi-%,
+and the callback/refresh/send latency summaries are in 1/10 µs. The
+`series` section holds the interval's per-step interface rates in bytes/s.
+`destinations` is the heavy-hitter sketch's top remote IPs (all in bytes,
+`bytes` = upload + download + error).
+
+`ref` is (name id << 1) | 1 when the name string follows, which happens
+until the master has acknowledged a report carrying that id.
+"""
+import ipaddress
+import struct
+import zlib
+
+CONTENT_TYPE = "application/x-netmon-report"
+VERSION      = 1
+MAGIC        = b"NM"
+
+FLAG_IDENTITY = 1
+FLAG_ZLIB     = 2
+ZLIB_MIN      = 256         # bodies smaller than this are not worth compressing
+
+HEALTH_LATENCIES = ("callback_us", "refresh_us", "send_us")
+HEALTH_QUANTILES = ("count", "p50", "p90", "p99", "max")
+
+_header = struct.Struct("!2sBB")
+
+# ─── Primitives ───────────────────────────────────────────────────────────────
+
+def put_uvarint(out, n):
+    if n < 0:
+        raise ValueError(f"negative value {n} for an unsigned field")
+    while n > 0x7F:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+def put_svarint(out, n):
+    put_uvarint(out, n << 1 if n >= 0 else ((-n) << 1) - 1)
+
+def put_str(out, s):
+    b = s.encode("utf-8")
+    put_uvarint(out, len(b))
+    out += b
+
+def put_mac(out, mac):
+    out += bytes.fromhex(mac.replace(":", "").replace("-", ""))
+
+def centi(v):
+    return max(0, round(v * 100))
+
+# ─── Encoder ──────────────────────────────────────────────────────────────────
+
+class ReportEncoder:
+    """Encodes legacy-shaped report dicts as compact deltas.
+
+    Keeps the state of the last report the master acknowledged; `ack()`
+    promotes the most recently encoded report to that state and `reset()`
+    drops it so the next report is sent in full.
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self.reset()
+
+    def reset(self):
+        self._acked_seq    = 0
+        self._acked_total  = (0, 0)
+        self._acked_procs  = {}     # name -> (total up, total down)
+        self._acked_names  = {}     # name -> id known by the master
+        self._name_ids     = {}     # name -> id, including unacknowledged ones
+        self._pending      = None
+
+    def encode(self, payload):
+        self.seq += 1
+        base  = self._acked_seq
+        flags = FLAG_IDENTITY if base == 0 else 0
+        body  = bytearray()
+
+        put_uvarint(body, self.seq)
+        put_uvarint(body, base)
+        put_uvarint(body, int(payload["timestamp"]))
+        put_mac(body, payload["mac"])
+        if flags & FLAG_IDENTITY:
+            for key in ("name", "username", "ip", "os", "state"):
+                put_str(body, payload.get(key) or "")
+
+        usage = payload["usage"]
+        put_uvarint(body, centi(usage["upload"]))
+        put_uvarint(body, centi(usage["download"]))
+        total = (int(payload["total_usage"]["upload"]), int(payload["total_usage"]["download"]))
+        put_svarint(body, total[0] - self._acked_total[0])
+        put_svarint(body, total[1] - self._acked_total[1])
+
+        procs = {}
+        put_uvarint(body, len(payload["process"]))
+        for proc in payload["process"]:
+            name = proc["name"]
+            nid  = self._name_ids.setdefault(name, len(self._name_ids))
+            if name in self._acked_names:
+                put_uvarint(body, nid << 1)
+            else:
+                put_uvarint(body, (nid << 1) | 1)
+                put_str(body, name)
+            put_uvarint(body, centi(proc["speed"]["upload"]))
+            put_uvarint(body, centi(proc["speed"]["download"]))
+            tot  = (int(proc["total"]["upload"]), int(proc["total"]["download"]))
+            prev = self._acked_procs.get(name, (0, 0))
+            put_svarint(body, tot[0] - prev[0])
+            put_svarint(body, tot[1] - prev[1])
+            procs[name] = tot
+
+        put_uvarint(body, len(payload["dns"]))
+        for domain in payload["dns"]:
+            put_str(body, domain)
+
+        domains  = payload.get("domains") or []
+        flows    = payload.get("flows")   or []
+        sampling = payload.get("sampling")
+        health   = payload.get("agent_health")
+        series   = payload.get("series")
+        dests    = payload.get("destinations")
+        last     = max((i for i, section in enumerate((domains, flows, sampling, health, series,
+                                                       dests))
+                        if section), default=-1)
+        if last >= 0:
+            put_uvarint(body, len(domains))
+            for entry in domains:
+                put_str(body, entry["name"])
+                put_uvarint(body, centi(entry["speed"]["upload"]))
+                put_uvarint(body, centi(entry["speed"]["download"]))
+                put_uvarint(body, int(entry["total"]["upload"]))
+                put_uvarint(body, int(entry["total"]["download"]))
+        if last >= 1:
+            put_uvarint(body, len(flows))
+            for flow in flows:
+                put_str(body, flow["proto"])
+                put_uvarint(body, flow["local_port"])
+                body += ipaddress.IPv4Address(flow["remote_ip"]).packed
+                put_uvarint(body, flow["remote_port"])
+                put_str(body, flow["process"])
+                put_uvarint(body, centi(flow["speed"]["upload"]))
+                put_uvarint(body, centi(flow["speed"]["download"]))
+                put_uvarint(body, int(flow["total"]["upload"]))
+                put_uvarint(body, int(flow["total"]["download"]))
+        if last >= 2:
+            sampling = sampling or {"rate": 1, "error": 0.0}
+            put_uvarint(body, sampling["rate"])
+            put_uvarint(body, round(sampling["error"] * 10000))
+            for entry in payload["process"]:
+                put_uvarint(body, centi(entry.get("error", 0)))
+            for entry in domains:
+                put_uvarint(body, centi(entry.get("error", 0)))
+        if last >= 3:
+            put_str(body, health["capture"])
+            for key in ("packets", "attributed", "unattributed"):
+                put_uvarint(body, health[key])
+            put_uvarint(body, 0 if health["drops"] is None else health["drops"] + 1)
+            put_uvarint(body, centi(health["cpu_percent"]))
+            put_uvarint(body, health["rss_bytes"])
+            put_uvarint(body, health["worker_restarts"])
+            for key in HEALTH_LATENCIES:
+                summary = health[key]
+                put_uvarint(body, summary["count"])
+                for q in HEALTH_QUANTILES[1:]:
+                    put_uvarint(body, round(summary[q] * 10))
+        if last >= 4:
+            put_uvarint(body, round(series["step"] * 1000))
+            put_uvarint(body, len(series["upload"]))
+            for up, down in zip(series["upload"], series["download"]):
+                put_uvarint(body, up)
+                put_uvarint(body, down)
+        if last >= 5:
+            for key in ("capacity", "total", "floor"):
+                put_uvarint(body, dests[key])
+            put_uvarint(body, len(dests["top"]))
+            for entry in dests["top"]:
+                body += ipaddress.IPv4Address(entry["ip"]).packed
+                put_uvarint(body, entry["upload"])
+                put_uvarint(body, entry["download"])
+                put_uvarint(body, entry["error"])
+
+        if len(body) >= ZLIB_MIN:
+            packed = zlib.compress(bytes(body), 6)
+            if len(packed) < len(body):
+                body   = packed
+                flags |= FLAG_ZLIB
+
+        self._pending = (self.seq, total, procs)
+        return _header.pack(MAGIC, VERSION, flags) + bytes(body)
+
+    def ack(self, seq):
+        """Record that the master applied report `seq`."""
+        if self._pending is None or self._pending[0] != seq:
+            return
+        self._acked_seq, self._acked_total, self._acked_procs = self._pending
+        for name in self._acked_procs:
+            self._acked_names[name] = self._name_ids[name]
+        self._pending = None
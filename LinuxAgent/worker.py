@@ -0,0 +1,344 @@
+"""Capture worker process for the Linux agent.
+
+With `CAPTURE_PROCESS` enabled, packet capture and parsing run in a separate
+process so `/proc` scans and report encoding in the agent no longer hold the
+GIL while frames queue up in the kernel. The worker writes cumulative
+counters into one `multiprocessing.shared_memory` block:
+
+    header      kernel packets, drops, freeze_q, worker pid,   (int64)
+                sampling rate, packets seen
+    ports       up/down bytes and packets per (TCP|UDP, port)  (int64)
+    domains     up/down bytes per domain slot                  (int64)
+    variance    sampling variance per port, per domain         (float64)
+    callback    `health.Histogram` of packet handling time
+    flows       a `flows.FlowTable`
+
+Port and domain counters only grow and are read lock-free; the flow table
+guards slot reuse with its own sequence counter. DNS names and new domain
+slots are low-rate and travel over a queue. Process attribution stays in
+the agent: it diffs the port counters on every port-cache refresh and
+charges the delta to whoever owns the port at that moment.
+"""
+import ctypes
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+from multiprocessing import shared_memory
+
+import capture
+import dnsmap
+import flows
+import health
+import sampling
+
+PORTS         = 2 * 65536           # TCP ports, then UDP ports
+DOMAIN_SLOTS  = 4096
+FLOW_CAPACITY = 16384
+RESTART_MIN   = 1.0                 # seconds before restarting a crashed worker
+RESTART_MAX   = 60.0
+STATS_EVERY   = 0.5                 # worker clock / kernel stats update period
+_CHUNK        = 4096                # bytes compared at once when diffing ports
+
+_HEADER  = 8
+_H_PACKETS, _H_DROPS, _H_FREEZE, _H_PID, _H_RATE, _H_SEEN = range(6)
+PR_SET_PDEATHSIG = 1
+
+
+class SharedCounters:
+    """Views onto the shared block; `name=None` creates a new one."""
+
+    def __init__(self, name=None, flow_capacity=FLOW_CAPACITY):
+        words = _HEADER + 4 * PORTS + 3 * DOMAIN_SLOTS
+        size  = words * 8 + health.Histogram.nbytes() + flows.FlowTable.nbytes(flow_capacity)
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name  = self.shm.name
+        buf        = self.shm.buf
+        off        = 0
+        def column(n, fmt="q"):
+            nonlocal off
+            view = buf[off:off + n * 8].cast(fmt)
+            off += n * 8
+            return view
+        self.header      = column(_HEADER)
+        self.port_up     = column(PORTS)
+        self.port_down   = column(PORTS)
+        self.port_pkts   = column(PORTS)
+        self.domain_up   = column(DOMAIN_SLOTS)
+        self.domain_down = column(DOMAIN_SLOTS)
+        self.port_var    = column(PORTS, "d")
+        self.domain_var  = column(DOMAIN_SLOTS, "d")
+        self.callback    = health.Histogram(buf[off:off + health.Histogram.nbytes()])
+        off += health.Histogram.nbytes()
+        self.flows       = flows.FlowTable(flow_capacity, buf=buf[off:])
+
+    def close(self, unlink=False):
+        self.flows.release()
+        self.callback.release()
+        for view in (self.header, self.port_up, self.port_down, self.port_pkts, self.domain_up,
+                     self.domain_down, self.port_var, self.domain_var):
+            view.release()
+        if unlink:
+            self.shm.unlink()
+        self.shm.close()
+
+# ─── Worker process ───────────────────────────────────────────────────────────
+
+def _worker_main(shm_name, iface, local_ip, mode, domain_names, events):
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        pass
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # the agent handles Ctrl-C
+
+    shared      = SharedCounters(shm_name)
+    header      = shared.header
+    port_up     = shared.port_up
+    port_down   = shared.port_down
+    port_pkts   = shared.port_pkts
+    domain_up   = shared.domain_up
+    domain_down = shared.domain_down
+    port_var    = shared.port_var
+    domain_var  = shared.domain_var
+    flow_table  = shared.flows
+    callback    = shared.callback
+    domain_map  = dnsmap.DomainMap()
+    domain_ids  = {name: slot for slot, name in enumerate(domain_names)}
+    flow_key    = flows.flow_key
+    rate        = [1]               # sampling rate the kernel filter applies
+    header[_H_PID] = os.getpid()
+
+    def on_dns(qname, answers=None):
+        header[_H_SEEN] += 1
+        events.put(("dns", qname))
+        if answers:
+            for ip, ttl in answers:
+                domain_map.learn(ip, qname, ttl)
+
+    def on_packet(proto, is_upload, local_port, remote_ip, remote_port, length):
+        seen = header[_H_SEEN] = header[_H_SEEN] + 1
+        start = time.perf_counter_ns() if not seen % health.TIME_EVERY else 0
+        var = 0.0
+        if rate[0] > 1:
+            length, var = sampling.scale(rate[0], length)
+        slot = (proto == capture.IPPROTO_UDP) << 16 | local_port
+        if is_upload:
+            port_up[slot] += length
+        else:
+            port_down[slot] += length
+        port_pkts[slot] += 1
+        if var:
+            port_var[slot] += var
+
+        domain = domain_map.get(remote_ip)
+        if domain is not None:
+            d = domain_ids.get(domain)
+            if d is None and len(domain_ids) < DOMAIN_SLOTS:
+                d = domain_ids[domain] = len(domain_ids)
+                events.put(("domain", d, domain))
+            if d is not None:
+                if is_upload:
+                    domain_up[d] += length
+                else:
+                    domain_down[d] += length
+                if var:
+                    domain_var[d] += var
+
+        flow_table.add(flow_key(proto, local_port, remote_ip, remote_port), -1, is_upload, length)
+        if start:
+            callback.record(time.perf_counter_ns() - start)
+
+    ring = None
+    if mode in ("auto", "mmap"):
+        try:
+            ring = capture.Ring(iface)
+        except OSError:
+            if mode == "mmap":
+                raise
+    sock  = ring.sock if ring is not None else capture.open_socket(iface)
+    stats = ring if ring is not None else capture.SocketStats(sock)
+
+    def apply_rate(new):
+        rate[0] = new
+
+    switch = capture.FilterSwitch(apply_rate)
+
+    def publish_stats():
+        while True:
+            flow_table.now = time.monotonic()
+            want = header[_H_RATE] or 1
+            if not switch.request(want):
+                header[_H_RATE] = rate[0]
+            counts = stats.stats()
+            header[_H_PACKETS] = counts["packets"]
+            header[_H_DROPS]   = counts["drops"]
+            header[_H_FREEZE]  = counts["freeze_q"]
+            time.sleep(STATS_EVERY)
+
+    threading.Thread(target=publish_stats, daemon=True).start()
+    if ring is not None:
+        ring.run(local_ip, on_dns, on_packet, switch)
+    else:
+        capture.run(sock, local_ip, on_dns, on_packet, switch)
+
+# ─── Agent side ───────────────────────────────────────────────────────────────
+
+class CaptureWorker:
+    """Owns the shared block and the worker process, restarting it on crash.
+
+    `supervise()`, `events()` and the `*_deltas()` generators must all be
+    called from one agent thread: together they restart a dead worker (with
+    exponential backoff), drain queued DNS events and yield the counter
+    deltas since the previous call.
+    """
+
+    def __init__(self, iface, local_ip, mode="auto"):
+        self.iface      = iface
+        self.local_ip   = local_ip
+        self.mode       = mode if mode in ("mmap", "raw") else "auto"
+        self.restarts   = 0
+        self.shared     = SharedCounters()
+        self.flows      = self.shared.flows
+        self.callback   = self.shared.callback
+        self.domains    = []                        # slot -> name
+        self._ctx       = mp.get_context("spawn")
+        self._events    = None
+        self._dns       = []                        # names drained from a dead worker's queue
+        self._proc      = None
+        self._delay     = RESTART_MIN
+        self._retry_at  = 0.0
+        self._port_up   = bytes(self.shared.port_up.nbytes)
+        self._port_down = bytes(self.shared.port_down.nbytes)
+        self._port_seen = {}                        # port slot -> (variance, packets) already charged
+        self._dom_seen  = [(0, 0, 0.0)] * DOMAIN_SLOTS
+
+    def start(self):
+        # A worker killed mid-put can leave its queue locked, so every
+        # worker gets a fresh one.
+        if self._events is not None:
+            self._dns += self.events()
+            self._events.close()
+        self._events = self._ctx.Queue()
+        self._proc = self._ctx.Process(
+            target=_worker_main,
+            args=(self.shared.name, self.iface, self.local_ip, self.mode,
+                  list(self.domains), self._events),
+            name="capture-worker",
+            daemon=True,
+        )
+        self._proc.start()
+        self._started = time.monotonic()
+
+    @property
+    def pid(self):
+        return self._proc.pid if self.alive() else None
+
+    def alive(self):
+        return self._proc is not None and self._proc.is_alive()
+
+    def supervise(self):
+        """Restart the worker if it exited; returns the exit code it had, if any."""
+        if self._proc is None or self._proc.is_alive():
+            return None
+        now  = time.monotonic()
+        code = self._proc.exitcode
+        if self._retry_at == 0.0:
+            # A worker that ran for a while gets a fresh backoff.
+            if now - self._started > RESTART_MAX:
+                self._delay = RESTART_MIN
+            self._retry_at = now + self._delay
+            self._delay    = min(RESTART_MAX, self._delay * 2)
+            return code
+        if now >= self._retry_at:
+            self._retry_at = 0.0
+            self.restarts += 1
+            self.start()
+        return None
+
+    def stop(self, timeout=2.0):
+        if self._proc is not None and self._proc.is_alive():
+            self._proc.terminate()
+            self._proc.join(timeout)
+            if self._proc.is_alive():
+                self._proc.kill()
+                self._proc.join()
+        self._proc = None
+        if self._events is not None:
+            self._events.close()
+        self.shared.close(unlink=True)
+
+    def set_rate(self, rate):
+        """Ask the worker to sample 1 in `rate` packets from its next stats tick."""
+        self.shared.header[_H_RATE] = rate
+
+    def packets(self):
+        """Packets the worker has handled since the agent started."""
+        return self.shared.header[_H_SEEN]
+
+    def stats(self):
+        """Kernel counters of the worker's capture socket."""
+        header = self.shared.header
+        return {"packets": header[_H_PACKETS], "drops": header[_H_DROPS],
+                "freeze_q": header[_H_FREEZE]}
+
+    def events(self):
+        """Drain queued DNS names; domain slot names are recorded internally."""
+        names, self._dns = self._dns, []
+        while True:
+            try:
+                event = self._events.get_nowait()
+            except (queue.Empty, OSError, ValueError):
+                return names
+            if event[0] == "dns":
+                names.append(event[1])
+            else:
+                _, slot, name = event
+                while len(self.domains) <= slot:
+                    self.domains.append(None)
+                self.domains[slot] = name
+
+    def port_deltas(self):
+        """Yield (proto, port, up, down, variance, packets) for every port that moved."""
+        var      = self.shared.port_var
+        pkts     = self.shared.port_pkts
+        up, down = bytes(self.shared.port_up), bytes(self.shared.port_down)
+        old_up, old_down = self._port_up, self._port_down
+        self._port_up, self._port_down = up, down
+        for off in range(0, len(up), _CHUNK):
+            end = off + _CHUNK
+            if up[off:end] == old_up[off:end] and down[off:end] == old_down[off:end]:
+                continue
+            nu, nd = memoryview(up)[off:end].cast("q"), memoryview(down)[off:end].cast("q")
+            ou, od = memoryview(old_up)[off:end].cast("q"), memoryview(old_down)[off:end].cast("q")
+            base = off // 8
+            for i in range(len(nu)):
+                du, dd = nu[i] - ou[i], nd[i] - od[i]
+                if du or dd:
+                    slot  = base + i
+                    proto = capture.IPPROTO_UDP if slot >> 16 else capture.IPPROTO_TCP
+                    v, p  = var[slot], pkts[slot]
+                    old   = self._port_seen.get(slot, (0.0, 0))
+                    self._port_seen[slot] = (v, p)
+                    yield proto, slot & 0xFFFF, du, dd, v - old[0], p - old[1]
+
+    def domain_deltas(self):
+        """Yield (name, up, down, variance) for every named domain that moved.
+
+        Bytes for a slot whose name has not arrived yet are held back until
+        it does.
+        """
+        up, down = self.shared.domain_up.tolist(), self.shared.domain_down.tolist()
+        var  = self.shared.domain_var.tolist()
+        seen = self._dom_seen
+        for slot, name in enumerate(self.domains):
+            if name is None:
+                continue
+            du, dd = up[slot] - seen[slot][0], down[slot] - seen[slot][1]
+            if du or dd:
+                yield name, du, dd, var[slot] - seen[slot][2]
+                seen[slot] = (up[slot], down[slot], var[slot])
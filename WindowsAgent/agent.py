@@ -6,22 +6,45 @@ import socket
 import platform
 import psutil
 import getpass
-from collections import defaultdict
-from scapy.all import sniff, DNS, DNSQR, IP, TCP, UDP
+import argparse
+import os
+import sys
+from collections import defaultdict, deque
+
+# checkpoint.py and sketch.py are shared with the Linux agent
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "common"))
+import checkpoint
+import sketch
 
 # ─── Config ───────────────────────────────────────────────────────────────────
-SEND_INTERVAL  = 5
-TOP_N_PROCS    = 10
+SEND_INTERVAL  = 5          # seconds; the master may change it, see apply_directives()
+TOP_N_PROCS    = 10         # likewise
+INCLUDE_DNS    = True       # likewise; when False, DNS names wait for a later report
+INTERVAL_RANGE = (1, 300)   # bounds on a master-chosen SEND_INTERVAL
+TOP_N_MAX      = 100
 CACHE_REFRESH  = 0.5
+RATE_STEP      = 1.0        # seconds between interface counter samples (report series)
+TOP_N_DESTINATIONS = 10
+DEST_CAPACITY  = 256        # remote IPs tracked by the heavy-hitter sketch
+CONFIG_FILE    = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.json")
+STATE_FILE     = os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent.state")
 
 # ─── Shared state ─────────────────────────────────────────────────────────────
 lock                = threading.Lock()
 interval_dns        = set()
 interval_proc_bytes = defaultdict(lambda: {"upload": 0, "download": 0})
+remote_bytes        = defaultdict(lambda: [0, 0])  # remote IP -> [up, down], sniffer thread only
+remote_handoff      = deque()                       # finished remote_bytes dicts for the reporter
+remote_wanted       = threading.Event()             # set by the reporter once per interval
 proc_total_bytes    = defaultdict(lambda: {"upload": 0, "download": 0})
 port_pid_cache      = {}
 _local_ip           = None
 io_baseline         = None
+io_samples          = deque(maxlen=512)   # (tick, monotonic time, bytes_sent, bytes_recv)
+io_ready            = threading.Condition()
+sniff = DNS = DNSQR = IP = TCP = UDP = None       # Scapy, see _load_scapy()
+_state              = None                        # checkpoint.Checkpoint of lifetime totals
+_remotes            = None                        # sketch.SpaceSaving, reporter thread only
 
 # ─── Utilities ────────────────────────────────────────────────────────────────
 
@@ -74,6 +97,7 @@ def port_cache_refresher():
 # ─── Thread 2: Scapy sniffer ──────────────────────────────────────────────────
 
 def packet_callback(pkt):
+    global remote_bytes
     if pkt.haslayer(DNS) and pkt.haslayer(DNSQR):
         qname = pkt[DNSQR].qname.decode(errors="ignore").rstrip(".")
         if qname:
@@ -102,6 +126,15 @@ def packet_callback(pkt):
     if local_port is None:
         return
 
+    # Only this thread writes remote_bytes; once per interval it hands the
+    # dict to the reporter through a deque (append/popleft are atomic), so
+    # the packet path takes no lock for it.
+    remote_bytes[dst if is_upload else src][0 if is_upload else 1] += length
+    if remote_wanted.is_set():
+        remote_wanted.clear()
+        remote_handoff.append(remote_bytes)
+        remote_bytes = defaultdict(lambda: [0, 0])
+
     pid = port_pid_cache.get(local_port)
     if pid is None:
         return
@@ -112,12 +145,39 @@ def packet_callback(pkt):
         interval_proc_bytes[name][key] += length
         proc_total_bytes[name][key]    += length
 
+def _load_scapy():
+    """Import only the sniffer and the layers the callback needs; `scapy.all`
+    loads every Scapy layer and costs seconds and tens of MB at startup."""
+    global sniff, DNS, DNSQR, IP, TCP, UDP
+    if sniff is None:
+        from scapy.layers.dns import DNS, DNSQR
+        from scapy.layers.inet import IP, TCP, UDP
+        from scapy.sendrecv import sniff
+
 def start_sniffer():
+    _load_scapy()
     print("[scapy] Starting packet capture — requires admin...")
     sniff(prn=packet_callback, store=False, filter="ip")
 
 # ─── Send to master ───────────────────────────────────────────────────────────
 
+def apply_directives(directives):
+    """Adopt the master's interval, process top-N and DNS choice for later reports."""
+    global SEND_INTERVAL, TOP_N_PROCS, INCLUDE_DNS
+    if not isinstance(directives, dict):
+        return
+    try:
+        lo, hi   = INTERVAL_RANGE
+        interval = min(hi, max(lo, float(directives.get("interval", SEND_INTERVAL))))
+        top_n    = min(TOP_N_MAX, max(1, int(directives.get("top_n", TOP_N_PROCS))))
+    except (TypeError, ValueError):
+        return
+    if interval != SEND_INTERVAL:
+        print(f"[{time.strftime('%X')}] Master set report interval to {interval:g} s")
+    SEND_INTERVAL = interval
+    TOP_N_PROCS   = top_n
+    INCLUDE_DNS   = bool(directives.get("dns", True))
+
 def _send(master_ip, master_port, payload):
     url = f"http://{master_ip}:{master_port}/usage"
     try:
@@ -127,6 +187,7 @@ def _send(master_ip, master_port, payload):
         with urllib.request.urlopen(req, data=data, timeout=5) as resp:
             response   = json.loads(resp.read().decode("utf-8"))
             collecting = response.get("collecting", True)
+            apply_directives(response.get("directives"))
             print(f"[{time.strftime('%X')}] "
                   f"↑{payload['usage']['upload']:.0f} B/s  "
                   f"↓{payload['usage']['download']:.0f} B/s  "
@@ -138,34 +199,103 @@ def _send(master_ip, master_port, payload):
         print(f"[{time.strftime('%X')}] Send failed: {e}")
         return None
 
+# ─── Interface sampler ────────────────────────────────────────────────────────
+
+def io_sampler():
+    """Sample interface counters every RATE_STEP s on a drift-free monotonic
+    schedule; late wakeups skip ticks instead of shifting later ones."""
+    origin = time.monotonic()
+    tick   = 0
+    while True:
+        io = psutil.net_io_counters()
+        with io_ready:
+            io_samples.append((tick, time.monotonic(), io.bytes_sent, io.bytes_recv))
+            io_ready.notify_all()
+        tick += 1
+        delay = origin + tick * RATE_STEP - time.monotonic()
+        if delay < 0:
+            missed = int(-delay // RATE_STEP) + 1
+            tick  += missed
+            delay += missed * RATE_STEP
+        time.sleep(delay)
+
+def wait_sample(tick):
+    """Newest sample once tick `tick` (or a later one) has been taken."""
+    with io_ready:
+        io_ready.wait_for(lambda: io_samples and io_samples[-1][0] >= tick)
+        return io_samples[-1]
+
+def rate_series(first, last):
+    """Per-step (upload, download) bytes/s between two samples."""
+    with io_ready:
+        window = [s for s in io_samples if first[0] <= s[0] <= last[0]]
+    up, down = [], []
+    for a, b in zip(window, window[1:]):
+        dt = (b[1] - a[1]) or RATE_STEP
+        up.append(max(0, round((b[2] - a[2]) / dt)))
+        down.append(max(0, round((b[3] - a[3]) / dt)))
+    return up, down
+
 # ─── Reporter ─────────────────────────────────────────────────────────────────
 
+def destination_summary(n):
+    """Fold the handed-off remote bytes into the sketch; report its top `n` remote IPs.
+
+    The sniffer hands over an interval's bytes at its next packet after
+    remote_wanted is set, so a late handoff lands in the following report.
+    """
+    while remote_handoff:
+        for ip, (up, down) in remote_handoff.popleft().items():
+            _remotes.add(ip, up, down)
+    top, total, floor = _remotes.top(n)
+    return {
+        "capacity": _remotes.capacity,
+        "total":    total,
+        "floor":    floor,
+        "top": [
+            {"ip": ip, "bytes": up + down + error,
+             "upload": up, "download": down, "error": error}
+            for ip, up, down, error in top
+        ],
+    }
+
 def reporter(master_ip, master_port, hostname, local_ip, mac, username):
     global interval_proc_bytes, interval_dns, proc_total_bytes, io_baseline
     was_collecting = True
 
-    while True:
-        with lock:
-            interval_proc_bytes.clear()
-            interval_dns.clear()
+    # Intervals run tick to tick on the sampler's schedule, so building and
+    # sending a report neither delays the next one nor loses its bytes.
+    last = wait_sample(0)
+    with lock:
+        interval_proc_bytes.clear()
 
-        io_before = psutil.net_io_counters()
-        time.sleep(SEND_INTERVAL)
-        io_after  = psutil.net_io_counters()
+    while True:
+        sample  = wait_sample(last[0] + max(1, round(SEND_INTERVAL / RATE_STEP)))
+        elapsed = (sample[1] - last[1]) or SEND_INTERVAL
 
-        system_upload   = io_after.bytes_sent - io_before.bytes_sent
-        system_download = io_after.bytes_recv - io_before.bytes_recv
-        upload_bps      = round(system_upload   / SEND_INTERVAL, 2)
-        download_bps    = round(system_download / SEND_INTERVAL, 2)
+        system_upload   = sample[2] - last[2]
+        system_download = sample[3] - last[3]
+        upload_bps      = round(system_upload   / elapsed, 2)
+        download_bps    = round(system_download / elapsed, 2)
+        series_up, series_down = rate_series(last, sample)
+        last            = sample
 
-        io_now     = psutil.net_io_counters()
-        total_up   = max(0, io_now.bytes_sent - io_baseline.bytes_sent)
-        total_down = max(0, io_now.bytes_recv - io_baseline.bytes_recv)
+        # Lifetime totals continue from the last checkpoint of a previous run.
+        total_up   = _state.total[0] + max(0, sample[2] - io_baseline.bytes_sent)
+        total_down = _state.total[1] + max(0, sample[3] - io_baseline.bytes_recv)
 
         with lock:
             proc_interval_snap = {k: dict(v) for k, v in interval_proc_bytes.items()}
             proc_total_snap    = {k: dict(v) for k, v in proc_total_bytes.items()}
-            dns_snapshot       = list(interval_dns)
+            interval_proc_bytes.clear()
+            dns_snapshot       = []
+            if INCLUDE_DNS:
+                # Otherwise names stay queued until a report includes them.
+                dns_snapshot = list(interval_dns)
+                interval_dns.clear()
+
+        remote_wanted.set()
+        destinations = destination_summary(TOP_N_DESTINATIONS)
 
         raw_total_up   = sum(v["upload"]   for v in proc_interval_snap.values()) or 1
         raw_total_down = sum(v["download"] for v in proc_interval_snap.values()) or 1
@@ -189,8 +319,8 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
             process_list.append({
                 "name":  name,
                 "speed": {
-                    "upload":   round(iv["upload"]   * scale_up   / SEND_INTERVAL, 2),
-                    "download": round(iv["download"] * scale_down / SEND_INTERVAL, 2),
+                    "upload":   round(iv["upload"]   * scale_up   / elapsed, 2),
+                    "download": round(iv["download"] * scale_down / elapsed, 2),
                 },
                 "total": {
                     "upload":   round(tot["upload"]   * scale_up),
@@ -210,8 +340,12 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
             "total_usage": {"upload": total_up,    "download": total_down},
             "process":     process_list,
             "dns":         dns_snapshot,
+            "series":      {"step": RATE_STEP, "upload": series_up, "download": series_down},
+            "destinations": destinations,
         }
 
+        _state.save((total_up, total_down),
+                    procs={k: (v["upload"], v["download"]) for k, v in proc_total_snap.items()})
         collecting = _send(master_ip, master_port, payload)
 
         if collecting is None:
@@ -224,7 +358,10 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
                     proc_total_bytes.clear()
                     interval_proc_bytes.clear()
                     interval_dns.clear()
+                remote_handoff.clear()
+                _remotes.clear()
                 io_baseline    = psutil.net_io_counters()
+                _state.reset()
                 was_collecting = False
         else:
             if not was_collecting:
@@ -234,12 +371,38 @@ def reporter(master_ip, master_port, hostname, local_ip, mac, username):
 
 # ─── Entry point ──────────────────────────────────────────────────────────────
 
+def master_address(argv=None):
+    """Master IP and port: flags, then MASTER_IP/MASTER_PORT, then the config
+    file; prompts only when none of them names a master and stdin is a tty."""
+    ap = argparse.ArgumentParser(description="Network usage agent (Windows)")
+    ap.add_argument("--master", help="master IP (or env MASTER_IP)")
+    ap.add_argument("--port",   help="master port (or env MASTER_PORT; default 5000)")
+    ap.add_argument("--config", help=f'JSON file with "master" and "port" (default {CONFIG_FILE} if present)')
+    args = ap.parse_args(argv)
+
+    config = {}
+    path   = args.config or (CONFIG_FILE if os.path.exists(CONFIG_FILE) else None)
+    if path:
+        try:
+            with open(path) as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            ap.error(f"cannot read config {path}: {e}")
+
+    master_ip   = args.master or os.environ.get("MASTER_IP")   or config.get("master")
+    master_port = args.port   or os.environ.get("MASTER_PORT") or config.get("port")
+    if not master_ip:
+        if not sys.stdin or not sys.stdin.isatty():
+            ap.error("no master given (use --master, MASTER_IP or a config file)")
+        master_ip   = input("Master IP   : ").strip()
+        master_port = master_port or input("Master port [5000]: ").strip()
+    return master_ip, str(master_port or 5000)
+
 def main():
-    global _local_ip, io_baseline
+    global _local_ip, io_baseline, _state, _remotes
 
     print("=== Network Usage Agent ===")
-    master_ip   = input("Master IP   : ").strip()
-    master_port = input("Master port [5000]: ").strip() or "5000"
+    master_ip, master_port = master_address()
 
     hostname  = socket.gethostname()
     _local_ip = get_local_ip()
@@ -255,9 +418,17 @@ def main():
     print(f"\n  Starting...\n")
 
     io_baseline = psutil.net_io_counters()
+    _remotes    = sketch.SpaceSaving(DEST_CAPACITY)
+    _state      = checkpoint.Checkpoint(STATE_FILE, tables=("procs",))
+    if _state.restored:
+        print(f"[state] Restored lifetime totals (epoch {_state.epoch}): "
+              f"↑{_state.total[0]} B  ↓{_state.total[1]} B  procs={len(_state.saved['procs'])}")
+        for name, (p_up, p_down) in _state.saved["procs"].items():
+            proc_total_bytes[name] = {"upload": p_up, "download": p_down}
 
     threading.Thread(target=port_cache_refresher, daemon=True).start()
     threading.Thread(target=start_sniffer,        daemon=True).start()
+    threading.Thread(target=io_sampler,           daemon=True).start()
 
     reporter(master_ip, master_port, hostname, _local_ip, mac, username)
 
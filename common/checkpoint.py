@@ -0,0 +1,130 @@
+"""Crash-safe lifetime counters, shared by the Linux and Windows agents.
+
+Totals (interface bytes, bytes per process and per domain) are kept in a
+fixed-layout file mapped into memory, so a restarted agent carries on from
+them instead of reporting from zero. The file holds two copies of the
+state. Each save rewrites the copy that does not hold the newest
+generation and msyncs just that copy's pages; a crash or power loss in
+the middle leaves the other copy intact. On load, the copy with a valid
+CRC32 and the highest generation wins. Every agent start bumps the epoch.
+
+Copy layout (little-endian), padded to a whole number of mmap allocation
+units (a page on Linux, 64 KiB on Windows, where flush offsets must be
+aligned to it):
+
+    magic:4s version:u16 slots:u16 crc:u32 epoch:u64 generation:u64
+    saved_at:f64 total_up:u64 total_down:u64 n × count:u32
+    n × slots × (name:64s up:u64 down:u64)
+
+Tables that have more names than `slots` keep the largest totals; names
+longer than NAME_MAX bytes are not saved.
+"""
+import mmap
+import os
+import struct
+import time
+import zlib
+
+MAGIC    = b"NMCP"
+VERSION  = 1
+SLOTS    = 512
+NAME_MAX = 64
+
+_head  = struct.Struct("<4sHHIQQdQQ")
+_count = struct.Struct("<I")
+_entry = struct.Struct(f"<{NAME_MAX}sQQ")
+_CRC   = 8                  # offset of the crc field
+
+
+class Checkpoint:
+    """Lifetime totals persisted in `path`, one dict per name in `tables`."""
+
+    def __init__(self, path, tables=("procs", "domains"), slots=SLOTS):
+        self.tables = tables
+        self.slots  = slots
+        used        = _head.size + len(tables) * (_count.size + slots * _entry.size)
+        gran        = mmap.ALLOCATIONGRANULARITY
+        self.size   = -(-used // gran) * gran
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        try:
+            if os.fstat(fd).st_size != 2 * self.size:
+                os.ftruncate(fd, 2 * self.size)
+            self.map = mmap.mmap(fd, 2 * self.size)
+        finally:
+            os.close(fd)
+
+        best = max((self._load(i) for i in (0, 1)), key=lambda s: s["generation"])
+        self.epoch      = best["epoch"] + 1
+        self.generation = best["generation"]
+        self.restored   = best["generation"] > 0
+        self.total      = best["total"]
+        self.saved      = best["tables"]
+
+    def _load(self, copy):
+        empty = {"epoch": 0, "generation": 0, "total": (0, 0),
+                 "tables": {name: {} for name in self.tables}}
+        base = copy * self.size
+        buf  = bytearray(self.map[base:base + self.size])
+        magic, version, slots, crc, epoch, generation, _at, up, down = _head.unpack_from(buf)
+        if magic != MAGIC or version != VERSION or slots != self.slots:
+            return empty
+        _count.pack_into(buf, _CRC, 0)
+        if zlib.crc32(buf) != crc:
+            return empty            # torn or never written
+
+        tables = {}
+        off = _head.size
+        for name in self.tables:
+            n, = _count.unpack_from(buf, off)
+            off += _count.size
+            table = {}
+            for i in range(min(n, slots)):
+                key, t_up, t_down = _entry.unpack_from(buf, off + i * _entry.size)
+                table[key.rstrip(b"\0").decode("utf-8", "replace")] = (t_up, t_down)
+            tables[name] = table
+            off += slots * _entry.size
+        return {"epoch": epoch, "generation": generation, "total": (up, down), "tables": tables}
+
+    def save(self, total, **tables):
+        """Write `total` (up, down) and each table {name: (up, down)}, then sync."""
+        self.generation += 1
+        buf = bytearray(self.size)
+        _head.pack_into(buf, 0, MAGIC, VERSION, self.slots, 0, self.epoch, self.generation,
+                        time.time(), int(total[0]), int(total[1]))
+        off = _head.size
+        for name in self.tables:
+            rows = {k: v for k, v in (tables.get(name) or {}).items()
+                    if len(k.encode("utf-8")) <= NAME_MAX}
+            if len(rows) > self.slots:
+                keep = sorted(rows, key=lambda k: rows[k][0] + rows[k][1], reverse=True)
+                rows = {k: rows[k] for k in keep[:self.slots]}
+            _count.pack_into(buf, off, len(rows))
+            off += _count.size
+            for i, (key, (t_up, t_down)) in enumerate(rows.items()):
+                _entry.pack_into(buf, off + i * _entry.size,
+                                 key.encode("utf-8"), int(t_up), int(t_down))
+            off += self.slots * _entry.size
+        _count.pack_into(buf, _CRC, zlib.crc32(buf))
+
+        base = (self.generation % 2) * self.size
+        self.map[base:base + self.size] = buf
+        self.map.flush(base, self.size)
+
+    def reset(self):
+        """Forget the restored totals (the master asked for a fresh start)."""
+        self.total = (0, 0)
+        self.saved = {name: {} for name in self.tables}
+
+    def close(self):
+        self.map.close()
+
+
+def merged(snap, saved):
+    """Counter delta dict {name: {"upload", "download"}} plus restored totals."""
+    out = {name: dict(v) for name, v in snap.items()}
+    for name, (up, down) in saved.items():
+        entry = out.setdefault(name, {"upload": 0, "download": 0})
+        entry["upload"]   += up
+        entry["download"] += down
+    return out
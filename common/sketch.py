@@ -0,0 +1,79 @@
+"""Heavy-hitter sketch of remote endpoints, shared by the Linux and Windows agents.
+
+A Space-Saving summary keeps bytes for at most `capacity` remote IPs, so
+memory stays fixed however many addresses the host talks to. Bytes for a
+monitored IP add to its entry. A new IP, with every entry taken, evicts
+the IP with the smallest count and inherits that count as its `error`.
+Every IP that carried more than total/capacity bytes is guaranteed to be
+monitored, and a monitored IP's true byte count lies in
+[count - error, count]. Upload and download are the bytes seen since the
+IP took its entry, so count = error + upload + download, and the counts
+of all entries add up to every byte seen.
+
+The agents feed it once per interval with the bytes per remote IP of that
+interval rather than per packet: weighted updates keep the same
+guarantees, and the packet path stays as it was.
+"""
+import heapq
+
+CAPACITY = 256
+
+
+class SpaceSaving:
+    """Top remote addresses by bytes in `capacity` entries.
+
+    Addresses are any hashable key: the Linux agent uses IPv4 ints, the
+    Windows agent strings.
+    """
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        self._entries = {}          # ip -> [upload, download, error]
+        # (count when pushed, ip) per entry. Counts only grow, so a heap
+        # entry never overstates its IP and is refreshed lazily on eviction.
+        self._heap    = []
+
+    def add(self, ip, up, down):
+        entry = self._entries.get(ip)
+        if entry is not None:
+            entry[0] += up
+            entry[1] += down
+            return
+        heap  = self._heap
+        error = 0
+        if len(self._entries) >= self.capacity:
+            while True:
+                count, victim = heap[0]
+                now = sum(self._entries[victim])
+                if now == count:
+                    break
+                heapq.heapreplace(heap, (now, victim))
+            del self._entries[victim]
+            heapq.heapreplace(heap, (count + up + down, ip))
+            error = count
+        else:
+            heapq.heappush(heap, (up + down, ip))
+        self._entries[ip] = [up, down, error]
+
+    def top(self, n):
+        """Top `n` entries and the bound on everything else.
+
+        Returns ([(ip, up, down, error)], total, floor): `total` is every
+        byte the sketch has seen and `floor` the most bytes any address not
+        in the list can have carried.
+        """
+        ranked = sorted(self._entries.items(), key=lambda kv: sum(kv[1]), reverse=True)
+        total  = sum(sum(e) for _, e in ranked)
+        if len(ranked) > n:
+            floor = sum(ranked[n - 1][1]) if n else sum(ranked[0][1])
+        elif len(ranked) >= self.capacity:
+            floor = sum(ranked[-1][1])
+        else:
+            floor = 0
+        return [(ip, up, down, error) for ip, (up, down, error) in ranked[:n]], total, floor
+
+    def __len__(self):
+        return len(self._entries)
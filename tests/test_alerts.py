@@ -0,0 +1,90 @@
+"""Alert table change cursor, and the master re-sending alerts only on change."""
+import importlib.util
+import pathlib
+import sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+MAC  = "02:00:00:00:00:01"
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+alerts = _load("master_alerts", "Backend/alerts.py")
+
+
+def test_detail_is_stored_but_not_a_change():
+    table  = alerts.Table()
+    fields = {"severity": "high", "message": "x.com accessed"}
+    opened = table.update(MAC, "blacklist", {"x.com": fields}, now=1, detail={"x.com": {"bytes": 10}})
+    assert [r["bytes"] for r in opened] == [10]
+    cursor = table.cursor()
+
+    assert table.update(MAC, "blacklist", {"x.com": fields}, now=2, detail={"x.com": {"bytes": 99}}) == []
+    assert table.changes(cursor) == (False, [])
+    assert table.open(MAC)[0]["bytes"] == 99
+
+    table.update(MAC, "blacklist", {"x.com": {**fields, "severity": "low"}}, now=3)
+    table.update(MAC, "blacklist", {}, now=4)
+    reset, changed = table.changes(cursor)
+    assert not reset
+    assert [(r["severity"], r["resolved_at"]) for r in changed] == [("low", 4)]
+
+
+def test_resolved_alerts_pruned_past_cursor_force_reset():
+    table = alerts.Table(keep=10)
+    table.update(MAC, "inactive", {None: {"severity": "low", "message": "Agent not reporting"}}, now=0)
+    cursor = table.cursor()
+    table.update(MAC, "inactive", {}, now=1)
+    table.prune(now=100)
+    assert table.changes(cursor) == (True, [])
+    assert table.changes(table.cursor()) == (False, [])
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """Backend/server.py run from an empty folder (default config, no MACs)."""
+    mp = pytest.MonkeyPatch()
+    mp.chdir(tmp_path_factory.mktemp("master"))
+    mp.syspath_prepend(str(ROOT / "Backend"))
+    for name in ("alerts", "blacklist", "history", "store", "stream", "wire"):
+        sys.modules.pop(name, None)
+    yield _load("master_server", "Backend/server.py")
+    mp.undo()
+
+
+def _report(ts, total):
+    return {
+        "name": "host", "username": "user", "ip": "10.0.0.2", "os": "Linux",
+        "state": "sending", "mac": MAC, "timestamp": ts,
+        "usage":       {"upload": 10.0, "download": 10.0},
+        "total_usage": {"upload": total, "download": total},
+        "process": [], "dns": [], "domains": [],
+    }
+
+
+def _apply(server, raw):
+    mac, dns, ts = server._prepare(raw)
+    with server.lock:
+        return server._ingest(mac, raw, dns, ts)
+
+
+def test_growing_usage_does_not_resend_open_alert(server):
+    client = server.app.test_client()
+    limit  = server.config["total_usage_limit"]
+
+    assert _apply(server, _report(1700000000, limit)) == "ok"
+    first = client.get("/alerts?since=").get_json()
+    assert [a["type"] for a in first["changes"]] == ["high_usage"]
+
+    assert _apply(server, _report(1700000005, limit + 1024 * 1024)) == "ok"
+    again = client.get(f"/alerts?since={first['cursor']}").get_json()
+    assert again["reset"] is False
+    assert again["changes"] == []
+    assert client.get("/alerts").get_json()["alerts"][0]["total_usage_MB"] > \
+        first["changes"][0]["total_usage_MB"]
@@ -0,0 +1,30 @@
+"""DNS answer parsing of the Linux agent's capture backends."""
+import importlib.util
+import pathlib
+import struct
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+capture = _load("agent_capture", "LinuxAgent/capture.py")
+
+
+def _response(*answers):
+    name = b"\x07example\x03com\x00"
+    msg  = struct.pack("!HHHHHH", 1, 0x8180, 1, len(answers), 0, 0) + name + struct.pack("!HH", 1, 1)
+    for rtype, rdata in answers:
+        msg += b"\xc0\x0c" + struct.pack("!HHIH", rtype, 1, 60, len(rdata)) + rdata
+    return msg
+
+
+def test_only_ipv4_answers_are_learned():
+    msg = _response((28, bytes(15) + b"\x01"), (1, bytes((93, 184, 216, 34))))
+    qname, pos = capture.dns_question(msg, 0, len(msg))
+    assert qname == "example.com"
+    assert capture.dns_answers(msg, 0, len(msg), pos) == [(0x5DB8D822, 60)]
@@ -0,0 +1,52 @@
+"""Agents' lifetime totals checkpoint: two CRC-checked copies in one mmap."""
+import importlib.util
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+checkpoint = _load("common_checkpoint", "common/checkpoint.py")
+
+
+def test_restart_restores_newest_save_and_bumps_epoch(tmp_path):
+    path = str(tmp_path / "agent.state")
+    cp = checkpoint.Checkpoint(path)
+    assert not cp.restored and cp.epoch == 1
+    cp.save((1, 2), procs={"a": (3, 4)})
+    cp.save((5, 6), procs={"a": (7, 8)}, domains={"x.com": (9, 10)})
+    cp.close()
+
+    cp = checkpoint.Checkpoint(path)
+    assert cp.restored and cp.epoch == 2
+    assert cp.total == (5, 6)
+    assert cp.saved == {"procs": {"a": (7, 8)}, "domains": {"x.com": (9, 10)}}
+    cp.close()
+
+
+def test_torn_write_falls_back_to_the_other_copy(tmp_path):
+    path = str(tmp_path / "agent.state")
+    cp = checkpoint.Checkpoint(path)
+    cp.save((1, 2), procs={"a": (3, 4)})
+    cp.save((5, 6), procs={"a": (7, 8)})
+    base = (cp.generation % 2) * cp.size
+    cp.map[base + 100] ^= 0xFF              # the newer copy, half written
+    cp.close()
+
+    cp = checkpoint.Checkpoint(path)
+    assert cp.total == (1, 2)
+    assert cp.saved["procs"] == {"a": (3, 4)}
+    cp.close()
+
+
+def test_merged_adds_restored_totals():
+    snap = {"a": {"upload": 1, "download": 2}}
+    assert checkpoint.merged(snap, {"a": (10, 20), "b": (5, 5)}) == {
+        "a": {"upload": 11, "download": 22},
+        "b": {"upload": 5, "download": 5},
+    }
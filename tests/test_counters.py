@@ -0,0 +1,47 @@
+"""Bounded per-name counters of the Linux agent: overflow and idle-slot reuse."""
+import importlib.util
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+counters = _load("agent_counters", "LinuxAgent/counters.py")
+
+
+def test_full_table_counts_new_names_as_overflow():
+    c = counters.PacketCounters(3, "other")
+    for name in ("a", "b", "c", "d"):
+        c.add_bytes(name, True, 10)
+    names, up, _, _, _ = c.snapshot()
+    assert len(names) == 3
+    assert dict(zip(names, up)) == {"a": 10, "b": 10, "other": 20}
+
+
+def test_without_overflow_names_past_capacity_are_not_counted():
+    c = counters.PacketCounters(1)
+    assert c.add_bytes("a", True, 10) == 0
+    assert c.add_bytes("b", True, 10) == -1
+
+
+def test_idle_slot_goes_to_a_new_name_and_counts_from_zero():
+    c = counters.PacketCounters(3, "other")
+    c.add_bytes("a", True, 100)
+    c.add_bytes("b", False, 50)
+    base = c.snapshot()
+
+    c.now = counters.IDLE_TIMEOUT + 1
+    c.add_bytes("b", False, 5)          # b stays busy, a went idle
+    slot = c.add_bytes("new", True, 7)
+    assert slot == 0 and c.names[slot] == "new"
+
+    assert counters.delta(c.snapshot(), base) == {
+        "b":   {"upload": 0, "download": 5},
+        "new": {"upload": 7, "download": 0},
+    }
+    assert "a" not in c.snapshot()[0]
@@ -0,0 +1,47 @@
+"""Master rate history: ring buckets, resolution choice and LTTB thinning."""
+import importlib.util
+import pathlib
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+history = _load("master_history", "Backend/history.py")
+
+
+def test_bucket_average_is_time_weighted():
+    ring = history.Ring(10, 4)
+    ring.add(1, 100, 0, 2)
+    ring.add(5, 400, 40, 6)
+    assert ring.points(0, 10) == [(0, 325.0, 30.0)]
+
+
+def test_ring_forgets_buckets_it_has_wrapped_past():
+    ring = history.Ring(10, 4)
+    for t in range(0, 80, 10):
+        ring.add(t, t, 0, 10)
+    ring.add(5, 999, 0, 10)                 # older than the ring keeps
+    assert [p[0] for p in ring.points(0, 80)] == [40, 50, 60, 70]
+
+
+def test_query_uses_the_finest_ring_reaching_back():
+    series = history.Series(((10, 6), (60, 10)))
+    for t in range(0, 300, 10):
+        series.add(t, 1, 1, 10)
+    assert series.query(250, 300)[0] == 10
+    assert series.query(0, 300)[0] == 60
+
+
+def test_lttb_keeps_endpoints_and_spike():
+    points = [(t, 10.0, 0.0) for t in range(100)]
+    points[37] = (37, 500.0, 0.0)
+    thinned = history.lttb(points, 10)
+    assert len(thinned) == 10
+    assert thinned[0] == points[0] and thinned[-1] == points[-1]
+    assert points[37] in thinned
+    assert history.lttb(points[:5], 10) == points[:5]
@@ -0,0 +1,43 @@
+"""Space-Saving sketch of remote endpoints: bounded size and error guarantees."""
+import importlib.util
+import pathlib
+import random
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+sketch = _load("common_sketch", "common/sketch.py")
+
+
+def test_heavy_hitters_survive_churn_within_error_bounds():
+    rng  = random.Random(7)
+    s    = sketch.SpaceSaving(16)
+    true = {}
+    for _ in range(5000):
+        ip    = rng.choice((1, 2, 3)) if rng.random() < 0.5 else rng.randrange(100, 10000)
+        up    = rng.randrange(1, 1500)
+        true[ip] = true.get(ip, 0) + up
+        s.add(ip, up, 0)
+    assert len(s) == 16
+
+    top, total, floor = s.top(3)
+    assert total == sum(true.values())
+    assert {ip for ip, *_ in top} == {1, 2, 3}
+    for ip, up, down, error in top:
+        assert up + down <= true[ip] <= up + down + error
+    assert max(b for ip, b in true.items() if ip not in (1, 2, 3)) <= floor
+
+
+def test_floor_is_zero_until_the_sketch_fills():
+    s = sketch.SpaceSaving(4)
+    s.add("10.0.0.1", 100, 50)
+    s.add("10.0.0.2", 10, 0)
+    assert s.top(5) == ([("10.0.0.1", 100, 50, 0), ("10.0.0.2", 10, 0, 0)], 160, 0)
+    s.clear()
+    assert s.top(5) == ([], 0, 0)
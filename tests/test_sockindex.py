@@ -0,0 +1,46 @@
+"""Port → PID index of the Linux agent: misses are queued, never resolved inline."""
+import importlib.util
+import pathlib
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+sockindex = _load("agent_sockindex", "LinuxAgent/sockindex.py")
+
+
+def test_request_never_reads_procfs(monkeypatch):
+    def no_procfs(*args, **kwargs):
+        raise AssertionError("procfs read on the packet path")
+    monkeypatch.setattr(sockindex, "read_sockets", no_procfs)
+    monkeypatch.setattr(sockindex, "scan_fds", no_procfs)
+
+    index = sockindex.SocketIndex()
+    for _ in range(3):
+        index.request(sockindex.IPPROTO_TCP, 40000)
+    index.request(sockindex.IPPROTO_UDP, 40000)
+    assert list(index.wanted) == [(sockindex.IPPROTO_TCP, 40000), (sockindex.IPPROTO_UDP, 40000)]
+
+
+def test_refresh_answers_requests_and_lets_them_be_asked_again(monkeypatch):
+    monkeypatch.setattr(sockindex, "PROC_NET", {})
+    index = sockindex.SocketIndex()
+    index.request(sockindex.IPPROTO_TCP, 40000)
+    index.refresh()
+    assert not index.wanted
+    index.request(sockindex.IPPROTO_TCP, 40000)
+    assert list(index.wanted) == [(sockindex.IPPROTO_TCP, 40000)]
+
+
+def test_wait_ends_early_once_a_port_is_requested():
+    index = sockindex.SocketIndex()
+    index.request(sockindex.IPPROTO_TCP, 40000)
+    start = time.monotonic()
+    index.wait(5)
+    assert time.monotonic() - start < 1
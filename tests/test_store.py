@@ -0,0 +1,51 @@
+"""Master usage store: day partitions, compaction into hourly rows, queries."""
+import importlib.util
+import pathlib
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+MAC  = "02:00:00:00:00:01"
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+store = _load("master_store", "Backend/store.py")
+
+
+def _row(t, up, procs=(("firefox", 60, 6),)):
+    return (MAC, t, {"hostname": "host"}, up, up // 10, 5.0, list(procs))
+
+
+def test_days_go_to_their_own_partitions_and_compact_to_hours(tmp_path):
+    events = []
+    s  = store.Store(str(tmp_path / "usage.db"), raw_days=2,
+                     log=lambda event, **fields: events.append(event))
+    db = s.open_writer()
+    today = store.day_of(time.time()) * store.DAY
+    s.write(db, [_row(today + 100, 1000), _row(today - store.DAY + 100, 500),
+                 _row(today + 200, 1000)])
+    assert store._partitions(db) == [store.day_of(today) - 1, store.day_of(today)]
+
+    start, end = today - store.DAY, today + store.DAY
+    before = (s.agent_totals(start, end), s.process_totals(start, end))
+    assert before[0] == {MAC: (2500, 250)}
+    assert before[1] == {"firefox": (180, 18)}
+
+    s.compact(db, now=today + 3 * store.DAY)
+    assert store._partitions(db) == []
+    assert events == ["store_compacted", "store_compacted"]
+    assert (s.agent_totals(start, end), s.process_totals(start, end)) == before
+    assert s.agents()[MAC]["hostname"] == "host"
+
+
+def test_rows_older_than_raw_retention_go_straight_to_hours(tmp_path):
+    s  = store.Store(str(tmp_path / "usage.db"), raw_days=2)
+    db = s.open_writer()
+    old = (store.day_of(time.time()) - 5) * store.DAY + 7200
+    s.write(db, [_row(old, 700)])
+    assert store._partitions(db) == []
+    assert s.agent_totals(old - 3600, old + 3600) == {MAC: (700, 70)}
@@ -0,0 +1,91 @@
+"""Round trip of the binary /usage report: LinuxAgent encoder → Backend decoder."""
+import importlib.util
+import pathlib
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+
+def _load(name, path):
+    spec   = importlib.util.spec_from_file_location(name, ROOT / path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+agent_wire  = _load("agent_wire",  "LinuxAgent/wire.py")
+master_wire = _load("master_wire", "Backend/wire.py")
+
+
+def _report(total=1000, ts=1700000000):
+    return {
+        "name":        "host",
+        "username":    "user",
+        "ip":          "10.0.0.2",
+        "os":          "Linux",
+        "state":       "sending",
+        "mac":         "02:00:00:00:00:01",
+        "timestamp":   ts,
+        "usage":       {"upload": 12.5, "download": 300.25},
+        "total_usage": {"upload": total, "download": 2 * total},
+        "process": [
+            {"name": "firefox", "speed": {"upload": 1.5, "download": 200.0},
+             "total": {"upload": total // 2, "download": total}},
+            {"name": "ssh", "speed": {"upload": 0.25, "download": 0.5},
+             "total": {"upload": 10, "download": 20}},
+        ],
+        "dns":     ["example.com"],
+        "domains": [
+            {"name": "example.com", "speed": {"upload": 1.0, "download": 2.0},
+             "total": {"upload": 100, "download": 200}},
+        ],
+        "flows": [
+            {"proto": "tcp", "local_port": 51000, "remote_ip": "93.184.216.34",
+             "remote_port": 443, "process": "firefox",
+             "speed": {"upload": 1.5, "download": 200.0},
+             "total": {"upload": 150, "download": 20000}},
+            {"proto": "udp", "local_port": 40000, "remote_ip": "1.1.1.1",
+             "remote_port": 53, "process": "systemd-resolved",
+             "speed": {"upload": 0.1, "download": 0.2},
+             "total": {"upload": 10, "download": 20}},
+        ],
+    }
+
+
+def test_round_trip_with_flows():
+    encoder, sessions = agent_wire.ReportEncoder(), {}
+    sent = _report()
+    seq, got, session = master_wire.decode_report(encoder.encode(sent), sessions)
+    sessions[got["mac"]] = session
+
+    assert seq == 1
+    assert got["process"] == sent["process"]
+    assert got["flows"]   == sent["flows"]
+    assert got["domains"] == sent["domains"]
+    for key in ("name", "username", "ip", "os", "state", "mac", "timestamp",
+                "usage", "total_usage", "dns"):
+        assert got[key] == sent[key]
+
+
+def test_delta_after_ack():
+    encoder, sessions = agent_wire.ReportEncoder(), {}
+    seq, got, session = master_wire.decode_report(encoder.encode(_report()), sessions)
+    sessions[got["mac"]] = session
+    encoder.ack(seq)
+
+    sent = _report(total=5000, ts=1700000005)
+    seq, got, session = master_wire.decode_report(encoder.encode(sent), sessions)
+    sessions[got["mac"]] = session
+
+    assert seq == 2
+    assert got["name"]        == "host"
+    assert got["total_usage"] == sent["total_usage"]
+    assert got["process"]     == sent["process"]
+    assert got["flows"]       == sent["flows"]
+
+
+def test_negative_unsigned_field_is_rejected():
+    report = _report()
+    report["domains"][0]["total"]["upload"] = -3
+    with pytest.raises(ValueError, match="negative value -3"):
+        agent_wire.ReportEncoder().encode(report)